@@ -3,19 +3,48 @@ import sys
 from colorama import init, Fore, Style
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import TELEGRAM_BOT_TOKEN
+from config import (
+    TELEGRAM_BOT_TOKEN, INSTA_DOWNLOAD_DIR, INSTA_DOWNLOAD_DIR_MAX_MB, INSTA_DOWNLOAD_MAX_AGE, WEBHOOK_URL, WEBHOOK_SECRET,
+    BOT_MAX_CONCURRENT_UPDATES, BOT_ROLE, WORKER_INDEX, WORKER_COUNT, FLUX_WEBHOOK_URL, FLUX_WEBHOOK_SECRET,
+)
+from utils.settings import REDIS_SENTINEL_HOSTS
+from utils.redis_client import RedisClient
+from utils.usage_ledger import UsageLedger
+from utils.image_pipeline import ImagePipeline
+from utils.vision_cache import VisionCache
+from utils.image_cache import ImageCache
+from utils.insta_cache import InstaCache
+from utils.disk_janitor import DiskJanitor
+from utils.video_transcoder import VideoTranscoder
+from utils.session_refresher import IgSessionRefresher
+from utils.send_scheduler import SendScheduler
+from utils.webhook_server import run_webhook
+from utils.bot_api import create_session
+from utils.update_dedupe import UpdateDedupe
+from utils.update_stream import UpdateStream, UpdateWorker, worker_shards
 from managers.session_manager import SessionManager
 from managers.subscription_manager import SubscriptionManager
+from managers.shadow_manager import ShadowManager
+from managers.insta_job_manager import InstaJobManager
+from managers.ig_account_pool import IgAccountPool
 from clients.openai_client import OpenAIClient
 from clients.claude_client import ClaudeClient
 from clients.gemini_client import GeminiClient
 from clients.grok_client import GrokClient
 from clients.flux_client import FluxClient
 from clients.instaloader import InstaloaderClient
+from clients.ig_client import IgClient
+from clients.segmented_downloader import SegmentedDownloader
+from utils.session_store import IgSessionStore
 from routers import commands_router, messages_router, media_router
 from middlewares.subscription import SubscriptionMiddleware
 from middlewares.logging import LoggingMiddleware
 from middlewares.dependencies import DependencyMiddleware
+from middlewares.usage import UsageContextMiddleware
+from middlewares.flood_control import FloodControlMiddleware
+from middlewares.concurrency import ConcurrencyLimitMiddleware
+from middlewares.dedupe import UpdateDedupeMiddleware
+from middlewares.update_stream import UpdatePublishMiddleware
 from utils.logging_config import logger
 
 # Initialize colorama for colored terminal output
@@ -29,17 +58,56 @@ async def main():
         print(f"\nExample: {Fore.CYAN}export TG_BOT_TOKEN='your_token_here'{Style.RESET_ALL}")
         print()
         sys.exit(1)
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        print(f"\n{Fore.RED}ERROR: {Style.BRIGHT}WEBHOOK_SECRET is required in webhook mode!{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}Telegram sends it with every update so forged requests can be rejected.{Style.RESET_ALL}")
+        print()
+        sys.exit(1)
+    if FLUX_WEBHOOK_URL and not FLUX_WEBHOOK_SECRET:
+        print(f"\n{Fore.RED}ERROR: {Style.BRIGHT}FLUX_WEBHOOK_SECRET is required when FLUX_WEBHOOK_URL is set!{Style.RESET_ALL}")
+        print(f"{Fore.YELLOW}Without it anyone could complete image generations with an arbitrary image URL.{Style.RESET_ALL}")
+        print()
+        sys.exit(1)
+    if BOT_ROLE not in ("all", "ingress", "worker") or (BOT_ROLE != "all" and not REDIS_SENTINEL_HOSTS):
+        print(f"\n{Fore.RED}ERROR: {Style.BRIGHT}BOT_ROLE must be all, ingress or worker; the last two need Redis!{Style.RESET_ALL}")
+        print()
+        sys.exit(1)
 
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    # A self-hosted Bot API server when TELEGRAM_API_URL is set
+    bot = Bot(token=TELEGRAM_BOT_TOKEN, session=create_session())
+    # All outgoing messages are paced below Telegram's flood limits
+    bot.session.middleware(FloodControlMiddleware(SendScheduler()))
     dp = Dispatcher(storage=MemoryStorage())
-    session_manager = SessionManager()
+    # Redis is optional; features fall back to in-process state without it
+    redis = RedisClient().get_master() if REDIS_SENTINEL_HOSTS else None
+    usage_ledger = UsageLedger(redis)
+    # In process; with BOT_ROLE=worker a user's updates always reach the same worker
+    session_manager = SessionManager(usage_ledger)
     subscription_manager = SubscriptionManager()
     openai_client = OpenAIClient()
     claude_client = ClaudeClient()
     gemini_client = GeminiClient()
     grok_client = GrokClient()
-    flux_client = FluxClient()
-    instaloader_client = InstaloaderClient()
+    # Flux callbacks are only served by the webhook server of a bot running all roles;
+    # anywhere else BFL would call a route nobody serves
+    flux_webhook_url = FLUX_WEBHOOK_URL if WEBHOOK_URL and BOT_ROLE == "all" else None
+    if FLUX_WEBHOOK_URL and not flux_webhook_url:
+        logger.warning("FLUX_WEBHOOK_URL is ignored: Flux callbacks are only served in webhook mode with BOT_ROLE=all")
+    flux_client = FluxClient(flux_webhook_url)
+    # Instagram accounts shared by the async client and instaloader; sessions load on first use
+    ig_pool = IgAccountPool(IgSessionStore(redis) if redis else None)
+    instaloader_client = InstaloaderClient(ig_pool)
+    ig_client = IgClient(ig_pool)
+    ig_refresher = IgSessionRefresher(ig_pool)
+    insta_jobs = InstaJobManager(instaloader_client)
+    insta_downloader = SegmentedDownloader()
+    insta_transcoder = VideoTranscoder()
+    insta_cache = InstaCache(redis)
+    insta_janitor = DiskJanitor(INSTA_DOWNLOAD_DIR, INSTA_DOWNLOAD_DIR_MAX_MB * 1024 * 1024, INSTA_DOWNLOAD_MAX_AGE)
+    shadow_manager = ShadowManager(openai_client, claude_client)
+    image_pipeline = ImagePipeline()
+    vision_cache = VisionCache(redis)
+    image_cache = ImageCache(redis)
 
     # Register dependencies
     dp["session_manager"] = session_manager
@@ -50,10 +118,30 @@ async def main():
     dp["grok_client"] = grok_client
     dp["flux_client"] = flux_client
     dp["instaloader_client"] = instaloader_client
+    dp["ig_client"] = ig_client
+    dp["insta_jobs"] = insta_jobs
+    dp["insta_cache"] = insta_cache
+    dp["insta_downloader"] = insta_downloader
+    dp["insta_transcoder"] = insta_transcoder
+    dp["shadow_manager"] = shadow_manager
+    dp["usage_ledger"] = usage_ledger
+    dp["image_pipeline"] = image_pipeline
+    dp["vision_cache"] = vision_cache
+    dp["image_cache"] = image_cache
 
     # Middlewares
+    update_stream = UpdateStream(redis) if BOT_ROLE != "all" else None
+    # Duplicates are dropped first, before they can take a concurrency slot. Workers
+    # get each update once from the stream; dedupe there would block crash recovery
+    if BOT_ROLE != "worker":
+        dp.update.outer_middleware(UpdateDedupeMiddleware(UpdateDedupe(redis)))
+    if BOT_ROLE == "ingress":
+        dp.update.outer_middleware(UpdatePublishMiddleware(update_stream))
+    elif WEBHOOK_URL:
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(BOT_MAX_CONCURRENT_UPDATES))
     dp.message.middleware(LoggingMiddleware())
     dp.message.middleware(SubscriptionMiddleware(subscription_manager))
+    dp.message.middleware(UsageContextMiddleware())
 
     # DependencyMiddleware - register dependencies
     dependency_middleware = DependencyMiddleware(
@@ -63,7 +151,17 @@ async def main():
         gemini_client=gemini_client,
         grok_client=grok_client,
         flux_client=flux_client,
-        instaloader_client=instaloader_client
+        instaloader_client=instaloader_client,
+        ig_client=ig_client,
+        insta_jobs=insta_jobs,
+        insta_cache=insta_cache,
+        insta_downloader=insta_downloader,
+        insta_transcoder=insta_transcoder,
+        shadow_manager=shadow_manager,
+        usage_ledger=usage_ledger,
+        image_pipeline=image_pipeline,
+        vision_cache=vision_cache,
+        image_cache=image_cache
     )
     dp.message.middleware(dependency_middleware)
 
@@ -74,7 +172,43 @@ async def main():
 
     print(f"\n{Fore.GREEN}Starting the bot...{Style.RESET_ALL}")
     logger.info("Starting the bot application")
-    await dp.start_polling(bot)
+    usage_ledger.start()
+    # The ingress only forwards updates; Instagram and shadow work happens where handlers run
+    if BOT_ROLE != "ingress":
+        shadow_manager.start()
+        insta_jobs.start()
+        insta_janitor.start()
+        ig_refresher.start()
+    try:
+        if BOT_ROLE == "worker":
+            worker = UpdateWorker(update_stream, dp, bot, worker_shards(WORKER_INDEX, WORKER_COUNT), f"worker-{WORKER_INDEX}")
+            try:
+                await worker.run()
+            finally:
+                await bot.session.close()
+        # The ingress publishes updates one after another: concurrently, a slower dedupe
+        # claim would let a user's later update enter the stream before an earlier one
+        elif WEBHOOK_URL:
+            await run_webhook(bot, dp, flux_client, background=BOT_ROLE != "ingress")
+        else:
+            # getUpdates is refused while a webhook is set, e.g. after switching modes
+            await bot.delete_webhook()
+            await dp.start_polling(
+                bot,
+                allowed_updates=dp.resolve_used_update_types(),
+                handle_as_tasks=BOT_ROLE != "ingress",
+                tasks_concurrency_limit=BOT_MAX_CONCURRENT_UPDATES,
+            )
+    finally:
+        await shadow_manager.stop()
+        await usage_ledger.stop()
+        await insta_jobs.stop()
+        await insta_janitor.stop()
+        await ig_refresher.stop()
+        image_pipeline.close()
+        await flux_client.close()
+        await ig_client.close()
+        await insta_downloader.close()
 
 if __name__ == "__main__":
     try:
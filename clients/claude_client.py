@@ -2,20 +2,22 @@ from contextlib import asynccontextmanager
 from typing import List, Dict, Any
 import anthropic
 from utils.logging_config import logger
-from config import ANTHROPIC_API_KEY, TELEGRAM_BOT_TOKEN
+from utils.limits import provider_semaphore
+from utils.image_pipeline import parse_data_url
+from config import ANTHROPIC_API_KEY
 
 class ClaudeClient:
     def __init__(self):
         self.api_key = ANTHROPIC_API_KEY
-        self.telegram_bot_token = TELEGRAM_BOT_TOKEN
 
     @asynccontextmanager
     async def get_client(self):
-        client = anthropic.AsyncAnthropic(api_key=self.api_key)
-        try:
-            yield client
-        finally:
-            pass
+        async with provider_semaphore("anthropic"):
+            client = anthropic.AsyncAnthropic(api_key=self.api_key)
+            try:
+                yield client
+            finally:
+                pass
 
     async def process_message(self, session: Any, user_message: str) -> str:
         # Use the updated Session class methods instead of direct list manipulation
@@ -35,20 +37,17 @@ class ClaudeClient:
         # Format the content as a list for Anthropic API
         message_blocks = []
 
-        # Add all image URLs to the content
+        # Add all images to the content, inline data URLs are sent as base64 sources
         for url in image_urls:
-            # Convert relative paths to full URLs for Telegram API
-            if not url.startswith(('http://', 'https://')):
-                full_url = f"https://api.telegram.org/file/bot{self.telegram_bot_token}/{url}"
-                logger.debug(f"Converting relative path to full URL: {url} -> {full_url}")
-                url = full_url
+            if url.startswith("data:"):
+                media_type, data = parse_data_url(url)
+                source = {"type": "base64", "media_type": media_type, "data": data}
+            else:
+                source = {"type": "url", "url": url}
 
             message_blocks.append({
                 "type": "image",
-                "source": {
-                    "type": "url",
-                    "url": url
-                }
+                "source": source
             })
 
         # Add the text content
@@ -73,7 +72,6 @@ class ClaudeClient:
 
         try:
             logger.info(f"Sending request to Anthropic API with {len(image_urls)} images")
-            logger.debug(f"Final image URLs: {[block['source']['url'] for block in message_blocks if block['type'] == 'image']}")
 
             # Get model from session
             model_to_use = session.get_model()
@@ -87,6 +85,7 @@ class ClaudeClient:
                 )
 
             reply = response.content[0].text
+            session.record_usage(response, images=len(image_urls))
 
             # Add the message to history
             messages.append({"role": "user", "content": user_message + " [with images]"})
@@ -1,54 +1,55 @@
-import aiohttp
-import asyncio
-from config import BFL_API_KEY, FLUX_MODEL
+import hmac
+from typing import Optional
+from aiohttp import web
+from config import BFL_API_KEY, FLUX_MODEL, FLUX_WEBHOOK_SECRET
+from clients.flux_scheduler import FluxScheduler
 from utils.logging_config import logger
 
 class FluxClient:
-    def __init__(self):
+    def __init__(self, webhook_url: Optional[str] = None):
         self.api_key = BFL_API_KEY
         self.model = FLUX_MODEL
+        self.image_model = FLUX_MODEL
+        self.width = 1024
+        self.height = 768
+        self.image_size = f"{self.width}x{self.height}"
         self.url = "https://api.bfl.ml/v1"
+        # BFL calls back on webhook_url; only pass it when handle_webhook is served there
+        self.scheduler = FluxScheduler(self.api_key, self.url, webhook_url)
+
+    async def close(self) -> None:
+        await self.scheduler.close()
 
     async def generate_image(self, prompt: str) -> str:
         endpoint = f"{self.url}/{self.model}"
         payload = {
             "prompt": prompt,
-            "width": 1024,
-            "height": 768,
+            "width": self.width,
+            "height": self.height,
             "prompt_upsampling": False,
             "safety_tolerance": 2,
             "output_format": "jpeg"
         }
-        headers = {
-            "Content-Type": "application/json",
-            "X-Key": self.api_key
-        }
-
-        async with aiohttp.ClientSession() as session:
-            try:
-                # Initial request to start generation
-                async with session.post(endpoint, json=payload, headers=headers) as response:
-                    response.raise_for_status()
-                    query_params = await response.json()
-                logger.info(f"Get task id: {query_params}")
 
-                # Poll until ready
-                get_url = f"{self.url}/get_result"
-                while True:
-                    async with session.get(get_url, params=query_params) as get_response:
-                        get_response.raise_for_status()
-                        result = await get_response.json()
-                        logger.info(f"Get result with image: {result}")
+        try:
+            return await self.scheduler.submit(endpoint, payload)
+        except Exception as e:
+            logger.error(f"Flux image generation failed: {e}")
+            raise
 
-                        if result["status"] == "Ready" and result["result"]:
-                            return result["result"]["sample"]
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        """aiohttp handler for BFL webhook callbacks"""
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
 
-                        # Add delay between polls to avoid hammering the server
-                        await asyncio.sleep(1)
+        # Unauthenticated callbacks could make the bot send any image URL
+        secret = request.headers.get("X-Webhook-Secret") or data.get("webhook_secret") or ""
+        if not FLUX_WEBHOOK_SECRET or not hmac.compare_digest(secret, FLUX_WEBHOOK_SECRET):
+            logger.warning("Rejected Flux webhook with invalid secret")
+            return web.Response(status=403)
 
-            except aiohttp.ClientError as e:
-                logger.error(f"HTTP request failed: {e}")
-                raise
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                raise
+        if not self.scheduler.handle_webhook(data):
+            logger.debug(f"Flux webhook for unknown job: {data.get('id')}")
+        return web.Response(status=200)
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+import aiohttp
+from config import FLUX_JOB_TIMEOUT, FLUX_MAX_CONCURRENT_JOBS, FLUX_POLL_MAX_INTERVAL, FLUX_WEBHOOK_SECRET
+from utils.logging_config import logger
+
+# Statuses after which polling a job is pointless
+FAILED_STATUSES = ("Error", "Request Moderated", "Content Moderated", "Task not found")
+MIN_POLL_INTERVAL = 0.5
+
+
+class FluxError(Exception):
+    pass
+
+
+@dataclass
+class FluxJob:
+    id: str
+    future: asyncio.Future
+    submitted_at: float
+    deadline: float
+    next_poll_at: float
+    polls: int = 0
+    polling_url: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class FluxScheduler:
+    """Track all in-flight Flux jobs and poll them from a single loop.
+
+    Polls are batched per tick over one shared HTTP session. The first poll of
+    a job is scheduled around the observed average generation time and later
+    polls back off exponentially. Every job has a deadline, and at most
+    FLUX_MAX_CONCURRENT_JOBS generations run at once. When a webhook URL is
+    given, BFL calls us back and polling only serves as a safety net.
+    """
+
+    def __init__(self, api_key: str, base_url: str, webhook_url: Optional[str] = None) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.webhook_url = webhook_url
+        self.jobs: Dict[str, FluxJob] = {}
+        self.avg_generation_time = 10.0
+        self._semaphore = asyncio.Semaphore(FLUX_MAX_CONCURRENT_JOBS)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", "X-Key": self.api_key}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=self.headers)
+        return self._session
+
+    async def close(self) -> None:
+        if self._poller:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def submit(self, endpoint: str, payload: Dict[str, Any]) -> str:
+        """Start a generation and wait for the resulting image URL"""
+        async with self._semaphore:
+            if self.webhook_url:
+                payload = dict(payload, webhook_url=self.webhook_url)
+                if FLUX_WEBHOOK_SECRET:
+                    payload["webhook_secret"] = FLUX_WEBHOOK_SECRET
+
+            async with self._get_session().post(endpoint, json=payload) as response:
+                response.raise_for_status()
+                task = await response.json()
+            logger.info(f"Get task id: {task}")
+
+            now = time.monotonic()
+            job = FluxJob(
+                id=task["id"],
+                future=asyncio.get_running_loop().create_future(),
+                submitted_at=now,
+                deadline=now + FLUX_JOB_TIMEOUT,
+                next_poll_at=now + self._first_poll_delay(),
+                polling_url=task.get("polling_url"),
+            )
+            self.jobs[job.id] = job
+            self._ensure_poller()
+            try:
+                return await job.future
+            finally:
+                self.jobs.pop(job.id, None)
+
+    def _first_poll_delay(self) -> float:
+        if self.webhook_url:
+            # The callback normally arrives first; poll late as a fallback only
+            return max(self.avg_generation_time * 2, FLUX_POLL_MAX_INTERVAL)
+        return max(MIN_POLL_INTERVAL, self.avg_generation_time * 0.8)
+
+    def _next_poll_delay(self, job: FluxJob) -> float:
+        return min(FLUX_POLL_MAX_INTERVAL, MIN_POLL_INTERVAL * (1.5 ** job.polls))
+
+    def _ensure_poller(self) -> None:
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+        self._wakeup.set()
+
+    async def _poll_loop(self) -> None:
+        while self.jobs:
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if now >= job.deadline and not job.future.done():
+                    logger.warning(f"Flux job {job.id} exceeded deadline of {FLUX_JOB_TIMEOUT}s")
+                    job.future.set_exception(FluxError("Image generation timed out"))
+
+            due = [job for job in self.jobs.values() if not job.future.done() and job.next_poll_at <= now]
+            if due:
+                # _poll handles its own errors; nothing may end the loop while jobs wait on it
+                await asyncio.gather(*(self._poll(job) for job in due), return_exceptions=True)
+
+            pending = [job for job in self.jobs.values() if not job.future.done()]
+            if not pending:
+                # Let waiters remove their finished jobs before checking again
+                await asyncio.sleep(0)
+                continue
+            wake_at = min(min(job.next_poll_at, job.deadline) for job in pending)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, wake_at - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: FluxJob) -> None:
+        job.polls += 1
+        try:
+            url = job.polling_url or f"{self.base_url}/get_result"
+            async with self._get_session().get(url, params={"id": job.id}) as response:
+                response.raise_for_status()
+                result = await response.json()
+            self._handle_result(job, result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Polling Flux job {job.id} failed: {e}")
+            job.next_poll_at = time.monotonic() + self._next_poll_delay(job)
+        except Exception as e:
+            # A malformed answer is retried like a failed request until the deadline
+            logger.error(f"Unexpected result polling Flux job {job.id}: {e}")
+            job.next_poll_at = time.monotonic() + self._next_poll_delay(job)
+
+    def _handle_result(self, job: FluxJob, result: Dict[str, Any]) -> None:
+        if job.future.done():
+            return
+        status = result.get("status")
+        logger.debug(f"Flux job {job.id} status: {status}")
+        sample = (result.get("result") or {}).get("sample")
+        if status == "Ready" and sample:
+            elapsed = time.monotonic() - job.submitted_at
+            self.avg_generation_time = 0.8 * self.avg_generation_time + 0.2 * elapsed
+            logger.info(f"Flux job {job.id} ready after {elapsed:.1f}s and {job.polls} polls")
+            job.future.set_result(sample)
+        elif status in FAILED_STATUSES:
+            job.future.set_exception(FluxError(f"Image generation failed: {status}"))
+        else:
+            job.next_poll_at = time.monotonic() + self._next_poll_delay(job)
+
+    def handle_webhook(self, data: Dict[str, Any]) -> bool:
+        """Resolve a job from a BFL webhook payload; returns False for unknown jobs"""
+        job = self.jobs.get(data.get("id") or data.get("task_id"))
+        if job is None:
+            return False
+        status = data.get("status")
+        # Webhook payloads report SUCCESS/FAILED while get_result reports Ready/Error
+        if status in ("SUCCESS", "Ready"):
+            data = dict(data, status="Ready")
+        elif status in ("FAILED", "ERROR"):
+            data = dict(data, status="Error")
+        self._handle_result(job, data)
+        self._wakeup.set()
+        return True
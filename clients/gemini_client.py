@@ -5,19 +5,20 @@ import os
 
 import google.generativeai as genai
 from utils.logging_config import logger
-from config import GEMINI_API_KEY, TELEGRAM_BOT_TOKEN
+from utils.limits import provider_semaphore
+from config import GEMINI_API_KEY
 
 
 class GeminiClient:
     def __init__(self):
         self.api_key = GEMINI_API_KEY
-        self.telegram_bot_token = TELEGRAM_BOT_TOKEN
         genai.configure(api_key=self.api_key)
 
     @asynccontextmanager
     async def get_client(self):
         # The google.generativeai library does not require a persistent client
-        yield genai
+        async with provider_semaphore("gemini"):
+            yield genai
 
     async def process_message(self, session: Any, user_message: str) -> str:
         try:
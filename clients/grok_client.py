@@ -3,19 +3,20 @@ from typing import Any, List
 
 from openai import AsyncOpenAI, OpenAIError, RateLimitError
 from utils.logging_config import logger
-from config import GROK_API_KEY, GROK_BASE_URL, TELEGRAM_BOT_TOKEN
+from utils.limits import provider_semaphore
+from config import GROK_API_KEY, GROK_BASE_URL
 
 
 class GrokClient:
     def __init__(self):
         self.api_key = GROK_API_KEY
         self.base_url = GROK_BASE_URL
-        self.telegram_bot_token = TELEGRAM_BOT_TOKEN
 
     @asynccontextmanager
     async def get_client(self):
-        async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
-            yield client
+        async with provider_semaphore("grok"):
+            async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+                yield client
 
     async def process_message(self, session: Any, user_message: str) -> str:
         try:
@@ -1,80 +1,196 @@
-import asyncio
+import json
 import httpx
 import instaloader
-from typing import Any, Dict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 
-from utils.settings import IG_USERNAME, IG_PASSWORD, IG_LOGIN_TIMEOUT_SEC
-from utils.session_store import IgSessionStore
+from managers.ig_session_manager import IgSessionManager, IgCheckpointRequired
+from managers.ig_account_pool import IgAccountPool, IgNoAccountAvailable, is_account_failure
+from utils.settings import IG_HTTP_MAX_CONNECTIONS, IG_HTTP_TIMEOUT_SEC
 from utils.logging_config import logger
 
+# HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 without it
+try:
+    import h2  # noqa: F401
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+# doc_id of the web GraphQL query resolving a shortcode to its media item
+SHORTCODE_DOC_ID = "27128499623469141"
+IG_APP_ID = "936619743392459"
+
+MEDIA_TYPES = {1: "image", 2: "video", 8: "carousel"}
+
+
+class IgError(Exception):
+    pass
+
+
+@dataclass
+class IgMedia:
+    shortcode: str
+    media_type: str  # image, video or carousel
+    video_url: Optional[str] = None
+    image_url: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[int] = None
+    product_type: Optional[str] = None  # "clips" for reels
+    id: Optional[str] = None
+    items: List["IgMedia"] = field(default_factory=list)  # carousel children
+
+    @property
+    def is_video(self) -> bool:
+        return self.media_type == "video" and bool(self.video_url)
+
+    @property
+    def url(self) -> Optional[str]:
+        return self.video_url if self.is_video else self.image_url
+
+
+def _largest(versions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return max(versions, key=lambda version: (version.get("width") or 0) * (version.get("height") or 0))
+
+
+def parse_media(shortcode: str, item: Dict[str, Any]) -> IgMedia:
+    """Build an IgMedia from an item of the shortcode web_info response"""
+    media_type = MEDIA_TYPES.get(item.get("media_type"), "image")
+    media = IgMedia(
+        shortcode=item.get("code") or shortcode,
+        media_type=media_type,
+        width=item.get("original_width"),
+        height=item.get("original_height"),
+        product_type=item.get("product_type"),
+        id=str(item["pk"]) if item.get("pk") else None,
+    )
+    candidates = (item.get("image_versions2") or {}).get("candidates") or []
+    if candidates:
+        media.image_url = _largest(candidates).get("url")
+    versions = item.get("video_versions") or []
+    if versions:
+        best = _largest(versions)
+        media.video_url = best.get("url")
+        media.width = best.get("width") or media.width
+        media.height = best.get("height") or media.height
+    if item.get("video_duration"):
+        media.duration = round(item["video_duration"])
+    media.items = [parse_media(media.shortcode, child) for child in item.get("carousel_media") or []]
+    return media
+
 
 class IgClient:
+    """Async Instagram client.
+
+    Every request leases an account from the IgAccountPool and runs with that
+    account's cookies. Each account gets its own light httpx client (its own
+    cookie jar), but all of them share one long-lived pooled HTTP/2 transport,
+    so connections are reused across accounts.
+    """
+
     GRAPHQL_URL = "https://www.instagram.com/graphql/query/"
 
-    def __init__(self, store: IgSessionStore):
-        self.store = store
-        self.loader = instaloader.Instaloader(
-            download_comments=False,
-            download_geotags=False,
-            download_pictures=False,
-            download_video_thumbnails=False,
-            save_metadata=False,
-        )
-        self.context = self.loader.context
-        self._loaded = False
-
-    async def ensure_session(self) -> None:
-        if self._loaded:
-            return
-        data = await self.store.get_session(IG_USERNAME)
-        if data:
-            self.context.load_session_from_dict(IG_USERNAME, data["cookies"])
-            await self.store.touch(IG_USERNAME)
-            self._loaded = True
-            return
-        lock = await self.store.acquire_lock()
-        try:
-            data = await self.store.get_session(IG_USERNAME)
-            if data:
-                self.context.load_session_from_dict(IG_USERNAME, data["cookies"])
-            else:
-                await self.login()
-        finally:
-            await lock.release()
-        self._loaded = True
-
-    async def login(self) -> None:
-        logger.info("Logging in to Instagram")
-
-        def _login() -> Dict[str, Any]:
-            self.loader.login(IG_USERNAME, IG_PASSWORD)
-            return self.context.save_session()
-
-        cookies = await asyncio.wait_for(
-            asyncio.to_thread(_login), timeout=IG_LOGIN_TIMEOUT_SEC
-        )
-
-        session_data = {
-            "sessionid": self.context._session.cookies.get("sessionid"),
-            "csrftoken": self.context._session.cookies.get("csrftoken"),
-            "ds_user_id": self.context._session.cookies.get("ds_user_id"),
-            "cookies": cookies,
-        }
-        await self.store.save_session(IG_USERNAME, session_data)
+    def __init__(self, pool: Optional[IgAccountPool] = None):
+        self.pool = pool or IgAccountPool()
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._cookie_versions: Dict[str, int] = {}
+
+    @property
+    def transport(self) -> httpx.AsyncBaseTransport:
+        if self._transport is None:
+            self._transport = httpx.AsyncHTTPTransport(
+                http2=_HAS_H2,
+                limits=httpx.Limits(
+                    max_connections=IG_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=IG_HTTP_MAX_CONNECTIONS,
+                ),
+            )
+        return self._transport
+
+    async def close(self) -> None:
+        # The clients hold nothing but cookies; the connections live in the transport
+        self._clients.clear()
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+    def client_for(self, sessions: IgSessionManager) -> httpx.AsyncClient:
+        """Return the HTTP client of an account, with its session cookies synced"""
+        client = self._clients.get(sessions.name)
+        if client is None:
+            client = httpx.AsyncClient(
+                transport=self.transport,
+                follow_redirects=True,
+                timeout=IG_HTTP_TIMEOUT_SEC,
+                headers={
+                    "User-Agent": instaloader.instaloadercontext.default_user_agent(),
+                    "X-IG-App-ID": IG_APP_ID,
+                    "Referer": "https://www.instagram.com/",
+                },
+            )
+            self._clients[sessions.name] = client
+        if self._cookie_versions.get(sessions.name) != sessions.version:
+            client.cookies.update(sessions.cookies)
+            self._cookie_versions[sessions.name] = sessions.version
+        return client
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request on a leased account, moving to another account once if this one is rejected"""
+        resp = None
+        last_error = ""
+        base_headers = kwargs.pop("headers", None) or {}
+        for _ in range(self.pool.attempts):
+            async with self.pool.lease() as sessions:
+                try:
+                    await sessions.ensure_session()
+                except IgCheckpointRequired as e:
+                    await self.pool.penalize(sessions, f"Checkpoint required: {e}")
+                    last_error = "Checkpoint required"
+                    continue
+                except Exception as e:
+                    raise IgError(f"Instagram login as {sessions.name} failed: {e}") from e
+                client = self.client_for(sessions)
+                headers = dict(base_headers)
+                if method == "POST":
+                    headers["X-CSRFToken"] = next(
+                        (cookie.value for cookie in client.cookies.jar if cookie.name == "csrftoken" and cookie.value), ""
+                    )
+                resp = await client.request(method, url, headers=headers, **kwargs)
+                if is_account_failure(resp.status_code):
+                    logger.warning(f"Received {resp.status_code} from Instagram for account {sessions.name}")
+                    await self.pool.penalize(sessions, resp.status_code)
+                    continue
+                await sessions.touch()
+                break
+        if resp is None:
+            raise IgError(f"No Instagram account could be used: {last_error}")
+        resp.raise_for_status()
+        return resp
 
     async def graphql(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        await self.ensure_session()
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            client.cookies.update(self.context._session.cookies.get_dict())
-            resp = await client.get(self.GRAPHQL_URL, params=params)
-            if resp.status_code in (401, 403):
-                logger.warning("Received %s from Instagram", resp.status_code)
-                await self.store.redis.delete(
-                    f"ig:session:{IG_USERNAME}"
-                )
-                self._loaded = False
-                await self.ensure_session()
-                resp = await client.get(self.GRAPHQL_URL, params=params)
-            await self.store.touch(IG_USERNAME)
-            resp.raise_for_status()
-            return resp.json()
+        resp = await self._request("GET", self.GRAPHQL_URL, params=params)
+        return resp.json()
+
+    async def get_media(self, shortcode: str) -> IgMedia:
+        """Resolve a shortcode to its media type, video URL and dimensions"""
+        variables = {
+            "shortcode": shortcode,
+            "__relay_internal__pv__PolarisAIGMMediaWebLabelEnabledrelayprovider": False,
+        }
+        data = {
+            "variables": json.dumps(variables, separators=(",", ":")),
+            "doc_id": SHORTCODE_DOC_ID,
+            "server_timestamps": "true",
+        }
+        try:
+            resp = await self._request("POST", self.GRAPHQL_URL, data=data)
+            payload = resp.json()
+        except (httpx.HTTPError, ValueError, IgNoAccountAvailable) as e:
+            raise IgError(f"Fetching post {shortcode} failed: {e}") from e
+
+        web_info = (payload.get("data") or {}).get("xdt_api__v1__media__shortcode__web_info") or {}
+        items = web_info.get("items")
+        if not items:
+            raise IgError(f"Post {shortcode} not found or not accessible")
+        return parse_media(shortcode, items[0])
@@ -1,195 +1,101 @@
+import asyncio
 import os
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional, Union
 import instaloader
+from config import INSTA_DOWNLOAD_DIR
+from clients.ig_client import IgMedia
+from managers.ig_session_manager import IgCheckpointRequired, CHECKPOINT_MESSAGE
+from managers.ig_account_pool import IgAccountPool, IgNoAccountAvailable, is_account_failure
+from utils.instagram import extract_shortcode
 from utils.logging_config import logger
-from pathlib import Path
 
-# Read credentials from environment to avoid import-time dependency on settings.py in Docker
-IG_USERNAME = os.getenv("IG_USERNAME")
-IG_PASSWORD = os.getenv("IG_PASSWORD")
-SESSION_FILE_ENV = os.getenv("INSTALOADER_SESSION_FILE")
-IG_SESSIONID = os.getenv("IG_SESSIONID")
-IG_CSRFTOKEN = os.getenv("IG_CSRFTOKEN")
-IG_DS_USER_ID = os.getenv("IG_DS_USER_ID")
-
-# Optional Redis-backed session store
-try:
-    from utils.redis_client import RedisClient  # lazy optional import
-    from utils.session_store import IgSessionStore
-    _HAS_REDIS = True
-except Exception:
-    _HAS_REDIS = False
 
 class InstaloaderClient:
-    def __init__(self):
-        self.loader = instaloader.Instaloader(
-            download_comments=False,
-            download_geotags=False,
-            download_pictures=False,
-            download_video_thumbnails=False,
-            save_metadata=False
-        )
-        self._logged_in = False
-        # Prefer user-provided session file if set, otherwise fallback to project-local
-        if SESSION_FILE_ENV:
-            self._session_file = SESSION_FILE_ENV
-        else:
-            self._session_file = f".instaloader_session_{IG_USERNAME}" if IG_USERNAME else None
-        # Try to load cookies from Redis or environment (no interactive login required)
-        self._try_load_redis_cookies()
-        self._try_load_env_cookies()
-        # Do NOT auto-login on startup; defer until needed to avoid crashing the bot
+    """Blocking instaloader actions on top of the shared IgAccountPool.
 
-    def _apply_cookies_to_context(self, cookies: dict) -> None:
-        try:
-            jar = self.loader.context._session.cookies
-            for name, value in cookies.items():
-                if value is None:
-                    continue
-                jar.set(name, value, domain=".instagram.com", path="/")
-            self._logged_in = True
-        except Exception as e:
-            logger.warning(f"Failed to apply cookies to Instaloader context: {e}")
+    download_video and get_media block and must run on a worker thread
+    with the instaloader of a leased account; call() leases the account, loads
+    its session asynchronously and moves to another account once when
+    Instagram rejects the first one.
+    """
 
-    def _try_load_redis_cookies(self) -> None:
-        if not _HAS_REDIS or not IG_USERNAME:
-            return
-        try:
-            redis = RedisClient().get_master()
-            store = IgSessionStore(redis)
-            # IgSessionStore stores a dict with keys: sessionid, csrftoken, ds_user_id, cookies
-            # We prefer explicit cookie values and fallback to cookies dict
-            import asyncio
-            async def _fetch():
-                return await store.get_session(IG_USERNAME)
-            data = asyncio.get_event_loop().run_until_complete(_fetch())
-            if data and isinstance(data, dict):
-                cookies = {
-                    "sessionid": data.get("sessionid"),
-                    "csrftoken": data.get("csrftoken"),
-                    "ds_user_id": data.get("ds_user_id"),
-                }
-                # If full cookies dict is present, merge
-                if isinstance(data.get("cookies"), dict):
-                    cookies.update(data["cookies"])
-                self._apply_cookies_to_context(cookies)
-                if self._logged_in:
-                    logger.info("Loaded Instagram cookies from Redis session store. Skipping login.")
-        except Exception as e:
-            logger.warning(f"Failed to load IG cookies from Redis: {e}")
+    def __init__(self, pool: Optional[IgAccountPool] = None):
+        self.pool = pool or IgAccountPool()
 
-    def _try_load_env_cookies(self) -> None:
-        if IG_SESSIONID:
-            try:
-                cookies = {
-                    "sessionid": IG_SESSIONID,
-                    "csrftoken": IG_CSRFTOKEN,
-                    "ds_user_id": IG_DS_USER_ID,
-                }
-                self._apply_cookies_to_context(cookies)
-                if self._logged_in:
-                    logger.info("Loaded Instagram cookies from environment. Skipping login.")
-            except Exception as e:
-                logger.warning(f"Failed to apply IG cookies from env: {e}")
+    def download_video(self, url: str, loader: instaloader.Instaloader) -> tuple[bool, str]:
+        """Download the video of a post to disk; returns (ok, file path or error)"""
+        shortcode = extract_shortcode(url)
+        if not shortcode:
+            return False, "Could not find an Instagram post in this URL"
+        post = instaloader.Post.from_shortcode(loader.context, shortcode)
+        if not post.is_video:
+            return False, "This post does not contain a video"
 
-    def _ensure_login(self) -> None:
-        if self._logged_in:
-            return
-        if not IG_USERNAME or not IG_PASSWORD:
-            logger.warning("IG credentials are not set (IG_USERNAME/IG_PASSWORD). Proceeding unauthenticated.")
-            return
-        # Try to load a persisted session first
-        try:
-            if self._session_file and Path(self._session_file).exists():
-                logger.info(f"Loading Instagram session from file: {self._session_file}")
-                self.loader.load_session_from_file(IG_USERNAME, filename=self._session_file)
-                self._logged_in = True
-                return
-            else:
-                # Try default session file path used by Instaloader CLI
-                try:
-                    logger.info("Trying to load default Instaloader session file")
-                    self.loader.load_session_from_file(IG_USERNAME)
-                    self._logged_in = True
-                    return
-                except Exception as e2:
-                    logger.info(f"Default session load failed, will try fresh login: {e2}")
-        except Exception as e:
-            logger.warning(f"Failed to load saved IG session file, will try login: {e}")
-        # Fallback to fresh login
-        logger.info("Logging in to Instagram via Instaloader")
-        self.loader.login(IG_USERNAME, IG_PASSWORD)
-        # Persist session to file for reuse
-        try:
-            if self._session_file:
-                self.loader.save_session_to_file(filename=self._session_file)
-                logger.info(f"Saved Instagram session to file: {self._session_file}")
-        except Exception as e:
-            logger.warning(f"Failed to save IG session file: {e}")
-        self._logged_in = True
+        video_url = post.video_url
+        extension = video_url.split('?')[0].split('.')[-1] if video_url else 'mp4'
+        filename = os.path.join(INSTA_DOWNLOAD_DIR, shortcode, f"{post.date_utc.strftime('%Y-%m-%d_%H-%M-%S')}_UTC.{extension}")
 
-    def download_video(self, url: str) -> tuple[bool, str]:
-        if not url:
-            return False, "Invalid URL provided"
+        logger.info(f"Downloading video to {filename}")
+        loader.download_post(post, target=shortcode)
 
-        # Ensure we are authenticated before attempting to access post data
-        try:
-            self._ensure_login()
-        except Exception as e:
-            # If a checkpoint is required or any login-side error occurs, surface a friendly message
-            msg = str(e)
-            if "Checkpoint required" in msg:
-                return False, (
-                    "Instagram requires verification (checkpoint). "
-                    "Open the challenge URL from logs in a browser, complete the steps, and retry."
-                )
-            logger.warning(f"Proceeding without IG login due to error: {e}")
+        if os.path.exists(filename):
+            return True, filename
+        else:
+            return False, "no file exists"
 
-        def _do_download() -> tuple[bool, str]:
-            shortcode = url.split('/')[-2]
-            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
-            if not post.is_video:
-                return False, "This post does not contain a video"
+    def get_media(self, url: str, loader: instaloader.Instaloader) -> tuple[bool, Union[IgMedia, str]]:
+        """Resolve the CDN URLs of a post (or of every carousel item) without downloading it"""
+        shortcode = extract_shortcode(url)
+        if not shortcode:
+            return False, "Could not find an Instagram post in this URL"
+        post = instaloader.Post.from_shortcode(loader.context, shortcode)
+        if post.typename == "GraphSidecar":
+            items = [
+                IgMedia(shortcode=shortcode, media_type="video" if node.is_video else "image",
+                        video_url=node.video_url, image_url=node.display_url)
+                for node in post.get_sidecar_nodes()
+            ]
+            return True, IgMedia(shortcode=shortcode, media_type="carousel", image_url=post.url, items=items)
+        if post.is_video:
+            duration = round(post.video_duration) if post.video_duration else None
+            return True, IgMedia(shortcode=shortcode, media_type="video", video_url=post.video_url, image_url=post.url,
+                                 duration=duration)
+        return True, IgMedia(shortcode=shortcode, media_type="image", image_url=post.url)
 
-            video_url = post.video_url
-            extension = video_url.split('?')[0].split('.')[-1] if video_url else 'mp4'
-            filename = f"{shortcode}/{post.date_utc.strftime('%Y-%m-%d_%H-%M-%S')}_UTC.{extension}"
+    async def call(self, executor: Optional[Executor], action: Callable[[str, instaloader.Instaloader], tuple[bool, Any]],
+                   url: str) -> tuple[bool, Any]:
+        """Run a blocking post action on the executor with a leased account"""
+        if not url:
+            return False, "Invalid URL provided"
 
-            logger.info(f"Downloading video to {filename}")
-            self.loader.download_post(post, target=shortcode)
+        loop = asyncio.get_running_loop()
+        last_error = ""
+        for _ in range(self.pool.attempts):
+            try:
+                async with self.pool.lease() as sessions:
+                    try:
+                        await sessions.ensure_session()
+                    except IgCheckpointRequired as e:
+                        await self.pool.penalize(sessions, f"Checkpoint required: {e}")
+                        last_error = "Checkpoint required"
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Proceeding without IG login due to error: {e}")
 
-            if os.path.exists(filename):
-                return True, filename
-            else:
-                return False, "no file exists"
+                    try:
+                        return await loop.run_in_executor(executor, action, url, sessions.loader)
+                    except Exception as e:
+                        last_error = str(e)
+                        if not is_account_failure(last_error):
+                            logger.error(f'Something went wrong while downloading video: {e}')
+                            return False, f"Failed to download video: {last_error}"
+                        # Rest this account and retry once on another one
+                        await self.pool.penalize(sessions, last_error)
+            except IgNoAccountAvailable:
+                return False, "All Instagram accounts are busy, please try again in a few minutes"
 
-        try:
-            return _do_download()
-        except Exception as e:
-            msg = str(e)
-            logger.warning(f"Download failed on first attempt: {msg}")
-            if any(err in msg for err in ["401", "403", "Please wait a few minutes", "Checkpoint required"]):
-                # Clear persisted session and re-login once
-                try:
-                    if self._session_file and Path(self._session_file).exists():
-                        Path(self._session_file).unlink(missing_ok=True)
-                        logger.info("Removed stale IG session file. Re-authenticating...")
-                except Exception as del_err:
-                    logger.warning(f"Failed to remove session file: {del_err}")
-                self._logged_in = False
-                try:
-                    # Try Redis/env cookies again before login
-                    self._try_load_redis_cookies()
-                    self._try_load_env_cookies()
-                    if not self._logged_in:
-                        self._ensure_login()
-                    return _do_download()
-                except Exception as e2:
-                    if "Checkpoint required" in str(e2):
-                        return False, (
-                            "Instagram requires verification (checkpoint). "
-                            "Open the challenge URL from logs in a browser, complete the steps, and retry."
-                        )
-                    logger.error(f"Retry after re-login failed: {e2}")
-                    return False, f"Failed to download video after re-login: {e2}"
-            logger.error(f'Something went wrong while downloading video: {e}')
-            return False, f"Failed to download video: {msg}"
+        if "Checkpoint required" in last_error:
+            return False, CHECKPOINT_MESSAGE
+        logger.error(f"Retry on another account failed: {last_error}")
+        return False, f"Failed to download video: {last_error}"
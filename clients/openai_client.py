@@ -1,18 +1,23 @@
+import asyncio
+import base64
 from contextlib import asynccontextmanager
 from typing import List, Dict, Any
 from openai import AsyncOpenAI, OpenAIError, RateLimitError
 from utils.logging_config import logger
-from config import OPENAI_API_KEY, TELEGRAM_BOT_TOKEN
+from utils.limits import provider_semaphore
+from config import OPENAI_API_KEY
 
 class OpenAIClient:
     def __init__(self):
         self.api_key = OPENAI_API_KEY
-        self.telegram_bot_token = TELEGRAM_BOT_TOKEN
+        self.image_model = "gpt-image-1"
+        self.image_size = "1024x1024"
 
     @asynccontextmanager
-    async def get_client(self):
-        async with AsyncOpenAI(api_key=self.api_key) as client:
-            yield client
+    async def get_client(self, limiter: str = "openai"):
+        async with provider_semaphore(limiter):
+            async with AsyncOpenAI(api_key=self.api_key) as client:
+                yield client
 
     async def process_message(self, session: Any, user_message: str) -> str:
         try:
@@ -36,15 +41,8 @@ class OpenAIClient:
         # Format the content as a list with text and images
         message_content = [{"type": "text", "text": user_message}]
 
-        # Add all image URLs to the content
+        # Images arrive as inline data URLs prepared by the image pipeline
         for url in image_urls:
-            # Telegram file paths need to be converted to full URLs that are accessible from outside
-            # For Telegram Bot API, we need to add the base URL
-            if not url.startswith(('http://', 'https://')):
-                full_url = f"https://api.telegram.org/file/bot{self.telegram_bot_token}/{url}"
-                logger.debug(f"Converting relative path to full URL: {url} -> {full_url}")
-                url = full_url
-
             message_content.append({
                 "type": "image_url",
                 "image_url": {
@@ -62,7 +60,6 @@ class OpenAIClient:
 
         try:
             logger.info(f"Sending request to OpenAI Vision API with {len(image_urls)} images using model {model_to_use}")
-            logger.debug(f"Final image URLs: {[item['image_url']['url'] for item in message_content if 'image_url' in item]}")
 
             # Get messages from session
             messages = session.data.get('messages', [])
@@ -85,6 +82,7 @@ class OpenAIClient:
                     messages=history_messages
                 )
             reply = response.choices[0].message.content.strip()
+            session.record_usage(response, images=len(image_urls), model=model_to_use)
 
             # Add messages to history (only storing the text part)
             messages.append({"role": "user", "content": user_message + " [with images]"})
@@ -116,17 +114,16 @@ class OpenAIClient:
         """
         logger.info(f"Generating image with OpenAI: {prompt}")
         try:
-            async with self.get_client() as client:
+            async with self.get_client("openai-image") as client:
                 response = await client.images.generate(
-                    model="gpt-image-1",
+                    model=self.image_model,
                     prompt=prompt,
-                    size="1024x1024",
+                    size=self.image_size,
                     quality="medium",
                     n=1
                 )
-            # Return the base64 encoded image
-            import base64
-            return base64.b64decode(response.data[0].b64_json)
+            # Decode off the event loop, images are several megabytes of base64
+            return await asyncio.to_thread(base64.b64decode, response.data[0].b64_json)
         except Exception as e:
             logger.error(f"Error generating image with OpenAI: {e}")
             raise
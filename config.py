@@ -45,3 +45,120 @@ OPENAI_ALLOWED_MODELS = [model.strip() for model in OPENAI_ALLOWED_MODELS if mod
 ANTHROPIC_ALLOWED_MODELS = [model.strip() for model in ANTHROPIC_ALLOWED_MODELS if model.strip()]
 GEMINI_ALLOWED_MODELS = [model.strip() for model in GEMINI_ALLOWED_MODELS if model.strip()]
 GROK_ALLOWED_MODELS = [model.strip() for model in GROK_ALLOWED_MODELS if model.strip()]
+
+# Maximum number of concurrent API calls per provider
+PROVIDER_MAX_CONCURRENCY = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+    "anthropic": int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "8")),
+    "gemini": int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    "grok": int(os.getenv("GROK_MAX_CONCURRENCY", "4")),
+    # Image generations take 10-30 s; they get their own limit so they can't starve chat calls
+    "openai-image": int(os.getenv("OPENAI_IMAGE_MAX_CONCURRENCY", "2")),
+}
+
+# Shadow traffic: mirror a sample of text turns to candidate models for offline comparison
+SHADOW_OPENAI_MODEL = os.getenv("SHADOW_OPENAI_MODEL")
+SHADOW_ANTHROPIC_MODEL = os.getenv("SHADOW_ANTHROPIC_MODEL")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0"))
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "100"))
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "2"))
+SHADOW_LOG_PATH = os.getenv("SHADOW_LOG_PATH", "shadow_log.jsonl")
+SHADOW_LOG_MAX_CHARS = int(os.getenv("SHADOW_LOG_MAX_CHARS", "2000"))
+
+# Token usage accounting
+ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()]
+USAGE_FLUSH_INTERVAL = int(os.getenv("USAGE_FLUSH_INTERVAL", "10"))  # seconds
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", "90"))
+
+# Vision image pipeline
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Vision answer cache keyed by Telegram file_unique_id
+VISION_CACHE_SIZE = int(os.getenv("VISION_CACHE_SIZE", "1024"))
+VISION_CACHE_TTL = int(os.getenv("VISION_CACHE_TTL", "86400"))  # seconds
+
+# Flux job scheduler
+FLUX_JOB_TIMEOUT = int(os.getenv("FLUX_JOB_TIMEOUT", "120"))  # seconds
+FLUX_MAX_CONCURRENT_JOBS = int(os.getenv("FLUX_MAX_CONCURRENT_JOBS", "8"))
+FLUX_POLL_MAX_INTERVAL = float(os.getenv("FLUX_POLL_MAX_INTERVAL", "5"))
+FLUX_WEBHOOK_URL = os.getenv("FLUX_WEBHOOK_URL")  # public URL of the Flux callback route (webhook mode)
+FLUX_WEBHOOK_SECRET = os.getenv("FLUX_WEBHOOK_SECRET")
+
+# Image generation limits
+IMG_MAX_CONCURRENT_PER_USER = int(os.getenv("IMG_MAX_CONCURRENT_PER_USER", "2"))
+IMG_MAX_BATCH = int(os.getenv("IMG_MAX_BATCH", "4"))
+
+# Generated image cache (Telegram file_id reuse)
+IMG_CACHE_SIZE = int(os.getenv("IMG_CACHE_SIZE", "1024"))
+IMG_CACHE_TTL = int(os.getenv("IMG_CACHE_TTL", "604800"))  # seconds
+
+# Instagram download worker pool
+INSTA_WORKERS = int(os.getenv("INSTA_WORKERS", "2"))
+INSTA_QUEUE_SIZE = int(os.getenv("INSTA_QUEUE_SIZE", "50"))
+INSTA_MAX_JOBS_PER_USER = int(os.getenv("INSTA_MAX_JOBS_PER_USER", "2"))
+
+# Instagram downloads: file_id cache and download directory limits
+INSTA_DOWNLOAD_DIR = os.getenv("INSTA_DOWNLOAD_DIR", "downloads")
+INSTA_CACHE_SIZE = int(os.getenv("INSTA_CACHE_SIZE", "1024"))
+INSTA_CACHE_TTL = int(os.getenv("INSTA_CACHE_TTL", "2592000"))  # seconds
+INSTA_DOWNLOAD_DIR_MAX_MB = int(os.getenv("INSTA_DOWNLOAD_DIR_MAX_MB", "1024"))
+INSTA_DOWNLOAD_MAX_AGE = int(os.getenv("INSTA_DOWNLOAD_MAX_AGE", "3600"))  # seconds
+
+# Instagram delivery: "auto" passes the CDN URL to Telegram or streams it, "file" always downloads to disk first
+INSTA_DELIVERY = os.getenv("INSTA_DELIVERY", "auto")
+INSTA_STREAM_TIMEOUT = int(os.getenv("INSTA_STREAM_TIMEOUT", "120"))  # seconds
+
+# Segmented downloads of large Instagram videos from the CDN
+INSTA_SEGMENT_SIZE = int(os.getenv("INSTA_SEGMENT_SIZE", str(4 * 1024 * 1024)))  # bytes
+INSTA_SEGMENT_CONCURRENCY = int(os.getenv("INSTA_SEGMENT_CONCURRENCY", "4"))
+INSTA_DOWNLOAD_CONNECTIONS = int(os.getenv("INSTA_DOWNLOAD_CONNECTIONS", "16"))
+INSTA_DOWNLOAD_MEMORY_LIMIT = int(os.getenv("INSTA_DOWNLOAD_MEMORY_LIMIT", str(50 * 1024 * 1024)))  # bytes
+
+# Instagram carousels: items fetched at once per post
+INSTA_ALBUM_CONCURRENCY = int(os.getenv("INSTA_ALBUM_CONCURRENCY", "4"))
+
+# Self-hosted Bot API server (telegram-bot-api); unset uses api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# The server runs with --local: file_path is a path on its disk and uploads may be up to 2000 MB
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "false").lower() == "true"
+# The server's --dir and where the same directory is mounted in the bot, if the paths differ
+TELEGRAM_API_FILES_DIR = os.getenv("TELEGRAM_API_FILES_DIR")
+TELEGRAM_API_LOCAL_FILES_DIR = os.getenv("TELEGRAM_API_LOCAL_FILES_DIR")
+
+# Videos above the Bot API upload limit are transcoded with ffmpeg
+INSTA_UPLOAD_LIMIT_MB = int(os.getenv("INSTA_UPLOAD_LIMIT_MB", "2000" if TELEGRAM_API_LOCAL else "50"))
+INSTA_TRANSCODE_WORKERS = int(os.getenv("INSTA_TRANSCODE_WORKERS", "1"))
+INSTA_TRANSCODE_THREADS = int(os.getenv("INSTA_TRANSCODE_THREADS", "2"))
+INSTA_TRANSCODE_TIMEOUT = int(os.getenv("INSTA_TRANSCODE_TIMEOUT", "600"))  # seconds
+
+# Outgoing message pacing (Telegram flood limits)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # messages per second
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages per second in private chats
+TELEGRAM_GROUP_RATE_PER_MIN = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MIN", "20"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Webhook mode: setting WEBHOOK_URL (the public base URL) replaces long polling with an aiohttp server
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # connections Telegram opens per bot
+# Updates handled at once by one process, in polling and webhook mode alike
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "64"))
+
+# Update ids already handled are remembered to drop Telegram redeliveries and failover duplicates
+UPDATE_DEDUPE_TTL = int(os.getenv("UPDATE_DEDUPE_TTL", "3600"))  # seconds
+UPDATE_DEDUPE_SIZE = int(os.getenv("UPDATE_DEDUPE_SIZE", "10000"))
+
+# Sharded mode: "ingress" receives updates and queues them in Redis Streams, "worker" handles its shards,
+# "all" does both in one process without Redis
+BOT_ROLE = os.getenv("BOT_ROLE", "all")
+UPDATE_STREAM_SHARDS = int(os.getenv("UPDATE_STREAM_SHARDS", "16"))
+UPDATE_STREAM_MAXLEN = int(os.getenv("UPDATE_STREAM_MAXLEN", "10000"))  # entries kept per shard
+UPDATE_STREAM_CLAIM_IDLE = int(os.getenv("UPDATE_STREAM_CLAIM_IDLE", "60"))  # seconds before a crashed worker's updates are taken over
+UPDATE_STREAM_READ_AHEAD = int(os.getenv("UPDATE_STREAM_READ_AHEAD", "1000"))  # updates a worker holds, running or waiting for their sender
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
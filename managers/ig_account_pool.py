@@ -0,0 +1,162 @@
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from utils.settings import (
+    IG_ACCOUNTS, IG_ACCOUNT_HOURLY_BUDGET, IG_ACCOUNT_COOLDOWN_SEC, IG_LEASE_TTL_SEC, IG_LEASE_WAIT_SEC,
+    IG_LEASES_PER_ACCOUNT,
+)
+from utils.session_store import IgSessionStore, LocalIgAccountState
+from managers.ig_session_manager import IgSessionManager
+from utils.logging_config import logger
+
+# Responses after which an account is rested; the auth ones also drop its session.
+# Statuses come from our own HTTP client, messages from instaloader exceptions.
+AUTH_FAILURES = (401, 403, "401", "403", "Checkpoint required", "login_required")
+RATE_LIMIT_FAILURES = (429, "429", "Please wait a few minutes")
+
+BUDGET_WINDOW = 3600
+
+
+class IgNoAccountAvailable(Exception):
+    pass
+
+
+def _matches(reason: Union[int, str], markers: tuple) -> bool:
+    if isinstance(reason, int):
+        return reason in markers
+    return any(isinstance(marker, str) and marker in reason for marker in markers)
+
+
+def is_account_failure(reason: Union[int, str]) -> bool:
+    """True if a status code or error message means the account itself was rejected"""
+    return _matches(reason, AUTH_FAILURES) or _matches(reason, RATE_LIMIT_FAILURES)
+
+
+class IgAccountPool:
+    """Spread Instagram traffic over several accounts.
+
+    Every request leases one account and counts against that account's hourly
+    budget. An account has up to leases_per_account leases at once across all
+    replicas (a sorted set in Redis); a lease is refreshed while it is held and
+    runs out after lease_ttl seconds if its holder dies. Concurrent leases in
+    one process share the account's instaloader session, so an account whose
+    session was dropped is not leased again here until its holders are done:
+    the next holder logs in alone. The least recently
+    used eligible account is picked first. Accounts that get 401/403/429
+    responses are put on cool-down for a while instead of being hammered with
+    immediate re-logins. Without Redis the same bookkeeping is kept in process.
+
+    The anonymous session used without any credentials has no budget, as
+    there is no account to protect; only its leases bound it.
+    """
+
+    def __init__(self, store: Optional[IgSessionStore] = None, accounts: Optional[List[Tuple[str, Optional[str]]]] = None,
+                 budget: int = IG_ACCOUNT_HOURLY_BUDGET, cooldown: int = IG_ACCOUNT_COOLDOWN_SEC,
+                 lease_ttl: int = IG_LEASE_TTL_SEC, lease_wait: float = IG_LEASE_WAIT_SEC,
+                 leases_per_account: int = IG_LEASES_PER_ACCOUNT) -> None:
+        self.store = store
+        self.state = store if store is not None else LocalIgAccountState()
+        accounts = IG_ACCOUNTS if accounts is None else accounts
+        if accounts:
+            self.accounts: Dict[str, IgSessionManager] = {}
+            for username, password in accounts:
+                self.accounts[username] = IgSessionManager(store, username, password)
+        else:
+            # No credentials at all: a single anonymous (or env cookie) session
+            sessions = IgSessionManager(store, None, None)
+            self.accounts = {sessions.name: sessions}
+        self.budget = budget
+        self.cooldown = cooldown
+        self.lease_ttl_ms = lease_ttl * 1000
+        self.lease_wait = lease_wait
+        self.leases_per_account = max(1, leases_per_account)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def attempts(self) -> int:
+        """How often a rejected request is tried; a retry only helps with another account"""
+        return 2 if len(self.accounts) > 1 else 1
+
+    async def _candidates(self) -> List[str]:
+        names = list(self.accounts)
+        try:
+            cooling = await self.state.cooling_down(names)
+            last_used = await self.state.last_used(names)
+        except Exception as e:
+            logger.warning(f"Failed to read IG account pool state: {e}")
+            return names
+        eligible = [name for name in names if name not in cooling]
+        return sorted(eligible, key=lambda name: last_used.get(name, 0.0))
+
+    async def _try_acquire(self, name: str, lease_id: str) -> bool:
+        if not await self.state.acquire_lease(name, lease_id, self.lease_ttl_ms, self.leases_per_account):
+            return False
+        if self.accounts[name].username and not await self.state.consume_budget(name, self.budget, BUDGET_WINDOW):
+            logger.info(f"IG account {name} used up its hourly budget")
+            await self.state.release_lease(name, lease_id)
+            return False
+        await self.state.mark_used(name)
+        return True
+
+    async def acquire(self) -> Tuple[IgSessionManager, str]:
+        """Lease the least recently used account that has a free lease, is within budget and not cooling down"""
+        lease_id = f"{self.holder}:{uuid.uuid4().hex[:8]}"
+        deadline = time.monotonic() + self.lease_wait
+        while True:
+            for name in await self._candidates():
+                sessions = self.accounts[name]
+                if sessions.leases and not sessions.loaded:
+                    # Its session is being replaced; don't run requests next to the login
+                    continue
+                try:
+                    acquired = await self._try_acquire(name, lease_id)
+                except Exception as e:
+                    logger.warning(f"Failed to lease IG account {name}: {e}")
+                    continue
+                if acquired:
+                    logger.debug(f"Leased IG account {name}")
+                    sessions.leases += 1
+                    return sessions, lease_id
+            if time.monotonic() >= deadline:
+                raise IgNoAccountAvailable("All Instagram accounts are busy or cooling down")
+            await asyncio.sleep(random.uniform(0.1, 0.3))
+
+    async def release(self, sessions: IgSessionManager, lease_id: str) -> None:
+        sessions.leases -= 1
+        try:
+            await self.state.release_lease(sessions.name, lease_id)
+        except Exception as e:
+            # The lease expires on its own after IG_LEASE_TTL_SEC
+            logger.warning(f"Failed to release IG account lease for {sessions.name}: {e}")
+
+    async def _keep_alive(self, sessions: IgSessionManager, lease_id: str) -> None:
+        """Refresh a lease well before it expires, for as long as it is held"""
+        while True:
+            await asyncio.sleep(self.lease_ttl_ms / 3000)
+            try:
+                if not await self.state.refresh_lease(sessions.name, lease_id, self.lease_ttl_ms):
+                    logger.warning(f"IG account lease for {sessions.name} ran out while held")
+            except Exception as e:
+                logger.warning(f"Failed to refresh IG account lease for {sessions.name}: {e}")
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[IgSessionManager]:
+        sessions, lease_id = await self.acquire()
+        keep_alive = asyncio.create_task(self._keep_alive(sessions, lease_id))
+        try:
+            yield sessions
+        finally:
+            keep_alive.cancel()
+            await self.release(sessions, lease_id)
+
+    async def penalize(self, sessions: IgSessionManager, reason: Union[int, str]) -> None:
+        """Rest an account Instagram rejected; auth failures also drop its session"""
+        logger.warning(f"Cooling down IG account {sessions.name} for {self.cooldown}s: {reason}")
+        await self.state.set_cooldown(sessions.name, self.cooldown)
+        if _matches(reason, AUTH_FAILURES):
+            await sessions.invalidate()
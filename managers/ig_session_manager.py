@@ -0,0 +1,237 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+import instaloader
+from config import INSTA_DOWNLOAD_DIR
+from utils.settings import (
+    IG_USERNAME, IG_PASSWORD, IG_LOGIN_TIMEOUT_SEC, IG_SESSIONID, IG_CSRFTOKEN, IG_DS_USER_ID,
+    INSTALOADER_SESSION_FILE,
+)
+from utils.session_store import IgSessionStore
+from utils.metrics import ig_login_duration_seconds, ig_login_errors_total
+from utils.logging_config import logger
+
+CHECKPOINT_MESSAGE = (
+    "Instagram requires verification (checkpoint). "
+    "Open the challenge URL from logs in a browser, complete the steps, and retry."
+)
+
+
+class IgCheckpointRequired(Exception):
+    pass
+
+
+class IgSessionManager:
+    """Own the Instagram login of one account, shared by IgClient and InstaloaderClient.
+
+    There is one instaloader instance per account and therefore one cookie jar. Sessions are
+    loaded lazily on first use, in order: the Redis session store, cookies from
+    the environment, the session file, and finally a fresh login. Nothing is
+    done at construction time, so creating the manager never touches Redis or
+    the network.
+    """
+
+    def __init__(self, store: Optional[IgSessionStore] = None, username: Optional[str] = IG_USERNAME,
+                 password: Optional[str] = IG_PASSWORD) -> None:
+        self.store = store
+        self.username = username
+        self.password = password
+        self.loader = instaloader.Instaloader(
+            download_comments=False,
+            download_geotags=False,
+            download_pictures=False,
+            download_video_thumbnails=False,
+            save_metadata=False,
+            dirname_pattern=os.path.join(INSTA_DOWNLOAD_DIR, "{target}"),
+        )
+        self.context = self.loader.context
+        if INSTALOADER_SESSION_FILE and username == IG_USERNAME:
+            self.session_file = INSTALOADER_SESSION_FILE
+        else:
+            self.session_file = f".instaloader_session_{username}" if username else None
+        self.loaded = False
+        # When the current session was created by a login, if known
+        self.saved_at: Optional[float] = None
+        # Bumped whenever the cookie jar changes so HTTP clients can resync
+        self.version = 0
+        # Pool leases held in this process; the loader's session is only replaced while there are none
+        self.leases = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.username or "anonymous"
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        return self.context._session.cookies.get_dict()
+
+    def _apply_cookies(self, cookies: Dict[str, Any]) -> None:
+        # Start from a fresh requests session; setting cookies on the anonymous
+        # session would leave its empty sessionid next to ours
+        cookies = {name: value for name, value in cookies.items() if value is not None}
+        cookies.setdefault("csrftoken", "")
+        self.loader.load_session(self.username, cookies)
+        self.version += 1
+
+    async def ensure_session(self) -> None:
+        if self.loaded:
+            return
+        async with self._lock:
+            if self.loaded:
+                return
+            await self._load()
+            self.loaded = True
+
+    async def _load(self) -> None:
+        if self.store is not None and self.username:
+            data = await self._fetch_stored_session()
+            if data:
+                self._apply_stored_session(data)
+                await self.touch()
+                logger.info("Loaded Instagram cookies from Redis session store. Skipping login.")
+                return
+
+        # Cookies from the environment belong to the primary account
+        if IG_SESSIONID and self.username == IG_USERNAME:
+            self._apply_cookies({"sessionid": IG_SESSIONID, "csrftoken": IG_CSRFTOKEN, "ds_user_id": IG_DS_USER_ID})
+            # Their real age is unknown; count from startup
+            self.saved_at = time.time()
+            logger.info("Loaded Instagram cookies from environment. Skipping login.")
+            return
+
+        if not self.username or not self.password:
+            logger.warning(f"IG credentials are not set for {self.name}. Proceeding unauthenticated.")
+            return
+
+        # Our own session file first, then the default one used by the Instaloader CLI
+        for filename in (self.session_file, None):
+            if filename and not Path(filename).exists():
+                continue
+            try:
+                logger.info(f"Loading Instagram session from file: {filename or 'default'}")
+                await asyncio.to_thread(self.loader.load_session_from_file, self.username, filename)
+                self.version += 1
+                if filename:
+                    self.saved_at = os.path.getmtime(filename)
+                return
+            except Exception as e:
+                logger.info(f"Session file load failed, will try fresh login: {e}")
+
+        if self.store is None:
+            await self.login()
+            return
+        # Only one process logs in; the others pick up the session it stores
+        lock = await self.store.acquire_lock(self.username)
+        try:
+            data = await self._fetch_stored_session()
+            if data:
+                self._apply_stored_session(data)
+            else:
+                await self.login()
+        finally:
+            await lock.release()
+
+    def _apply_stored_session(self, data: dict) -> None:
+        cookies = dict(data.get("cookies") or {})
+        for name in ("sessionid", "csrftoken", "ds_user_id"):
+            cookies.setdefault(name, data.get(name))
+        self._apply_cookies(cookies)
+        self.saved_at = data.get("saved_at")
+
+    async def sync_from_store(self) -> bool:
+        """Pick up a newer session another replica stored; returns True if one was applied"""
+        if self.store is None or not self.username:
+            return False
+        data = await self._fetch_stored_session()
+        if not data or (data.get("saved_at") or 0) <= (self.saved_at or 0):
+            return False
+        async with self._lock:
+            self._apply_stored_session(data)
+            self.loaded = True
+        logger.info(f"Picked up refreshed Instagram session of {self.name}")
+        return True
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.time() - self.saved_at if self.saved_at else None
+
+    async def _fetch_stored_session(self) -> Optional[dict]:
+        try:
+            return await self.store.get_session(self.username)
+        except Exception as e:
+            logger.warning(f"Failed to load IG session from Redis: {e}")
+            return None
+
+    async def login(self) -> None:
+        logger.info(f"Logging in to Instagram as {self.name}")
+
+        def _login() -> Dict[str, Any]:
+            self.loader.login(self.username, self.password)
+            return self.context.save_session()
+
+        started = time.monotonic()
+        try:
+            cookies = await asyncio.wait_for(
+                asyncio.to_thread(_login), timeout=IG_LOGIN_TIMEOUT_SEC
+            )
+        except Exception as e:
+            ig_login_errors_total.inc()
+            if "Checkpoint required" in str(e):
+                raise IgCheckpointRequired(str(e)) from e
+            raise
+        finally:
+            ig_login_duration_seconds.observe(time.monotonic() - started)
+        self.version += 1
+        self.loaded = True
+        self.saved_at = time.time()
+
+        if self.session_file:
+            try:
+                await asyncio.to_thread(self.loader.save_session_to_file, self.session_file)
+                logger.info(f"Saved Instagram session to file: {self.session_file}")
+            except Exception as e:
+                logger.warning(f"Failed to save IG session file: {e}")
+
+        if self.store is not None:
+            session_data = {
+                "sessionid": cookies.get("sessionid"),
+                "csrftoken": cookies.get("csrftoken"),
+                "ds_user_id": cookies.get("ds_user_id"),
+                "cookies": cookies,
+                "saved_at": self.saved_at,
+            }
+            await self.store.save_session(self.username, session_data)
+
+    async def relogin(self) -> None:
+        """Replace the session by a fresh login; requests starting meanwhile wait in ensure_session"""
+        async with self._lock:
+            loaded, self.loaded = self.loaded, False
+            try:
+                await self.login()
+            except Exception:
+                # The previous session is still in place
+                self.loaded = loaded
+                raise
+
+    async def touch(self) -> None:
+        if self.store is not None and self.username:
+            try:
+                await self.store.touch(self.username)
+            except Exception as e:
+                logger.debug(f"Failed to extend IG session TTL: {e}")
+
+    async def invalidate(self) -> None:
+        """Forget the current session everywhere so the next use logs in again"""
+        async with self._lock:
+            self.loaded = False
+            if self.store is not None and self.username:
+                try:
+                    await self.store.delete_session(self.username)
+                except Exception as e:
+                    logger.warning(f"Failed to delete IG session from Redis: {e}")
+            if self.session_file and Path(self.session_file).exists():
+                Path(self.session_file).unlink(missing_ok=True)
+                logger.info("Removed stale IG session file. Re-authenticating...")
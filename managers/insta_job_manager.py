@@ -0,0 +1,141 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import INSTA_WORKERS, INSTA_QUEUE_SIZE, INSTA_MAX_JOBS_PER_USER
+from utils.metrics import insta_queue_depth, insta_jobs_running, insta_job_wait_seconds, insta_job_duration_seconds
+from utils.logging_config import logger
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class InstaQueueFull(Exception):
+    """Raised when a job can't be queued because of the global or per-user limit"""
+
+
+class InstaUserLimit(InstaQueueFull):
+    """Raised when the user already has the maximum number of jobs queued or running"""
+
+
+class InstaDownloadError(Exception):
+    """A download finished without producing a video; the message is user facing"""
+
+
+@dataclass
+class InstaJob:
+    user_id: int
+    url: str
+    func: Callable[[str], Tuple[bool, Any]]
+    stage: str
+    future: asyncio.Future
+    progress: Optional[ProgressCallback] = None
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class InstaJobManager:
+    """Run Instagram downloads on a bounded thread pool instead of the event loop.
+
+    Instaloader is fully blocking (login, metadata and the download itself), so
+    every job, whether a metadata lookup or a full download, is executed in a
+    worker thread. Jobs wait in a bounded queue and a
+    user can only have a few jobs queued or running at once.
+    """
+
+    def __init__(self, instaloader_client, workers: int = INSTA_WORKERS, queue_size: int = INSTA_QUEUE_SIZE,
+                 max_jobs_per_user: int = INSTA_MAX_JOBS_PER_USER) -> None:
+        self.client = instaloader_client
+        self.workers_count = max(1, workers)
+        self.max_jobs_per_user = max_jobs_per_user
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.user_jobs: Dict[int, int] = {}
+        self.workers: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        if self.workers:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers_count, thread_name_prefix="insta")
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def download(self, user_id: int, url: str, progress: Optional[ProgressCallback] = None) -> Tuple[bool, str]:
+        """Queue a download and wait for (ok, path or error message)"""
+        return await self._submit(user_id, url, self.client.download_video, "downloading", progress)
+
+    async def resolve_media(self, user_id: int, url: str, progress: Optional[ProgressCallback] = None) -> Tuple[bool, Any]:
+        """Queue a metadata lookup and wait for (ok, IgMedia with CDN URLs or error message)"""
+        return await self._submit(user_id, url, self.client.get_media, "fetching", progress)
+
+    async def _submit(self, user_id: int, url: str, func: Callable[[str], Tuple[bool, Any]], stage: str,
+                      progress: Optional[ProgressCallback]) -> Tuple[bool, Any]:
+        if self.user_jobs.get(user_id, 0) >= self.max_jobs_per_user:
+            raise InstaUserLimit(f"You already have {self.max_jobs_per_user} Instagram downloads in progress, please wait")
+
+        job = InstaJob(user_id=user_id, url=url, func=func, stage=stage, future=asyncio.get_running_loop().create_future(), progress=progress)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise InstaQueueFull("Too many Instagram downloads in the queue, please try again later")
+        self.user_jobs[user_id] = self.user_jobs.get(user_id, 0) + 1
+        insta_queue_depth.set(self.queue.qsize())
+        try:
+            return await job.future
+        finally:
+            remaining = self.user_jobs.get(user_id, 1) - 1
+            if remaining > 0:
+                self.user_jobs[user_id] = remaining
+            else:
+                self.user_jobs.pop(user_id, None)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            insta_queue_depth.set(self.queue.qsize())
+            try:
+                if not job.future.done():
+                    await self._run_job(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job: InstaJob) -> None:
+        started = time.monotonic()
+        insta_job_wait_seconds.observe(started - job.queued_at)
+        await self._report(job, job.stage)
+
+        status = "error"
+        insta_jobs_running.inc()
+        try:
+            result = await self.client.call(self._executor, job.func, job.url)
+            status = "ok" if result[0] else "failed"
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            logger.error(f"Instagram job for {job.url} crashed: {e}", exc_info=True)
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            insta_jobs_running.dec()
+            duration = time.monotonic() - started
+            insta_job_duration_seconds.labels(stage=job.stage, status=status).observe(duration)
+            logger.info(f"Instagram {job.stage} job for user {job.user_id} finished with status {status} in {duration:.1f}s")
+
+    async def _report(self, job: InstaJob, stage: str) -> None:
+        if job.progress is None:
+            return
+        try:
+            await job.progress(stage)
+        except Exception as e:
+            logger.debug(f"Failed to report Instagram job progress: {e}")
@@ -1,13 +1,42 @@
 import asyncio
+import base64
 import time
-from typing import Dict, List, Union, Optional
+from typing import Any, Dict, List, Union, Optional
 from config import SESSION_EXPIRY, OPENAI_MODEL, ANTHROPIC_MODEL, GEMINI_MODEL, GROK_MODEL, SYSTEM_PROMPT, DEFAULT_MODEL_PROVIDER
 from models.models_list import MODELS, DEFAULT_MODEL
+from utils.image_pipeline import parse_data_url
 from utils.logging_config import logger
 
+def extract_usage(response: Any) -> Dict[str, int]:
+    """Normalize token usage from an OpenAI, Claude or Gemini response"""
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        input_tokens = getattr(usage, 'prompt_tokens', None)
+        if input_tokens is None:
+            input_tokens = getattr(usage, 'input_tokens', 0)
+        output_tokens = getattr(usage, 'completion_tokens', None)
+        if output_tokens is None:
+            output_tokens = getattr(usage, 'output_tokens', 0)
+        cached_tokens = getattr(usage, 'cache_read_input_tokens', None)
+        if cached_tokens is None:
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cached_tokens = getattr(details, 'cached_tokens', 0) if details else 0
+    else:
+        # Gemini reports usage in usage_metadata (not available in older SDKs)
+        usage = getattr(response, 'usage_metadata', None)
+        input_tokens = getattr(usage, 'prompt_token_count', 0) if usage else 0
+        output_tokens = getattr(usage, 'candidates_token_count', 0) if usage else 0
+        cached_tokens = getattr(usage, 'cached_content_token_count', 0) if usage else 0
+    return {
+        'input_tokens': input_tokens or 0,
+        'output_tokens': output_tokens or 0,
+        'cached_tokens': cached_tokens or 0,
+    }
+
 class SessionManager:
-    def __init__(self):
+    def __init__(self, usage_ledger=None):
         self.sessions: Dict[int, Dict[str, Union[List[Dict[str, str]], float, str]]] = {}
+        self.usage_ledger = usage_ledger
 
     def get_or_create_session(self, user_id: int) -> 'Session':
         current_time = time.time()
@@ -23,7 +52,7 @@ class SessionManager:
         else:
             self.sessions[user_id]['last_activity'] = current_time
 
-        return Session(self.sessions[user_id])
+        return Session(self.sessions[user_id], self.usage_ledger)
 
     def create_new_session(self, user_id: int) -> None:
         # Preserve model preferences when creating a new session
@@ -84,9 +113,42 @@ class SessionManager:
         # If model not found, return default
         return DEFAULT_MODEL
 
+    def create_scratch_session(self, user_id: int, provider: str) -> 'Session':
+        """Create a detached session with a copy of the user's history.
+
+        Messages processed through the scratch session are not written back
+        to the user's main conversation.
+        """
+        user_session = self.get_or_create_session(user_id)
+        scratch = Session({
+            'messages': [dict(m) for m in user_session.data.get('messages', [])],
+            'last_activity': time.time(),
+            'model_provider': provider,
+            'image_model': user_session.get_image_model(),
+            'state': None
+        }, self.usage_ledger)
+        # Keep the user's specific model for their current provider, default model otherwise
+        if user_session.data.get('model_provider', DEFAULT_MODEL_PROVIDER) == provider:
+            scratch.data['model'] = user_session.get_model()
+        else:
+            scratch.update_model(provider)
+        return scratch
+
 class Session:
-    def __init__(self, session_data):
+    def __init__(self, session_data, usage_ledger=None):
         self.data = session_data
+        self.usage_ledger = usage_ledger
+        self.last_usage: Dict[str, int] = {}
+        # Converted request and latency of the latest text turn (used by shadow traffic)
+        self.last_request: Optional[Dict[str, Any]] = None
+        self.last_latency: float = 0.0
+
+    def record_usage(self, response: Any, images: int = 0, model: Optional[str] = None) -> Dict[str, int]:
+        """Store the token usage of the latest API response and account it in the ledger"""
+        self.last_usage = extract_usage(response)
+        if self.usage_ledger is not None:
+            self.usage_ledger.record(self.get_provider(), model or self.get_model(), self.last_usage, images)
+        return self.last_usage
 
     def update_state(self, state: str) -> None:
         """Update the state of the session"""
@@ -150,6 +212,23 @@ class Session:
         """Get the current image generation model"""
         return self.data.get('image_model', 'openai')
 
+    def describe_last_image_turn(self, description: str) -> None:
+        """Replace the image placeholder of the latest user turn with a compact description"""
+        for m in reversed(self.data.get('messages', [])):
+            if m["role"] == "user" and isinstance(m["content"], str):
+                content = m["content"]
+                if content.endswith(" [with images]"):
+                    content = content[:-len(" [with images]")]
+                m["content"] = f"{content} [image: {description}]"
+                return
+
+    def add_image_turn(self, message: str, description: str, reply: str) -> None:
+        """Add a cached image question and answer to the history without resending pixels"""
+        messages = self.data.get('messages', [])
+        messages.append({"role": "user", "content": f"{message} [image: {description}]"})
+        messages.append({"role": "assistant", "content": reply})
+        self.data['messages'] = messages
+
     async def process_openai_message(self, message: str, openai_client):
         """Process a message using OpenAI"""
         messages = self.data.get('messages', [])
@@ -161,18 +240,24 @@ class Session:
         model_id = self.get_model()
 
         try:
+            converted_messages = [
+                {"role": m["role"], "content": m["content"]}
+                for m in messages
+            ]
+
             # Call OpenAI API using the get_client method
+            started = time.monotonic()
             async with openai_client.get_client() as client:
                 response = await client.chat.completions.create(
                     model=model_id,
-                    messages=[
-                        {"role": m["role"], "content": m["content"]}
-                        for m in messages
-                    ]
+                    messages=converted_messages
                 )
+            self.last_latency = time.monotonic() - started
 
             # Get assistant's response
             assistant_message = response.choices[0].message.content
+            self.record_usage(response)
+            self.last_request = {"provider": "openai", "model": model_id, "messages": converted_messages}
 
             # Add assistant message to history
             messages.append({"role": "assistant", "content": assistant_message})
@@ -206,6 +291,7 @@ class Session:
                 claude_messages.append({"role": role, "content": m["content"]})
 
             # Call Claude API
+            started = time.monotonic()
             async with claude_client.get_client() as client:
                 response = await client.messages.create(
                     model=model_id,
@@ -213,9 +299,12 @@ class Session:
                     messages=claude_messages,
                     system=SYSTEM_PROMPT
                 )
+            self.last_latency = time.monotonic() - started
 
             # Get assistant's response
             assistant_message = response.content[0].text
+            self.record_usage(response)
+            self.last_request = {"provider": "anthropic", "model": model_id, "messages": claude_messages, "system": SYSTEM_PROMPT}
 
             # Add assistant message to history
             messages.append({"role": "assistant", "content": assistant_message})
@@ -243,9 +332,10 @@ class Session:
                     resp = model.generate_content([
                         {"role": "user", "parts": [m["content"]]} if m["role"] == "user" else {"role": "model", "parts": [m["content"]]} for m in messages if m["role"] != "developer"
                     ])
-                    return resp.text
+                    return resp, resp.text
 
-                assistant_message = await asyncio.to_thread(_call)
+                response, assistant_message = await asyncio.to_thread(_call)
+            self.record_usage(response)
 
             messages.append({"role": "assistant", "content": assistant_message})
             self.data['messages'] = messages
@@ -255,25 +345,31 @@ class Session:
 
     async def process_gemini_message_with_image(self, message: str, image_urls: List[str], gemini_client):
         messages = self.data.get('messages', [])
+
+        # Images are sent inline as blobs in the same turn as the question
+        image_parts = []
         for url in image_urls:
-            if not url.startswith(('http://', 'https://')):
-                url = f"https://api.telegram.org/file/bot{gemini_client.telegram_bot_token}/{url}"
-            messages.append({"role": "user", "content": {"type": "image", "source": url}})
+            media_type, data = parse_data_url(url)
+            image_parts.append({"mime_type": media_type, "data": base64.b64decode(data)})
 
-        messages.append({"role": "user", "content": message})
+        contents = [
+            {"role": "user", "parts": [m["content"]]} if m["role"] == "user" else {"role": "model", "parts": [m["content"]]} for m in messages if m["role"] != "developer"
+        ]
+        contents.append({"role": "user", "parts": image_parts + [message]})
 
         model_id = self.get_model()
         try:
             async with gemini_client.get_client() as client:
                 def _call():
                     model = client.GenerativeModel(model_id)
-                    resp = model.generate_content([
-                        {"role": "user", "parts": [m["content"]]} if m["role"] == "user" else {"role": "model", "parts": [m["content"]]} for m in messages if m["role"] != "developer"
-                    ])
-                    return resp.text
-                assistant_message = await asyncio.to_thread(_call)
+                    resp = model.generate_content(contents)
+                    return resp, resp.text
+                response, assistant_message = await asyncio.to_thread(_call)
+            self.record_usage(response, images=len(image_urls))
 
-            self.data['messages'] = [msg for msg in messages if isinstance(msg['content'], str)] + [{"role": "assistant", "content": assistant_message}]
+            messages.append({"role": "user", "content": message})
+            messages.append({"role": "assistant", "content": assistant_message})
+            self.data['messages'] = messages
             return assistant_message
         except Exception as e:
             return f"Error processing message with Gemini: {str(e)}"
@@ -293,6 +389,7 @@ class Session:
                     messages=[{"role": m["role"], "content": m["content"]} for m in messages]
                 )
             assistant_message = response.choices[0].message.content
+            self.record_usage(response)
 
             messages.append({"role": "assistant", "content": assistant_message})
             self.data['messages'] = messages
@@ -303,8 +400,6 @@ class Session:
     async def process_grok_message_with_image(self, message: str, image_urls: List[str], grok_client):
         message_content = [{"type": "text", "text": message}]
         for url in image_urls:
-            if not url.startswith(('http://', 'https://')):
-                url = f"https://api.telegram.org/file/bot{grok_client.telegram_bot_token}/{url}"
             message_content.append({
                 "type": "image_url",
                 "image_url": {"url": url, "detail": "auto"}
@@ -326,6 +421,7 @@ class Session:
                     messages=history_messages
                 )
             reply = response.choices[0].message.content.strip()
+            self.record_usage(response, images=len(image_urls))
 
             messages.append({"role": "user", "content": message + " [with images]"})
             messages.append({"role": "assistant", "content": reply})
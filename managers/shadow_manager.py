@@ -0,0 +1,132 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+from config import (
+    SHADOW_OPENAI_MODEL, SHADOW_ANTHROPIC_MODEL, SHADOW_SAMPLE_RATE, SHADOW_QUEUE_SIZE,
+    SHADOW_WORKERS, SHADOW_LOG_PATH, SHADOW_LOG_MAX_CHARS
+)
+from managers.session_manager import extract_usage
+from utils.limits import provider_semaphore
+from utils.logging_config import logger
+
+class ShadowManager:
+    """Mirror a sample of text turns to candidate models in the background.
+
+    Turns are queued only after the user's reply has been sent. The queue is
+    bounded and jobs are dropped rather than delaying anything on the user path.
+    """
+
+    def __init__(self, openai_client, claude_client):
+        self.clients = {"openai": openai_client, "anthropic": claude_client}
+        self.candidates = {"openai": SHADOW_OPENAI_MODEL, "anthropic": SHADOW_ANTHROPIC_MODEL}
+        self.sample_rate = SHADOW_SAMPLE_RATE
+        self.log_path = SHADOW_LOG_PATH
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SHADOW_QUEUE_SIZE)
+        self.workers: List[asyncio.Task] = []
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and any(self.candidates.values())
+
+    def start(self) -> None:
+        if not self.enabled or self.workers:
+            return
+        logger.info(f"Starting shadow traffic with sample rate {self.sample_rate}: {self.candidates}")
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(max(1, SHADOW_WORKERS))]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def mirror(self, session: Any, reply: str) -> None:
+        """Queue the session's latest turn for the candidate model, if sampled"""
+        request = getattr(session, "last_request", None)
+        if not self.workers or not request:
+            return
+        candidate = self.candidates.get(request["provider"])
+        if not candidate or candidate == request["model"] or random.random() >= self.sample_rate:
+            return
+
+        job = {
+            "request": request,
+            "candidate": candidate,
+            "primary_output": reply,
+            "primary_latency": session.last_latency,
+            "primary_usage": dict(session.last_usage),
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.debug(f"Shadow queue full, dropped turn (total dropped: {self.dropped})")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                logger.warning(f"Shadow request failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        request = job["request"]
+        provider = request["provider"]
+
+        # Never compete with user traffic for a saturated provider
+        if provider_semaphore(provider).locked():
+            self.dropped += 1
+            logger.debug(f"Provider {provider} is saturated, skipping shadow request")
+            return
+
+        started = time.monotonic()
+        error: Optional[str] = None
+        output = ""
+        usage: Dict[str, int] = {}
+        try:
+            async with self.clients[provider].get_client() as client:
+                if provider == "anthropic":
+                    response = await client.messages.create(
+                        model=job["candidate"],
+                        max_tokens=4096,
+                        messages=request["messages"],
+                        system=request.get("system")
+                    )
+                    output = response.content[0].text
+                else:
+                    response = await client.chat.completions.create(
+                        model=job["candidate"],
+                        messages=request["messages"]
+                    )
+                    output = response.choices[0].message.content
+            usage = extract_usage(response)
+        except Exception as e:
+            error = str(e)
+        latency = time.monotonic() - started
+
+        record = {
+            "ts": int(time.time()),
+            "provider": provider,
+            "primary_model": request["model"],
+            "shadow_model": job["candidate"],
+            "primary_latency_ms": round(job["primary_latency"] * 1000),
+            "shadow_latency_ms": round(latency * 1000),
+            "primary_usage": job["primary_usage"],
+            "shadow_usage": usage,
+            "primary_output": job["primary_output"][:SHADOW_LOG_MAX_CHARS],
+            "shadow_output": (output or "")[:SHADOW_LOG_MAX_CHARS],
+        }
+        if error:
+            record["error"] = error
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: str) -> None:
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
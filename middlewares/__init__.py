@@ -2,3 +2,4 @@
 from .subscription import SubscriptionMiddleware
 from .logging import LoggingMiddleware
 from .dependencies import DependencyMiddleware
+from .usage import UsageContextMiddleware
@@ -0,0 +1,20 @@
+import asyncio
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Cap how many updates are handled at once.
+
+    Webhook updates are handled in background tasks as soon as they arrive;
+    registered as an outer update middleware this keeps a burst of them from
+    starting an unbounded number of handlers. Long polling has the same limit
+    built in (tasks_concurrency_limit).
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        async with self.semaphore:
+            return await handler(event, data)
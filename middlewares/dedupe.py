@@ -0,0 +1,23 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from utils.update_dedupe import UpdateDedupe
+from utils.metrics import telegram_duplicate_updates_total
+from utils.logging_config import logger
+
+
+class UpdateDedupeMiddleware(BaseMiddleware):
+    """Drop updates another replica (or an earlier delivery) already took.
+
+    Registered as the first outer update middleware, so a duplicate is
+    skipped before any handler, and therefore any provider call, runs.
+    """
+
+    def __init__(self, dedupe: UpdateDedupe) -> None:
+        self.dedupe = dedupe
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        if not await self.dedupe.claim(data["bot"].id, event.update_id):
+            telegram_duplicate_updates_total.inc()
+            logger.info(f"Skipping duplicate update {event.update_id}")
+            return None
+        return await handler(event, data)
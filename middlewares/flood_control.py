@@ -0,0 +1,33 @@
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, Response, SendChatAction
+from aiogram.methods.base import TelegramType
+from utils.send_scheduler import SendScheduler
+
+# Methods that create messages besides the send* family
+MESSAGE_METHODS = {"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"}
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """Route every outgoing message of the bot through the SendScheduler.
+
+    Registered on the bot session, so answer(), reply(), answer_video() and
+    friends are paced without the handlers knowing about it. Other methods
+    (edits, getters, chat actions) go out directly.
+    """
+
+    def __init__(self, scheduler: SendScheduler) -> None:
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or isinstance(method, SendChatAction) or not (name.startswith("send") or name in MESSAGE_METHODS):
+            return await make_request(bot, method)
+        # Every item of an album counts as a message
+        messages = len(getattr(method, "media", None) or []) if name == "sendMediaGroup" else 1
+        return await self.scheduler.run(chat_id, lambda: make_request(bot, method), method=name, messages=max(1, messages))
@@ -0,0 +1,25 @@
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from utils.update_stream import UpdateStream
+
+
+class UpdatePublishMiddleware(BaseMiddleware):
+    """Queue updates for the workers instead of handling them (ingress role).
+
+    Registered as the last outer update middleware, after the dedupe, so
+    the ingress process only parses, deduplicates and forwards; the handlers
+    run in the worker that owns the sender's shard. Routing by user keeps
+    everything the bot holds per user in memory (sessions, model choice,
+    per-user limits) in one worker, whichever chat the user writes in.
+    """
+
+    def __init__(self, stream: UpdateStream) -> None:
+        self.stream = stream
+
+    async def __call__(self, handler, event: Update, data: dict):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        # Updates without a user (channel posts and the like) are ordered per chat
+        key = user.id if user else chat.id if chat else event.update_id
+        await self.stream.publish(key, event.model_dump_json(exclude_unset=True, by_alias=True))
+        return None
@@ -0,0 +1,21 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from utils.usage_ledger import usage_context
+
+class UsageContextMiddleware(BaseMiddleware):
+    """Expose the current user and chat to the usage ledger"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        chat = getattr(event, "chat", None)
+        token = usage_context.set((user.id if user else None, chat.id if chat else None))
+        try:
+            return await handler(event, data)
+        finally:
+            usage_context.reset(token)
@@ -1,13 +1,31 @@
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile, BufferedInputFile
+from aiogram.types import Message, FSInputFile, BufferedInputFile, InputMediaPhoto, InputMediaVideo, URLInputFile
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.dispatcher.event.bases import SkipHandler
-from config import OPENAI_MODEL, ANTHROPIC_MODEL, OPENAI_ALLOWED_MODELS, ANTHROPIC_ALLOWED_MODELS, GEMINI_MODEL, GEMINI_ALLOWED_MODELS, GROK_MODEL, GROK_ALLOWED_MODELS
+from config import OPENAI_MODEL, ANTHROPIC_MODEL, OPENAI_ALLOWED_MODELS, ANTHROPIC_ALLOWED_MODELS, GEMINI_MODEL, GEMINI_ALLOWED_MODELS, GROK_MODEL, GROK_ALLOWED_MODELS, ADMIN_USER_IDS, IMG_MAX_BATCH, INSTA_DELIVERY, INSTA_STREAM_TIMEOUT, INSTA_DOWNLOAD_DIR, INSTA_ALBUM_CONCURRENCY
+from models.models_list import MODELS
+import asyncio
+import os
 import re
+import time
+import httpx
+from typing import Optional, Tuple, Union
 from utils.logging_config import logger
+from utils.limits import image_user_limiter
+from utils.image_cache import ImageCache
+from managers.insta_job_manager import InstaQueueFull, InstaUserLimit, InstaDownloadError
+from utils.instagram import extract_shortcode
+from utils.send_scheduler import answer_long
+from utils.bot_api import upload_file, MemoryInputFile
+from clients.ig_client import IgError, IgMedia
+from clients.segmented_downloader import SegmentedDownloadError
 
 router = Router()
 
+# Telegram accepts at most 10 items per media group
+MEDIA_GROUP_LIMIT = 10
+
 @router.message(Command("start"))
 async def handle_start(message: Message, session_manager):
     user_id = message.from_user.id
@@ -36,7 +54,9 @@ async def handle_help(message: Message):
         "/new - Start a new conversation\n"
         "/provider - Select AI provider (OpenAI or Claude)\n"
         "/model - Select a specific model from the current provider\n"
+        "/compare - Ask all configured providers the same question\n"
         "/img - Generate images (OpenAI or Flux)\n"
+        "/imgs - Generate several images across providers at once\n"
         "/imgmodel - Select default image generation model\n"
         "/help - Show this help message\n\n"
         "<b>Using the bot:</b>\n"
@@ -263,7 +283,7 @@ async def handle_imgmodel_command(message: Message, session_manager):
     await message.answer(response, parse_mode="HTML")
 
 @router.message(Command("img"))
-async def handle_img_command(message: Message, openai_client, flux_client, session_manager):
+async def handle_img_command(message: Message, openai_client, flux_client, session_manager, image_cache):
     user_id = message.from_user.id
     args = message.text.split()
 
@@ -283,23 +303,298 @@ async def handle_img_command(message: Message, openai_client, flux_client, sessi
         await message.answer(f"Usage: /img [openai|flux] <prompt>\nCurrent default: {default_provider.upper()}")
         return
 
-    await message.answer(f"Generating image using {provider.upper()}...")
+    key = _image_cache_key(provider, prompt, 0, openai_client, flux_client)
+    if await image_cache.get(key) is None:
+        await message.answer(f"Generating image using {provider.upper()}...")
 
     try:
+        await _send_generated_photo(
+            message, image_cache, key,
+            lambda: _generate_image(user_id, provider, prompt, openai_client, flux_client)
+        )
+    except Exception as e:
+        await message.answer(f"Error generating image: {str(e)}")
+
+async def _generate_image(user_id: int, provider: str, prompt: str, openai_client, flux_client):
+    """Generate one image, returning something answer_photo accepts (InputFile or URL)"""
+    # Per-user limit so a single user can't take all generation capacity
+    async with image_user_limiter.acquire(user_id):
         if provider == "openai":
             image_bytes = await openai_client.generate_image(prompt)
-            await message.answer_photo(BufferedInputFile(image_bytes, filename="image.png"))
-        else:  # flux
-            image_url = await flux_client.generate_image(prompt)
-            await message.answer_photo(image_url)
+            return BufferedInputFile(image_bytes, filename="image.png")
+        return await flux_client.generate_image(prompt)
+
+def _image_cache_key(provider: str, prompt: str, variant: int, openai_client, flux_client) -> str:
+    client = openai_client if provider == "openai" else flux_client
+    return ImageCache.make_key(provider, client.image_model, client.image_size, prompt, variant)
+
+async def _send_generated_photo(message: Message, image_cache, key: str, generate, caption=None) -> None:
+    """Answer with a generated photo, reusing the cached file_id when possible.
+
+    Concurrent identical requests share one generation: the first one uploads
+    the image and the others resend its file_id.
+    """
+    file_id = await image_cache.get(key)
+    if file_id:
+        logger.info(f"Image cache hit for {key}")
+        await message.answer_photo(file_id, caption=caption)
+        return
+
+    async def produce() -> str:
+        sent = await message.answer_photo(await generate(), caption=caption)
+        file_id = sent.photo[-1].file_id
+        await image_cache.set(key, file_id)
+        return file_id
+
+    file_id, shared = await image_cache.flights.do(key, produce)
+    if shared:
+        await message.answer_photo(file_id, caption=caption)
+
+@router.message(Command("imgs"))
+async def handle_imgs_command(message: Message, openai_client, flux_client, image_cache):
+    user_id = message.from_user.id
+    args = message.text.split()[1:]
+
+    # Usage: /imgs [count] [album] <prompt>
+    count = 2
+    album = False
+    while args and (args[0].isdigit() or args[0] == "album"):
+        if args[0] == "album":
+            album = True
+        else:
+            count = int(args[0])
+        args = args[1:]
+    prompt = " ".join(args)
+
+    providers = [name for name, client in (("openai", openai_client), ("flux", flux_client)) if client.api_key]
+    if not prompt or not providers:
+        await message.answer(f"Usage: /imgs [count] [album] <prompt>\nGenerates up to {IMG_MAX_BATCH} images across OpenAI and Flux")
+        return
+    count = max(1, min(count, IMG_MAX_BATCH))
+
+    # Spread the images over the available providers; the variant number keeps
+    # several images of the same provider distinct in the cache
+    assignments = [(providers[i % len(providers)], i // len(providers)) for i in range(count)]
+    logger.info(f"Generating {count} images for user {user_id} with {assignments}")
+    await message.answer(f"Generating {count} images using {', '.join(p.upper() for p in sorted({p for p, _ in assignments}))}...")
+
+    if not album:
+        async def deliver(provider: str, variant: int):
+            key = _image_cache_key(provider, prompt, variant, openai_client, flux_client)
+            try:
+                await _send_generated_photo(
+                    message, image_cache, key,
+                    lambda: _generate_image(user_id, provider, prompt, openai_client, flux_client),
+                    caption=provider.upper()
+                )
+            except Exception as e:
+                logger.error(f"Error generating image with {provider}: {e}")
+                await message.answer(f"Error generating image with {provider.upper()}: {e}")
+
+        # Each image is sent as soon as it is ready
+        await asyncio.gather(*(deliver(provider, variant) for provider, variant in assignments))
+        return
+
+    # Album items go through the cache and singleflight too; a fresh image's
+    # flight stays open until the album is sent and its file_id is known
+    uploads = {}
+
+    async def generate(provider: str, variant: int):
+        key = _image_cache_key(provider, prompt, variant, openai_client, flux_client)
+        try:
+            file_id = await image_cache.get(key)
+            if file_id:
+                logger.info(f"Image cache hit for {key}")
+                return provider, key, file_id, None
+            loop = asyncio.get_running_loop()
+            generated, uploaded = loop.create_future(), loop.create_future()
+
+            async def produce() -> str:
+                generated.set_result(await _generate_image(user_id, provider, prompt, openai_client, flux_client))
+                file_id = await uploaded
+                await image_cache.set(key, file_id)
+                return file_id
+
+            flight = asyncio.ensure_future(image_cache.flights.do(key, produce))
+            await asyncio.wait([generated, flight], return_when=asyncio.FIRST_COMPLETED)
+            if generated.done():
+                uploads[key] = (uploaded, flight)
+                return provider, key, generated.result(), None
+            # Another request generated this image and resends its file_id
+            file_id, _ = flight.result()
+            return provider, key, file_id, None
+        except Exception as e:
+            logger.error(f"Error generating image with {provider}: {e}")
+            return provider, key, None, e
+
+    results = await asyncio.gather(*(generate(provider, variant) for provider, variant in assignments))
+    ready = [(provider, key, photo) for provider, key, photo, error in results if not error]
+    failed = [provider for provider, _, _, error in results if error]
+    file_ids = {}
+    try:
+        if len(ready) > 1:
+            sent = await message.answer_media_group([
+                InputMediaPhoto(media=photo, caption=provider.upper()) for provider, _, photo in ready
+            ])
+        elif ready:
+            provider, _, photo = ready[0]
+            sent = [await message.answer_photo(photo, caption=provider.upper())]
+        else:
+            sent = []
+        file_ids = {key: sent_message.photo[-1].file_id for (_, key, _), sent_message in zip(ready, sent)}
+    finally:
+        # Release the flights: with a file_id to cache, or failed for anyone waiting on them
+        for key, (uploaded, _) in uploads.items():
+            if key in file_ids:
+                uploaded.set_result(file_ids[key])
+            else:
+                uploaded.set_exception(RuntimeError("The generated image was not sent"))
+        await asyncio.gather(*(flight for _, flight in uploads.values()), return_exceptions=True)
+    if failed:
+        await message.answer(f"Failed to generate {len(failed)} of {count} images ({', '.join(p.upper() for p in failed)})")
+
+async def _resolve_instagram_media(message: Message, insta_jobs, ig_client, url: str, shortcode: str, progress) -> IgMedia:
+    """Resolve a post to its CDN URLs with the async IgClient, with instaloader on the worker pool as a fallback"""
+    if ig_client is not None:
+        try:
+            return await ig_client.get_media(shortcode)
+        except IgError as e:
+            logger.info(f"Async metadata lookup for {shortcode} failed, using instaloader: {e}")
+    ok, media = await insta_jobs.resolve_media(message.from_user.id, url, progress=progress)
+    if not ok:
+        raise InstaDownloadError(media)
+    return media
+
+async def _fit_video(bot, insta_transcoder, path: str) -> Tuple[Union[str, FSInputFile], dict]:
+    """Transcode a downloaded video that is over the upload limit; returns the file and its answer_video arguments"""
+    transcoded = await insta_transcoder.fit(path) if insta_transcoder is not None else None
+    if transcoded is None:
+        return upload_file(bot, path), {}
+    info = transcoded.info
+    extra = {"supports_streaming": True}
+    for name, value in (("width", info.width), ("height", info.height), ("duration", info.duration and round(info.duration))):
+        if value is not None:
+            extra[name] = value
+    if transcoded.thumbnail:
+        extra["thumbnail"] = FSInputFile(transcoded.thumbnail)
+    return upload_file(bot, transcoded.path), extra
+
+def _write_file(path: str, data: memoryview) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def _download_instagram_file(bot, insta_downloader, url: str, shortcode: str, filename: str, insta_transcoder=None):
+    """Fetch a CDN file with the segmented downloader into an input file Telegram can upload.
+
+    With a transcoder, videos over the upload limit are shrunk first; the
+    returned dict holds the answer_video arguments describing the new file.
+    Files on disk go to a local Bot API server by path instead of as uploads.
+    """
+    path = os.path.join(INSTA_DOWNLOAD_DIR, shortcode, filename)
+    download = await insta_downloader.download(url, path)
+    if download.data is not None:
+        if insta_transcoder is None or download.size <= insta_transcoder.size_limit:
+            return MemoryInputFile(download.data, filename=filename), {}
+        # ffmpeg needs a file
+        await asyncio.to_thread(_write_file, path, download.data)
+    return await _fit_video(bot, insta_transcoder, path)
+
+async def _send_instagram_video_from_url(message: Message, media: IgMedia, status_message: Message,
+                                        insta_downloader=None, insta_transcoder=None) -> Optional[Message]:
+    """Deliver a video from its CDN URL instead of downloading it with instaloader.
+
+    Telegram is first asked to fetch the CDN URL itself; if it refuses, the
+    video is fetched in parallel byte ranges by the segmented downloader (in
+    memory, or on disk when large and then shrunk to the upload limit if
+    needed), or without one streamed through to the upload chunk by chunk.
+    Returns None when all of that fails so the caller
+    can fall back to a regular download.
+    """
+    shortcode, video_url = media.shortcode, media.video_url
+    video_info = {name: value for name, value in (("width", media.width), ("height", media.height), ("duration", media.duration))
+                  if value is not None}
+    await status_message.edit_text("⬆️ Uploading...")
+    try:
+        return await message.answer_video(video_url, **video_info)
     except Exception as e:
-        await message.answer(f"Error generating image: {str(e)}")
+        logger.info(f"Telegram could not fetch the video of {shortcode} by URL, streaming it instead: {e}")
+
+    if insta_downloader is not None:
+        try:
+            video, extra = await _download_instagram_file(message.bot, insta_downloader, video_url, shortcode, f"{shortcode}.mp4", insta_transcoder)
+        except (SegmentedDownloadError, httpx.HTTPError, OSError) as e:
+            logger.warning(f"Downloading the video of {shortcode} from the CDN failed, falling back to instaloader: {e}")
+            return None
+        try:
+            return await message.answer_video(video, **{**video_info, **extra})
+        except Exception as e:
+            logger.warning(f"Uploading the video of {shortcode} failed, falling back to download: {e}")
+            return None
+
+    try:
+        return await message.answer_video(URLInputFile(video_url, filename=f"{shortcode}.mp4", timeout=INSTA_STREAM_TIMEOUT), **video_info)
+    except Exception as e:
+        logger.warning(f"Streaming the video of {shortcode} failed, falling back to download: {e}")
+        return None
+
+async def _send_instagram_album(message: Message, media: IgMedia, insta_cache, status_message: Message, insta_downloader=None,
+                                insta_transcoder=None) -> None:
+    """Send the photos and videos of a carousel (or a single photo post) as albums of up to 10 items.
+
+    Items are fetched concurrently, at most INSTA_ALBUM_CONCURRENCY at a time;
+    items sent before are reused by their cached file_id. Without a downloader
+    Telegram fetches the CDN URLs itself.
+    """
+    shortcode = media.shortcode
+    items = [item for item in (media.items or [media]) if item.url]
+    if not items:
+        raise InstaDownloadError("This post has no photos or videos")
+    semaphore = asyncio.Semaphore(INSTA_ALBUM_CONCURRENCY)
+
+    async def fetch(index: int, item: IgMedia):
+        key = f"{shortcode}:{item.id or index}"
+        file_id = await insta_cache.get(key)
+        if file_id:
+            return key, file_id, {}
+        if insta_downloader is None:
+            return key, item.url, {}
+        async with semaphore:
+            if item.is_video:
+                file, extra = await _download_instagram_file(message.bot, insta_downloader, item.url, shortcode, f"{index}.mp4", insta_transcoder)
+            else:
+                file, extra = await _download_instagram_file(message.bot, insta_downloader, item.url, shortcode, f"{index}.jpg")
+        return key, file, extra
+
+    try:
+        files = await asyncio.gather(*(fetch(index, item) for index, item in enumerate(items)))
+    except (SegmentedDownloadError, httpx.HTTPError, OSError) as e:
+        raise InstaDownloadError(f"Failed to download the post: {e}")
+
+    await status_message.edit_text("⬆️ Uploading...")
+    for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+        chunk = list(zip(items[start:start + MEDIA_GROUP_LIMIT], files[start:start + MEDIA_GROUP_LIMIT]))
+        # A media group needs at least two items
+        if len(chunk) == 1:
+            item, (_, file, extra) = chunk[0]
+            if item.is_video:
+                sent = [await message.answer_video(file, **extra)]
+            else:
+                sent = [await message.answer_photo(file)]
+        else:
+            sent = await message.answer_media_group([
+                InputMediaVideo(media=file, **extra) if item.is_video else InputMediaPhoto(media=file)
+                for item, (_, file, extra) in chunk
+            ])
+        for (item, (key, _, _)), sent_message in zip(chunk, sent):
+            file_id = sent_message.video.file_id if item.is_video else sent_message.photo[-1].file_id
+            await insta_cache.set(key, file_id)
 
 @router.message(Command("insta"))
-async def cmd_insta(message: Message, instaloader_client):
+async def cmd_insta(message: Message, insta_jobs, insta_cache, ig_client=None, insta_downloader=None, insta_transcoder=None):
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        await message.answer("Usage: /insta <link to instagram video>")
+        await message.answer("Usage: /insta <link to instagram post or reel>")
         return
     user_message = args[1]
     url_pattern = r'https?://(?:www\.)?instagram\.com/[^\s]+'
@@ -308,14 +603,70 @@ async def cmd_insta(message: Message, instaloader_client):
         await message.answer("Please provide a valid Instagram URL")
         return
     instagram_url = match.group(0)
-    ok, path = instaloader_client.download_video(instagram_url)
-    if not ok:
-        await message.answer(f"Something went wrong: {path}")
+    shortcode = extract_shortcode(instagram_url)
+    if not shortcode:
+        await message.answer("Please provide a link to an Instagram post or reel")
         return
 
-    # Use FSInputFile instead of directly opening the file
-    video_file = FSInputFile(path)
-    await message.answer_video(video_file)
+    file_id = await insta_cache.get(shortcode)
+    if file_id:
+        logger.info(f"Instagram cache hit for {shortcode}")
+        await message.answer_video(file_id)
+    else:
+        status_message = await message.answer("⏳ Queued...")
+
+        async def report_progress(stage: str) -> None:
+            await status_message.edit_text(f"⬇️ {stage.capitalize()}...")
+
+        led = False
+
+        async def produce() -> Optional[str]:
+            nonlocal led
+            led = True
+            media = await _resolve_instagram_media(message, insta_jobs, ig_client, instagram_url, shortcode, report_progress)
+            if not media.is_video:
+                await _send_instagram_album(message, media, insta_cache, status_message, insta_downloader, insta_transcoder)
+                return None
+            sent = None
+            if INSTA_DELIVERY != "file":
+                sent = await _send_instagram_video_from_url(message, media, status_message, insta_downloader, insta_transcoder)
+            if sent is None:
+                ok, path = await insta_jobs.download(message.from_user.id, instagram_url, progress=report_progress)
+                if not ok:
+                    raise InstaDownloadError(path)
+                video, extra = await _fit_video(message.bot, insta_transcoder, path)
+                await status_message.edit_text("⬆️ Uploading...")
+                sent = await message.answer_video(video, **extra)
+            await insta_cache.set(shortcode, sent.video.file_id)
+            return sent.video.file_id
+
+        # Concurrent requests for the same post share one download and upload
+        try:
+            try:
+                file_id, shared = await insta_cache.flights.do(shortcode, produce)
+            except InstaUserLimit:
+                if led:
+                    raise
+                # The leader's own job limit says nothing about this user, who tries on their own
+                file_id, shared = await produce(), False
+            if shared and file_id is None:
+                # Albums are cached per item, so this only resends their file_ids
+                await produce()
+        except InstaQueueFull as e:
+            await status_message.edit_text(str(e))
+            return
+        except (InstaDownloadError, TelegramBadRequest) as e:
+            # Telegram refusing the upload (too big, bad media) fails the download as well
+            await status_message.edit_text(f"Something went wrong: {e}")
+            return
+        except Exception as e:
+            # Worker, network or transcoder failures: never leave the status message hanging
+            logger.error(f"Instagram download of {shortcode} failed: {e}", exc_info=True)
+            await status_message.edit_text("Something went wrong while downloading this post, please try again later")
+            return
+        if shared and file_id:
+            await message.answer_video(file_id)
+        await status_message.delete()
 
     # Try deleting the original command message only when allowed (groups, bot has rights)
     if message.chat.type in ("group", "supergroup"):
@@ -329,7 +680,7 @@ async def cmd_insta(message: Message, instaloader_client):
             logger.debug(f"Skip deleting message (no rights or not allowed): {e}")
 
 @router.message(Command("ask"), ~F.photo)
-async def handle_ask_command(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+async def handle_ask_command(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client, shadow_manager=None):
     user_id = message.from_user.id
 
     # Extract the actual question (remove the /ask part)
@@ -352,7 +703,91 @@ async def handle_ask_command(message: Message, session_manager, openai_client, c
     else:
         response = await session.process_openai_message(question, openai_client)
 
-    await message.answer(response)
+    await answer_long(message, response)
+    if shadow_manager:
+        shadow_manager.mirror(session, response)
+
+@router.message(Command("compare"))
+async def handle_compare_command(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+    user_id = message.from_user.id
+
+    question_source = message.text or message.caption or ""
+    parts = question_source.split(maxsplit=1)
+    question = parts[1].strip() if len(parts) > 1 else ""
+    if not question:
+        await message.answer("Usage: /compare <question>")
+        return
+
+    clients = {
+        "openai": (openai_client, "process_openai_message"),
+        "anthropic": (claude_client, "process_claude_message"),
+        "gemini": (gemini_client, "process_gemini_message"),
+        "grok": (grok_client, "process_grok_message"),
+    }
+    # Only fan out to providers that have an API key configured
+    providers = [model for model in MODELS if getattr(clients[model["provider"]][0], "api_key", None)]
+    if not providers:
+        await message.answer("No AI providers are configured.")
+        return
+
+    logger.info(f"Compare command from user {user_id} across {len(providers)} providers")
+    await message.answer(f"⏳ Asking {len(providers)} providers: {', '.join(model['name'] for model in providers)}")
+
+    async def ask(model: dict):
+        # Scratch sessions keep the comparison out of the user's main history
+        session = session_manager.create_scratch_session(user_id, model["provider"])
+        client, method = clients[model["provider"]]
+        started = time.monotonic()
+        reply = await getattr(session, method)(question, client)
+        return model, session, reply, time.monotonic() - started
+
+    for finished in asyncio.as_completed([ask(model) for model in providers]):
+        model, session, reply, latency = await finished
+        usage = session.last_usage
+        header = (
+            f"🤖 {model['name']} ({session.get_model()}) — {latency:.1f}s, "
+            f"{usage.get('input_tokens', 0)} in / {usage.get('output_tokens', 0)} out tokens"
+        )
+        await answer_long(message, f"{header}\n\n{reply}")
+
+@router.message(Command("usage"))
+async def handle_usage_command(message: Message, usage_ledger):
+    user_id = message.from_user.id
+    if user_id not in ADMIN_USER_IDS:
+        logger.info(f"Ignoring /usage from non-admin user {user_id}")
+        return
+
+    # Usage: /usage [user|chat|model] [YYYY-MM-DD]
+    args = message.text.split()[1:]
+    scope = "user"
+    day = None
+    for arg in args:
+        if arg.rstrip("s") in ("user", "chat", "model"):
+            scope = arg.rstrip("s")
+        elif re.match(r"^\d{4}-\d{2}-\d{2}$", arg):
+            day = arg
+        else:
+            await message.answer("Usage: /usage [user|chat|model] [YYYY-MM-DD]")
+            return
+
+    top = await usage_ledger.top_consumers(scope, day)
+    if not top:
+        await message.answer("No usage recorded for this day.")
+        return
+
+    lines = [f"📊 Top {scope}s by tokens ({day or 'today, UTC'}):", ""]
+    for position, (scope_id, total, fields) in enumerate(top, start=1):
+        totals = {}
+        for field, value in fields.items():
+            metric = field.rsplit(":", 1)[-1]
+            totals[metric] = totals.get(metric, 0) + value
+        lines.append(
+            f"{position}. {scope_id} — {total} tokens "
+            f"(in {totals.get('input_tokens', 0)}, out {totals.get('output_tokens', 0)}, "
+            f"cached {totals.get('cached_tokens', 0)}, images {totals.get('images', 0)}, "
+            f"requests {totals.get('requests', 0)})"
+        )
+    await message.answer("\n".join(lines))
 
 # Handler for numeric responses in the form of a reply to a bot message in group chats
 @router.message(F.reply_to_message & F.text.regexp(r"^[1-9]\d*$"))
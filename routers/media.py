@@ -1,189 +1,118 @@
+from typing import List, Optional
 from aiogram import Router, F
 from aiogram.types import Message
-import asyncio
+from utils.media_group import MediaGroupCollector, MediaGroupItem
+from utils.send_scheduler import answer_long
 from utils.logging_config import logger
 
 router = Router()
-media_groups = {}
-media_group_locks = {}
+media_group_collector = MediaGroupCollector()
+
+async def _process_images(bot, user_id, caption, photos, session_manager, image_pipeline, vision_cache, openai_client, claude_client, gemini_client, grok_client) -> str:
+    """Send photos (lists of PhotoSize) with a caption to the user's current provider"""
+    session = session_manager.get_or_create_session(user_id)
+    model_provider = session_manager.get_model_provider(user_id)
+
+    # The same image forwarded around shares its file_unique_id, so answers can be reused
+    cache_key = vision_cache.make_key(
+        f"{model_provider}/{session.get_model()}",
+        [sizes[-1].file_unique_id for sizes in photos],
+        caption
+    )
+    cached = await vision_cache.get(cache_key)
+    if cached:
+        logger.info(f"Vision cache hit for user {user_id}")
+        session.add_image_turn(caption, cached["description"], cached["answer"])
+        return cached["answer"]
+
+    # Download each photo once and inline it, sized for the provider
+    image_urls = await image_pipeline.prepare_many(bot, photos, model_provider)
+
+    if model_provider == "anthropic":
+        reply = await claude_client.process_message_with_image(session, caption, image_urls)
+    elif model_provider == "gemini":
+        reply = await gemini_client.process_message_with_image(session, caption, image_urls)
+    elif model_provider == "grok":
+        reply = await grok_client.process_message_with_image(session, caption, image_urls)
+    else:
+        reply = await openai_client.process_message_with_image(session, caption, image_urls)
+
+    # Usage is only recorded for successful API responses; error replies are not cached
+    if session.last_usage:
+        entry = await vision_cache.set(cache_key, reply)
+        session.describe_last_image_turn(entry["description"])
+    return reply
 
 @router.message(F.chat.type == "private", F.photo)
-async def handle_private_photo(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+async def handle_private_photo(message: Message, session_manager, image_pipeline, vision_cache, openai_client, claude_client, gemini_client, grok_client):
     user_id = message.from_user.id
 
+    async def process(anchor: Message, photos: List, caption: Optional[str]) -> None:
+        caption = caption or "What is in this image?"
+        if caption.startswith("/ask"):
+            caption = caption.replace("/ask", "", 1).strip()
+
+        reply = await _process_images(
+            anchor.bot, user_id, caption, photos, session_manager, image_pipeline, vision_cache,
+            openai_client, claude_client, gemini_client, grok_client
+        )
+        await answer_long(anchor, reply)
+
     # Check if message is part of a media group
     if message.media_group_id:
-        media_group_id = message.media_group_id
-        logger.debug(f"Media group ID: {media_group_id}")
-
-        # Create lock for this media group if it doesn't exist
-        if media_group_id not in media_group_locks:
-            media_group_locks[media_group_id] = asyncio.Lock()
-
-        async with media_group_locks[media_group_id]:
-            if media_group_id not in media_groups:
-                media_groups[media_group_id] = {
-                    'messages': [message],
-                    'processed': False
-                }
-
-                # Schedule processing of the media group
-                async def process_media_group():
-                    await asyncio.sleep(2)  # Give time for all images to be received
-                    async with media_group_locks[media_group_id]:
-                        if not media_groups[media_group_id]['processed']:
-                            messages = media_groups[media_group_id]['messages']
-                            caption = None
-
-                            # Use the caption from the first message or any message with a caption
-                            for msg in messages:
-                                if msg.caption:
-                                    caption = msg.caption
-                                    break
-
-                            if caption and caption.startswith("/ask"):
-                                caption = caption.replace("/ask", "", 1).strip()
-
-                            if not caption:
-                                caption = "What is in this image?"
-
-                            file_urls = []
-                            for message in messages:
-                                if message.photo:
-                                    file = await message.bot.get_file(message.photo[-1].file_id)
-                                    file_urls.append(file.file_path)
-
-                            session = session_manager.get_or_create_session(user_id)
-                            model_provider = session_manager.get_model_provider(user_id)
-
-                            if model_provider == "anthropic":
-                                reply = await claude_client.process_message_with_image(session, caption, file_urls)
-                            elif model_provider == "gemini":
-                                reply = await gemini_client.process_message_with_image(session, caption, file_urls)
-                            elif model_provider == "grok":
-                                reply = await grok_client.process_message_with_image(session, caption, file_urls)
-                            else:
-                                reply = await openai_client.process_message_with_image(session, caption, file_urls)
-
-                            await messages[0].answer(reply)
-                            media_groups[media_group_id]['processed'] = True
-
-                asyncio.create_task(process_media_group())
-            else:
-                media_groups[media_group_id]['messages'].append(message)
+        logger.debug(f"Media group ID: {message.media_group_id}")
+
+        async def process_media_group(anchor: Message, items: List[MediaGroupItem]) -> None:
+            # Use the caption from the first message or any message with a caption
+            caption = next((item.caption for item in items if item.caption), None)
+            await process(anchor, [item.photo for item in items if item.photo], caption)
+
+        media_group_collector.add(message, process_media_group)
     else:
         # Single image handling
-        caption = message.caption or "What is in this image?"
-        if caption.startswith("/ask"):
-            caption = caption.replace("/ask", "", 1).strip()
-        file = await message.bot.get_file(message.photo[-1].file_id)
-        file_url = file.file_path
-
-        session = session_manager.get_or_create_session(user_id)
-        model_provider = session_manager.get_model_provider(user_id)
+        await process(message, [message.photo], message.caption)
 
-        if model_provider == "anthropic":
-            reply = await claude_client.process_message_with_image(session, caption, [file_url])
-        elif model_provider == "gemini":
-            reply = await gemini_client.process_message_with_image(session, caption, [file_url])
-        elif model_provider == "grok":
-            reply = await grok_client.process_message_with_image(session, caption, [file_url])
-        else:
-            reply = await openai_client.process_message_with_image(session, caption, [file_url])
+def _ask_or_collect(message: Message) -> bool:
+    """Match photos with /ask; other album parts are only buffered in case a sibling has the /ask.
 
-        await message.answer(reply)
+    Buffering happens here, in the filter, so albums not meant for the bot never
+    reach the handler's middlewares (subscription check, logging, usage).
+    """
+    if (message.caption or "").startswith("/ask"):
+        return True
+    if message.media_group_id:
+        media_group_collector.observe(message)
+    return False
 
-@router.message((F.chat.type == "group") | (F.chat.type == "supergroup"), F.photo & F.caption.startswith("/ask"))
-async def handle_group_photo_ask(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+@router.message((F.chat.type == "group") | (F.chat.type == "supergroup"), F.photo, _ask_or_collect)
+async def handle_group_photo_ask(message: Message, session_manager, image_pipeline, vision_cache, openai_client, claude_client, gemini_client, grok_client):
     user_id = message.from_user.id
 
     # If it's a single photo with /ask command
     if not message.media_group_id:
         caption = message.caption.replace('/ask', '').strip()
-        file = await message.bot.get_file(message.photo[-1].file_id)
-        file_url = file.file_path
-
-        session = session_manager.get_or_create_session(user_id)
-        model_provider = session_manager.get_model_provider(user_id)
-
-        if model_provider == "anthropic":
-            reply = await claude_client.process_message_with_image(session, caption, [file_url])
-        elif model_provider == "gemini":
-            reply = await gemini_client.process_message_with_image(session, caption, [file_url])
-        elif model_provider == "grok":
-            reply = await grok_client.process_message_with_image(session, caption, [file_url])
-        else:
-            reply = await openai_client.process_message_with_image(session, caption, [file_url])
-
-        await message.reply(reply)
+
+        reply = await _process_images(
+            message.bot, user_id, caption, [message.photo], session_manager, image_pipeline, vision_cache,
+            openai_client, claude_client, gemini_client, grok_client
+        )
+
+        await answer_long(message, reply, as_reply=True)
         return
 
-    # If part of a media group, process with group handler
-    media_group_id = message.media_group_id
-
-    # Create lock for this media group if it doesn't exist
-    if media_group_id not in media_group_locks:
-        media_group_locks[media_group_id] = asyncio.Lock()
-
-    async with media_group_locks[media_group_id]:
-        if media_group_id not in media_groups:
-            media_groups[media_group_id] = {
-                'messages': [message],
-                'processed': False
-            }
-
-            # Schedule processing after a delay
-            async def process_media_group():
-                await asyncio.sleep(2)  # Wait for 2 seconds
-                async with media_group_locks[media_group_id]:
-                    if media_group_id in media_groups and not media_groups[media_group_id]['processed']:
-                        group_data = media_groups[media_group_id]
-                        messages = group_data['messages']
-
-                        # Find message with /ask command
-                        caption = None
-                        for msg in messages:
-                            if msg.caption and msg.caption.startswith('/ask'):
-                                caption = msg.caption.replace('/ask', '').strip()
-                                break
-
-                        logger.debug(f"Processing media group {media_group_id}. Messages count: {len(messages)}")
-                        logger.debug(f"Final caption: {caption}")
-
-                        if not caption:
-                            await messages[0].reply("Please add /ask command with your question")
-                            return
-
-                        # Process all photos
-                        file_urls = []
-                        for message in messages:
-                            if message.photo:
-                                file = await message.bot.get_file(message.photo[-1].file_id)
-                                file_urls.append(file.file_path)
-
-                        session = session_manager.get_or_create_session(user_id)
-                        model_provider = session_manager.get_model_provider(user_id)
-
-                        if model_provider == "anthropic":
-                            reply = await claude_client.process_message_with_image(session, caption, file_urls)
-                        elif model_provider == "gemini":
-                            reply = await gemini_client.process_message_with_image(session, caption, file_urls)
-                        elif model_provider == "grok":
-                            reply = await grok_client.process_message_with_image(session, caption, file_urls)
-                        else:
-                            reply = await openai_client.process_message_with_image(session, caption, file_urls)
-
-                        await messages[0].reply(reply)
-
-                        # Mark as processed
-                        media_groups[media_group_id]['processed'] = True
-
-            # Start the delayed processing
-            asyncio.create_task(process_media_group())
-        else:
-            # Just add this message to the group for processing later
-            media_groups[media_group_id]['messages'].append(message)
-            # Update caption if this message has the /ask command
-            if message.caption and message.caption.startswith('/ask'):
-                caption = message.caption.replace('/ask', '').strip()
-                media_groups[media_group_id]['caption'] = caption
+    # The album's other parts were buffered by _ask_or_collect, before or after this one
+    async def process_media_group(anchor: Message, items: List[MediaGroupItem]) -> None:
+        ask_captions = [item.caption for item in items if item.caption and item.caption.startswith('/ask')]
+        logger.debug(f"Processing media group {message.media_group_id}. Parts count: {len(items)}")
+        caption = ask_captions[0].replace('/ask', '').strip()
+        if not caption:
+            await anchor.reply("Please add /ask command with your question")
+            return
+
+        reply = await _process_images(
+            anchor.bot, user_id, caption, [item.photo for item in items if item.photo], session_manager, image_pipeline, vision_cache,
+            openai_client, claude_client, gemini_client, grok_client
+        )
+        await answer_long(anchor, reply, as_reply=True)
+
+    media_group_collector.add(message, process_media_group)
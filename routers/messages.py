@@ -1,11 +1,12 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from utils.logging_config import logger
+from utils.send_scheduler import answer_long
 
 router = Router()
 
 @router.message(F.chat.type == "private", F.text)
-async def handle_private_message(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+async def handle_private_message(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client, shadow_manager=None):
     user_id = message.from_user.id
 
     user_message = message.text
@@ -30,10 +31,12 @@ async def handle_private_message(message: Message, session_manager, openai_clien
         logger.info("Using OpenAI client for processing")
         reply = await openai_client.process_message(session, user_message)
 
-    await message.answer(reply)
+    await answer_long(message, reply)
+    if shadow_manager:
+        shadow_manager.mirror(session, reply)
 
 @router.message((F.chat.type == "group") | (F.chat.type == "supergroup"), F.text)
-async def handle_group_message(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client):
+async def handle_group_message(message: Message, session_manager, openai_client, claude_client, gemini_client, grok_client, shadow_manager=None):
     bot_username = (await message.bot.me()).username
     bot_id = (await message.bot.me()).id
     message_text = message.text or "" # Ensure message_text is not None
@@ -132,8 +135,10 @@ async def handle_group_message(message: Message, session_manager, openai_client,
             logger.info(f"Using OpenAI client for user {user_id}")
             reply = await openai_client.process_message(session, user_message)
 
-        await message.reply(reply) # Use reply to keep context in group chat
+        await answer_long(message, reply, as_reply=True) # Use reply to keep context in group chat
         logger.info(f"Successfully processed and replied in group to user {user_id}.")
+        if shadow_manager:
+            shadow_manager.mirror(session, reply)
     except Exception as e:
         logger.error(f"Error processing group message for user {user_id} via AI client: {e}", exc_info=True)
         await message.reply("Sorry, I encountered an error trying to process that.")
@@ -0,0 +1,204 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import clients.flux_client as flux_client
+import clients.flux_scheduler as flux_scheduler
+from clients.flux_scheduler import FluxScheduler, FluxError, FluxJob, MIN_POLL_INTERVAL
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return self.data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """BFL API: every job is Pending until results has an entry for it"""
+
+    closed = False
+
+    def __init__(self):
+        self.submitted = 0
+        self.polls = []
+        self.results = {}
+
+    def post(self, url, json=None):
+        self.submitted += 1
+        return FakeResponse({"id": f"job-{self.submitted}"})
+
+    def get(self, url, params=None):
+        self.polls.append(params["id"])
+        return FakeResponse(self.results.get(params["id"], {"status": "Pending"}))
+
+    async def close(self):
+        pass
+
+
+def make_scheduler(monkeypatch, webhook_url=None, timeout=120):
+    monkeypatch.setattr(flux_scheduler, "FLUX_JOB_TIMEOUT", timeout)
+    scheduler = FluxScheduler("key", "https://api.bfl.ml/v1", webhook_url)
+    scheduler._session = FakeSession()
+    return scheduler
+
+
+async def wait_for_jobs(scheduler, count):
+    while len(scheduler.jobs) < count:
+        await asyncio.sleep(0.001)
+
+
+def test_poll_backoff_grows_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(flux_scheduler, "FLUX_POLL_MAX_INTERVAL", 5)
+    scheduler = make_scheduler(monkeypatch)
+    job = FluxJob(id="job", future=None, submitted_at=0, deadline=0, next_poll_at=0)
+    delays = []
+    for polls in range(1, 10):
+        job.polls = polls
+        delays.append(scheduler._next_poll_delay(job))
+    assert delays == sorted(delays)
+    assert delays[0] == MIN_POLL_INTERVAL * 1.5
+    assert delays[-1] == 5
+
+
+def test_first_poll_follows_average_generation_time(monkeypatch):
+    scheduler = make_scheduler(monkeypatch)
+    scheduler.avg_generation_time = 10
+    assert scheduler._first_poll_delay() == 8
+    scheduler.avg_generation_time = 0.1
+    assert scheduler._first_poll_delay() == MIN_POLL_INTERVAL
+    # With callbacks polling is only a late fallback
+    scheduler.webhook_url = "https://bot.example.com/flux/webhook"
+    monkeypatch.setattr(flux_scheduler, "FLUX_POLL_MAX_INTERVAL", 5)
+    scheduler.avg_generation_time = 10
+    assert scheduler._first_poll_delay() == 20
+
+
+@pytest.mark.asyncio
+async def test_polling_resolves_ready_job(monkeypatch):
+    scheduler = make_scheduler(monkeypatch)
+    scheduler.avg_generation_time = 0
+    scheduler._session.results["job-1"] = {"status": "Ready", "result": {"sample": "https://cdn.bfl.ml/1.jpg"}}
+    assert await asyncio.wait_for(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}), timeout=2) == "https://cdn.bfl.ml/1.jpg"
+    assert scheduler._session.polls == ["job-1"]
+    assert scheduler.jobs == {}
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_job_past_its_deadline_times_out(monkeypatch):
+    scheduler = make_scheduler(monkeypatch, timeout=0.05)
+    with pytest.raises(FluxError, match="timed out"):
+        await asyncio.wait_for(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}), timeout=2)
+    assert scheduler.jobs == {}
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_generations_are_capped(monkeypatch):
+    scheduler = make_scheduler(monkeypatch)
+    scheduler._semaphore = asyncio.Semaphore(2)
+    tasks = [asyncio.create_task(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {})) for _ in range(4)]
+    await wait_for_jobs(scheduler, 2)
+    await asyncio.sleep(0.01)
+    assert scheduler._session.submitted == 2
+
+    for job_id in list(scheduler.jobs):
+        scheduler.handle_webhook({"id": job_id, "status": "SUCCESS", "result": {"sample": job_id}})
+    while scheduler._session.submitted < 4 or len(scheduler.jobs) < 2:
+        await asyncio.sleep(0.001)
+    assert set(scheduler.jobs) == {"job-3", "job-4"}
+    for job_id in list(scheduler.jobs):
+        scheduler.handle_webhook({"id": job_id, "status": "SUCCESS", "result": {"sample": job_id}})
+    assert sorted(await asyncio.gather(*tasks)) == ["job-1", "job-2", "job-3", "job-4"]
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_resolves_ready_and_failed_jobs(monkeypatch):
+    scheduler = make_scheduler(monkeypatch, webhook_url="https://bot.example.com/flux/webhook")
+    ready = asyncio.create_task(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}))
+    failed = asyncio.create_task(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}))
+    await wait_for_jobs(scheduler, 2)
+
+    assert scheduler.handle_webhook({"id": "job-1", "status": "Ready", "result": {"sample": "https://cdn.bfl.ml/1.jpg"}})
+    assert scheduler.handle_webhook({"task_id": "job-2", "status": "FAILED"})
+    assert not scheduler.handle_webhook({"id": "job-unknown", "status": "Ready"})
+
+    assert await ready == "https://cdn.bfl.ml/1.jpg"
+    with pytest.raises(FluxError, match="failed"):
+        await failed
+    # Callbacks arrived before the fallback poll was due
+    assert scheduler._session.polls == []
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_client_rejects_callbacks_without_the_secret(monkeypatch):
+    client = flux_client.FluxClient()
+    client.scheduler.handle_webhook = MagicMock(return_value=True)
+
+    def request(secret):
+        return MagicMock(headers={"X-Webhook-Secret": secret} if secret else {},
+                         json=AsyncMock(return_value={"id": "job-1", "status": "Ready"}))
+
+    monkeypatch.setattr(flux_client, "FLUX_WEBHOOK_SECRET", None)
+    assert (await client.handle_webhook(request(None))).status == 403
+    monkeypatch.setattr(flux_client, "FLUX_WEBHOOK_SECRET", "s3cret")
+    assert (await client.handle_webhook(request("wrong"))).status == 403
+    client.scheduler.handle_webhook.assert_not_called()
+    assert (await client.handle_webhook(request("s3cret"))).status == 200
+    client.scheduler.handle_webhook.assert_called_once()
+
+
+class FlakySession(FakeSession):
+    """Times out, then answers garbage, then the real result"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = list(failures)
+
+    def get(self, url, params=None):
+        self.polls.append(params["id"])
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return FakeResponse(failure)
+        return FakeResponse({"status": "Ready", "result": {"sample": "https://cdn.bfl.ml/1.jpg"}})
+
+
+@pytest.mark.asyncio
+async def test_poll_errors_are_retried_without_killing_the_poller(monkeypatch):
+    monkeypatch.setattr(flux_scheduler, "MIN_POLL_INTERVAL", 0.01)
+    scheduler = make_scheduler(monkeypatch)
+    scheduler.avg_generation_time = 0
+    scheduler._session = FlakySession([asyncio.TimeoutError(), ["not", "a", "dict"], {"status": "Ready", "result": {}}])
+
+    assert await asyncio.wait_for(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}), timeout=2) == "https://cdn.bfl.ml/1.jpg"
+    assert scheduler._session.polls == ["job-1"] * 4
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_deadline_is_enforced_while_polls_keep_failing(monkeypatch):
+    scheduler = make_scheduler(monkeypatch, timeout=0.1)
+    scheduler.avg_generation_time = 0
+    scheduler._session = FlakySession([RuntimeError("boom")] * 100)
+
+    with pytest.raises(FluxError, match="timed out"):
+        await asyncio.wait_for(scheduler.submit("https://api.bfl.ml/v1/flux-pro-1.1", {}), timeout=2)
+    await scheduler.close()
@@ -0,0 +1,154 @@
+import json
+from unittest.mock import AsyncMock
+from urllib.parse import parse_qs
+import httpx
+import instaloader
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from clients.ig_client import IgClient, IgError, parse_media, SHORTCODE_DOC_ID
+from managers.ig_account_pool import IgAccountPool
+from managers.ig_session_manager import IgCheckpointRequired
+
+REEL_ITEM = {
+    "code": "Cx_y-Z12345",
+    "media_type": 2,
+    "product_type": "clips",
+    "original_width": 1080,
+    "original_height": 1920,
+    "video_duration": 14.6,
+    "video_versions": [
+        {"url": "https://cdn.example/low.mp4", "width": 480, "height": 854},
+        {"url": "https://cdn.example/high.mp4", "width": 720, "height": 1280},
+    ],
+}
+
+
+def web_info(*items):
+    return {"data": {"xdt_api__v1__media__shortcode__web_info": {"items": list(items)}}, "status": "ok"}
+
+
+def test_parse_media_picks_largest_video_version():
+    media = parse_media("Cx_y-Z12345", REEL_ITEM)
+    assert media.is_video
+    assert media.video_url == "https://cdn.example/high.mp4"
+    assert (media.width, media.height, media.duration) == (720, 1280, 15)
+    assert media.product_type == "clips"
+
+
+def test_parse_media_image_post_is_not_a_video():
+    media = parse_media("C1a2B3c4D5e", {"code": "C1a2B3c4D5e", "media_type": 1, "original_width": 1080, "original_height": 1080})
+    assert media.media_type == "image"
+    assert not media.is_video
+
+
+@pytest.mark.asyncio
+async def test_get_media_reuses_one_pooled_client_with_session_cookies():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=web_info(REEL_ITEM))
+
+    client = IgClient(IgAccountPool(accounts=[]))
+    client.pool.accounts["anonymous"]._apply_cookies({"sessionid": "abc", "csrftoken": "tok"})
+    client._transport = httpx.MockTransport(handler)
+
+    first = await client.get_media("Cx_y-Z12345")
+    second = await client.get_media("Cx_y-Z12345")
+    await client.close()
+
+    assert first == second
+    assert len(requests) == 2
+    body = parse_qs(requests[0].content.decode())
+    assert body["doc_id"] == [SHORTCODE_DOC_ID]
+    assert json.loads(body["variables"][0])["shortcode"] == "Cx_y-Z12345"
+    assert "sessionid=abc" in requests[0].headers["cookie"]
+    assert requests[0].headers["x-csrftoken"] == "tok"
+
+
+@pytest.mark.asyncio
+async def test_get_media_raises_when_post_is_missing():
+    client = IgClient(IgAccountPool(accounts=[]))
+    client._transport = httpx.MockTransport(lambda request: httpx.Response(200, json=web_info()))
+    with pytest.raises(IgError):
+        await client.get_media("missing")
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_account_cools_down_and_request_moves_to_another():
+    seen = []
+
+    def handler(request):
+        sessionid = request.headers["cookie"].split("sessionid=")[1].split(";")[0]
+        seen.append(sessionid)
+        if sessionid == "first":
+            return httpx.Response(429)
+        return httpx.Response(200, json=web_info(REEL_ITEM))
+
+    pool = IgAccountPool(accounts=[("first", None), ("second", None)], cooldown=60)
+    for name, sessions in pool.accounts.items():
+        sessions._apply_cookies({"sessionid": name})
+        sessions.loaded = True
+    client = IgClient(pool)
+    client._transport = httpx.MockTransport(handler)
+
+    media = await client.get_media("Cx_y-Z12345")
+    assert media.is_video
+    assert seen == ["first", "second"]
+    assert await pool.state.cooling_down(["first", "second"]) == {"first"}
+
+    # The cooled down account is skipped entirely
+    await client.get_media("Cx_y-Z12345")
+    assert seen == ["first", "second", "second"]
+    await client.close()
+
+
+def test_parse_media_carousel_children():
+    item = {
+        "code": "C1a2B3c4D5e", "media_type": 8, "pk": 100,
+        "carousel_media": [
+            {"pk": 101, "media_type": 1, "image_versions2": {"candidates": [
+                {"url": "https://cdn.example/small.jpg", "width": 320, "height": 320},
+                {"url": "https://cdn.example/big.jpg", "width": 1080, "height": 1080},
+            ]}},
+            dict(REEL_ITEM, pk=102, code=None),
+        ],
+    }
+    media = parse_media("C1a2B3c4D5e", item)
+    assert media.media_type == "carousel" and not media.is_video
+    assert [child.id for child in media.items] == ["101", "102"]
+    assert media.items[0].url == "https://cdn.example/big.jpg"
+    assert media.items[1].is_video and media.items[1].url == "https://cdn.example/high.mp4"
+
+
+@pytest.mark.asyncio
+async def test_failed_login_is_raised_as_ig_error():
+    requests = []
+    pool = IgAccountPool(accounts=[("first", "wrong")])
+    pool.accounts["first"].login = AsyncMock(side_effect=instaloader.exceptions.BadCredentialsException("Wrong password."))
+    pool.accounts["first"].session_file = None
+    client = IgClient(pool)
+    client._transport = httpx.MockTransport(lambda request: requests.append(request) or httpx.Response(200, json=web_info(REEL_ITEM)))
+
+    with pytest.raises(IgError, match="Wrong password"):
+        await client.get_media("Cx_y-Z12345")
+    assert not requests
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_on_login_moves_the_request_to_another_account():
+    pool = IgAccountPool(accounts=[("first", "pw"), ("second", None)], cooldown=60)
+    pool.accounts["first"].ensure_session = AsyncMock(side_effect=IgCheckpointRequired("Checkpoint required"))
+    pool.accounts["second"].loaded = True
+    client = IgClient(pool)
+    client._transport = httpx.MockTransport(lambda request: httpx.Response(200, json=web_info(REEL_ITEM)))
+
+    media = await client.get_media("Cx_y-Z12345")
+    assert media.is_video
+    assert await pool.state.cooling_down(["first", "second"]) == {"first"}
+    await client.close()
@@ -0,0 +1,47 @@
+import asyncio
+import base64
+from types import SimpleNamespace
+import pytest
+from unittest.mock import patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import clients.openai_client as openai_client
+from utils.limits import provider_semaphore
+
+
+class FakeAsyncOpenAI:
+    release = None
+
+    def __init__(self, api_key=None):
+        self.images = SimpleNamespace(generate=self.generate)
+
+    async def generate(self, **kwargs):
+        await FakeAsyncOpenAI.release.wait()
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(b"png").decode())])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_image_generation_does_not_take_chat_slots():
+    FakeAsyncOpenAI.release = asyncio.Event()
+    client = openai_client.OpenAIClient()
+    chat = provider_semaphore("openai")
+    images = provider_semaphore("openai-image")
+    free_chat_slots, free_image_slots = chat._value, images._value
+
+    with patch.object(openai_client, "AsyncOpenAI", FakeAsyncOpenAI):
+        generation = asyncio.create_task(client.generate_image("a cat"))
+        while images._value == free_image_slots:
+            await asyncio.sleep(0.001)
+        # The generation is running on its own limiter
+        assert chat._value == free_chat_slots
+        FakeAsyncOpenAI.release.set()
+        assert await generation == b"png"
+    assert images._value == free_image_slots
@@ -0,0 +1,95 @@
+import httpx
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from clients.segmented_downloader import SegmentedDownloader, SegmentedDownloadError
+
+VIDEO = bytes(range(256)) * 40  # 10240 bytes
+URL = "https://cdn.example/video.mp4"
+
+
+def range_server(body, ranges=True, fail_once=None):
+    requests = []
+    failed = set()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.headers.get("Range"))
+        header = request.headers.get("Range")
+        if not ranges or not header:
+            return httpx.Response(200, content=body)
+        start, end = (int(value) for value in header.removeprefix("bytes=").split("-"))
+        end = min(end, len(body) - 1)
+        if fail_once is not None and start == fail_once and start not in failed:
+            failed.add(start)
+            return httpx.Response(503)
+        return httpx.Response(206, content=body[start:end + 1],
+                              headers={"Content-Range": f"bytes {start}-{end}/{len(body)}"})
+
+    return httpx.MockTransport(handler), requests
+
+
+@pytest.mark.asyncio
+async def test_downloads_in_parallel_ranges_into_memory():
+    transport, requests = range_server(VIDEO)
+    downloader = SegmentedDownloader(segment_size=4096, concurrency=2, transport=transport)
+
+    download = await downloader.download(URL)
+    await downloader.close()
+
+    assert download.data == VIDEO and download.path is None
+    assert sorted(requests) == ["bytes=0-4095", "bytes=4096-8191", "bytes=8192-10239"]
+
+
+@pytest.mark.asyncio
+async def test_large_downloads_go_to_a_preallocated_file(tmp_path):
+    transport, _ = range_server(VIDEO)
+    downloader = SegmentedDownloader(segment_size=3000, memory_limit=1024, transport=transport)
+    path = str(tmp_path / "Cx_y-Z12345" / "video.mp4")
+
+    download = await downloader.download(URL, path)
+
+    assert download.path == path and download.data is None
+    assert download.size == len(VIDEO)
+    with open(path, "rb") as f:
+        assert f.read() == VIDEO
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_a_single_stream_without_range_support(tmp_path):
+    transport, requests = range_server(VIDEO, ranges=False)
+    downloader = SegmentedDownloader(segment_size=1024, transport=transport)
+
+    download = await downloader.download(URL)
+
+    assert download.data == VIDEO
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_downloads_without_a_path_stay_under_the_memory_limit():
+    for ranges in (False, True):
+        transport, _ = range_server(VIDEO, ranges=ranges)
+        downloader = SegmentedDownloader(segment_size=1024, memory_limit=4096, transport=transport)
+        with pytest.raises(SegmentedDownloadError):
+            await downloader.download(URL)
+
+
+@pytest.mark.asyncio
+async def test_failed_segment_is_retried_and_gives_up_eventually(tmp_path):
+    transport, requests = range_server(VIDEO, fail_once=4096)
+    downloader = SegmentedDownloader(segment_size=4096, transport=transport)
+    assert (await downloader.download(URL)).data == VIDEO
+    assert requests.count("bytes=4096-8191") == 2
+
+    def broken(request: httpx.Request) -> httpx.Response:
+        if request.headers["Range"] == "bytes=0-4095":
+            return httpx.Response(206, content=VIDEO[:4096], headers={"Content-Range": f"bytes 0-4095/{len(VIDEO)}"})
+        return httpx.Response(503)
+
+    downloader = SegmentedDownloader(segment_size=4096, memory_limit=0, transport=httpx.MockTransport(broken))
+    path = tmp_path / "video.mp4"
+    with pytest.raises(SegmentedDownloadError):
+        await downloader.download(URL, str(path))
+    assert not path.exists()
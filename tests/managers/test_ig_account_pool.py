@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from managers.ig_account_pool import IgAccountPool, IgNoAccountAvailable, is_account_failure
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault("lease_wait", 0)
+    return IgAccountPool(accounts=[("a", None), ("b", None), ("c", None)], **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_account_is_leased_first():
+    pool = make_pool()
+    order = []
+    for _ in range(6):
+        async with pool.lease() as sessions:
+            order.append(sessions.name)
+        await asyncio.sleep(0.001)
+    assert order == ["a", "b", "c", "a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_an_account_has_a_bounded_number_of_leases():
+    pool = make_pool(leases_per_account=2)
+    for sessions in pool.accounts.values():
+        sessions.loaded = True
+    leased = [await pool.acquire() for _ in range(6)]
+    assert sorted(sessions.name for sessions, _ in leased) == ["a", "a", "b", "b", "c", "c"]
+    with pytest.raises(IgNoAccountAvailable):
+        await pool.acquire()
+
+    await pool.release(*leased[1])
+    assert (await pool.acquire())[0].name == leased[1][0].name
+
+
+@pytest.mark.asyncio
+async def test_held_lease_is_refreshed_past_its_ttl():
+    pool = IgAccountPool(accounts=[("a", None)], lease_wait=0, leases_per_account=1)
+    pool.lease_ttl_ms = 150
+    async with pool.lease():
+        await asyncio.sleep(0.4)
+        # Without the refresh the lease would have run out by now
+        with pytest.raises(IgNoAccountAvailable):
+            await pool.acquire()
+    assert (await pool.acquire())[0].name == "a"
+
+
+@pytest.mark.asyncio
+async def test_anonymous_session_has_no_budget():
+    pool = IgAccountPool(accounts=[], budget=1, lease_wait=0)
+    for _ in range(3):
+        async with pool.lease() as sessions:
+            assert sessions.username is None
+
+
+@pytest.mark.asyncio
+async def test_budget_and_cooldown_exclude_accounts():
+    pool = make_pool(budget=1)
+    await pool.penalize(pool.accounts["a"], 429)
+    async with pool.lease() as sessions:
+        assert sessions.name == "b"
+    async with pool.lease() as sessions:
+        assert sessions.name == "c"
+    # b and c used their budget, a is cooling down
+    with pytest.raises(IgNoAccountAvailable):
+        await pool.acquire()
+
+
+@pytest.mark.asyncio
+async def test_auth_failures_drop_the_session():
+    pool = make_pool()
+    sessions = pool.accounts["a"]
+    sessions.loaded = True
+    await pool.penalize(sessions, "Please wait a few minutes before you try again.")
+    assert sessions.loaded
+    await pool.penalize(sessions, 401)
+    assert not sessions.loaded
+
+
+def test_is_account_failure():
+    assert is_account_failure(403)
+    assert is_account_failure(429)
+    assert not is_account_failure(404)
+    assert is_account_failure("JSON Query to graphql/query: 401 Unauthorized")
+    assert not is_account_failure("Post not found")
+
+
+@pytest.mark.asyncio
+async def test_dropped_session_is_not_leased_next_to_its_holders():
+    pool = IgAccountPool(accounts=[("a", None)], lease_wait=0, leases_per_account=2)
+    sessions = pool.accounts["a"]
+    sessions.loaded = True
+    first = await pool.acquire()
+    await pool.penalize(sessions, 401)
+    pool.state.cooldowns.clear()
+
+    # The next holder logs in again, which must not happen under a running request
+    with pytest.raises(IgNoAccountAvailable):
+        await pool.acquire()
+    await pool.release(*first)
+    assert sessions.leases == 0
+    assert (await pool.acquire())[0] is sessions
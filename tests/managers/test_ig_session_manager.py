@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import managers.ig_session_manager as ig_session_manager
+from managers.ig_session_manager import IgSessionManager
+from managers.ig_account_pool import IgAccountPool
+from clients.ig_client import IgClient
+from clients.instaloader import InstaloaderClient
+
+
+class FakeStore:
+    def __init__(self, data=None):
+        self.data = data
+        self.get_session = AsyncMock(side_effect=lambda username: self.data)
+        self.touch = AsyncMock()
+        self.delete_session = AsyncMock()
+
+
+def test_construction_does_no_io():
+    store = FakeStore()
+    pool = IgAccountPool(store, accounts=[("tester", "secret"), ("other", "secret")])
+    InstaloaderClient(pool)
+    IgClient(pool)
+    store.get_session.assert_not_called()
+    assert not any(sessions.loaded for sessions in pool.accounts.values())
+
+
+@pytest.mark.asyncio
+async def test_clients_share_one_session_loaded_once():
+    store = FakeStore({"cookies": {"sessionid": "abc", "csrftoken": "tok"}})
+    pool = IgAccountPool(store, accounts=[("tester", None)])
+    sessions = pool.accounts["tester"]
+    ig_client = IgClient(pool)
+
+    await asyncio.gather(*(sessions.ensure_session() for _ in range(5)))
+
+    assert store.get_session.await_count == 1
+    assert sessions.loader.context._session.cookies.get("sessionid") == "abc"
+    assert ig_client.client_for(sessions).cookies.get("sessionid") == "abc"
+    await ig_client.close()
+
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_a_single_relogin():
+    store = FakeStore()
+    sessions = IgSessionManager(store, "tester", "secret")
+    sessions.session_file = None
+
+    async def fake_login():
+        sessions.version += 1
+        sessions.loaded = True
+
+    with patch.object(ig_session_manager, "IG_SESSIONID", None), \
+         patch.object(sessions.loader, "load_session_from_file", side_effect=FileNotFoundError), \
+         patch.object(sessions, "login", side_effect=fake_login) as login:
+        store.acquire_lock = AsyncMock(return_value=AsyncMock())
+        await asyncio.gather(*(sessions.ensure_session() for _ in range(3)))
+        assert login.await_count == 1
+
+        await sessions.invalidate()
+        store.delete_session.assert_awaited_once_with("tester")
+        await sessions.ensure_session()
+        assert login.await_count == 2
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from managers.insta_job_manager import InstaJobManager, InstaQueueFull
+
+
+class BlockingClient:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.threads = set()
+
+    def download_video(self, url):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return True, f"{url}.mp4"
+
+    async def call(self, executor, action, url):
+        return await asyncio.get_running_loop().run_in_executor(executor, action, url)
+
+
+@pytest.mark.asyncio
+async def test_downloads_run_off_the_event_loop():
+    manager = InstaJobManager(BlockingClient(), workers=2, queue_size=10, max_jobs_per_user=5)
+    manager.start()
+    stages = []
+
+    async def progress(stage):
+        stages.append(stage)
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        results = await asyncio.gather(*(manager.download(1, f"url{n}", progress) for n in range(2)))
+    finally:
+        ticker_task.cancel()
+        await manager.stop()
+
+    assert results == [(True, "url0.mp4"), (True, "url1.mp4")]
+    assert stages == ["downloading", "downloading"]
+    # The loop kept running while both downloads slept in worker threads
+    assert ticks > 10
+    assert all(name.startswith("insta") for name in manager.client.threads)
+    assert manager.user_jobs == {}
+
+
+@pytest.mark.asyncio
+async def test_per_user_and_global_limits():
+    manager = InstaJobManager(BlockingClient(delay=0.1), workers=1, queue_size=2, max_jobs_per_user=1)
+    manager.start()
+    try:
+        first = asyncio.create_task(manager.download(1, "a"))
+        await asyncio.sleep(0)
+        with pytest.raises(InstaQueueFull):
+            await manager.download(1, "b")
+
+        # Worker busy with "a": the queue holds two more jobs, the third is rejected
+        await asyncio.sleep(0.02)
+        others = [asyncio.create_task(manager.download(user_id, "c")) for user_id in (2, 3)]
+        await asyncio.sleep(0)
+        with pytest.raises(InstaQueueFull):
+            await manager.download(4, "d")
+
+        assert await first == (True, "a.mp4")
+        assert [await task for task in others] == [(True, "c.mp4")] * 2
+    finally:
+        await manager.stop()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import pytest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from managers.shadow_manager import ShadowManager
+from utils.limits import provider_semaphore
+
+
+class FakeOpenAIClient:
+    def __init__(self, output="shadow answer"):
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=output))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None),
+        )
+        self.create = AsyncMock(return_value=response)
+
+    @asynccontextmanager
+    async def get_client(self):
+        yield SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+
+def make_manager(tmp_path, client=None, queue_size=100):
+    manager = ShadowManager(client or FakeOpenAIClient(), None)
+    manager.candidates = {"openai": "gpt-4.1-mini", "anthropic": None}
+    manager.sample_rate = 1.0
+    manager.log_path = str(tmp_path / "shadow.jsonl")
+    manager.queue = asyncio.Queue(maxsize=queue_size)
+    return manager
+
+
+def make_session():
+    return SimpleNamespace(
+        last_request={"provider": "openai", "model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}]},
+        last_latency=0.5,
+        last_usage={"input_tokens": 8, "output_tokens": 4},
+    )
+
+
+@pytest.mark.asyncio
+async def test_turn_is_dropped_when_queue_is_full(tmp_path):
+    manager = make_manager(tmp_path, queue_size=1)
+    # Mark as started without workers draining the queue
+    manager.workers = [asyncio.create_task(asyncio.sleep(3600))]
+    manager.mirror(make_session(), "primary answer")
+    manager.mirror(make_session(), "primary answer")
+    assert manager.queue.qsize() == 1
+    assert manager.dropped == 1
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_skipped_when_provider_is_saturated(tmp_path):
+    client = FakeOpenAIClient()
+    manager = make_manager(tmp_path, client)
+    semaphore = provider_semaphore("openai")
+    held = 0
+    while not semaphore.locked():
+        await semaphore.acquire()
+        held += 1
+    try:
+        await manager._run_job({
+            "request": make_session().last_request, "candidate": "gpt-4.1-mini",
+            "primary_output": "primary answer", "primary_latency": 0.5, "primary_usage": {},
+        })
+    finally:
+        for _ in range(held):
+            semaphore.release()
+    client.create.assert_not_awaited()
+    assert manager.dropped == 1
+    assert not os.path.exists(manager.log_path)
+
+
+@pytest.mark.asyncio
+async def test_writes_jsonl_record_and_stops_cleanly(tmp_path):
+    client = FakeOpenAIClient()
+    manager = make_manager(tmp_path, client)
+    manager.start()
+    manager.mirror(make_session(), "primary answer")
+    await asyncio.wait_for(manager.queue.join(), timeout=2)
+    await manager.stop()
+
+    assert manager.workers == []
+    assert client.create.await_args.kwargs["model"] == "gpt-4.1-mini"
+    with open(manager.log_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    record = records[0]
+    assert record["primary_model"] == "gpt-4o-mini"
+    assert record["shadow_model"] == "gpt-4.1-mini"
+    assert record["primary_latency_ms"] == 500
+    assert record["primary_output"] == "primary answer"
+    assert record["shadow_output"] == "shadow answer"
+    assert record["shadow_usage"]["output_tokens"] == 5
+    assert "error" not in record
+
+
+@pytest.mark.asyncio
+async def test_mirror_is_a_noop_after_stop(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.start()
+    await manager.stop()
+    manager.mirror(make_session(), "primary answer")
+    assert manager.queue.empty()
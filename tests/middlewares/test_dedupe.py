@@ -0,0 +1,57 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.update_dedupe import UpdateDedupe
+from middlewares.dedupe import UpdateDedupeMiddleware
+
+
+class FakeRedis:
+    """SET NX shared between replicas"""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = 0
+
+    async def set(self, key, value, nx=False, ex=None):
+        self.calls += 1
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+
+async def feed(middleware, update_id):
+    handler = AsyncMock(return_value="handled")
+    result = await middleware(handler, SimpleNamespace(update_id=update_id), {"bot": SimpleNamespace(id=42)})
+    return result, handler.await_count
+
+
+@pytest.mark.asyncio
+async def test_duplicate_update_is_skipped_in_process():
+    middleware = UpdateDedupeMiddleware(UpdateDedupe())
+    assert await feed(middleware, 1) == ("handled", 1)
+    assert await feed(middleware, 1) == (None, 0)
+    assert await feed(middleware, 2) == ("handled", 1)
+
+
+@pytest.mark.asyncio
+async def test_only_one_replica_handles_an_update():
+    redis = FakeRedis()
+    first, second = UpdateDedupeMiddleware(UpdateDedupe(redis)), UpdateDedupeMiddleware(UpdateDedupe(redis))
+    assert await feed(first, 7) == ("handled", 1)
+    assert await feed(second, 7) == (None, 0)
+    # The local LRU answers repeats without asking Redis
+    calls = redis.calls
+    assert await feed(first, 7) == (None, 0)
+    assert redis.calls == calls
+
+
+@pytest.mark.asyncio
+async def test_redis_failure_lets_updates_through():
+    redis = FakeRedis()
+    redis.set = AsyncMock(side_effect=ConnectionError("down"))
+    assert await feed(UpdateDedupeMiddleware(UpdateDedupe(redis)), 3) == ("handled", 1)
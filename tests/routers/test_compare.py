@@ -0,0 +1,66 @@
+import datetime
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram.types import Message, User, Chat
+
+from managers.session_manager import SessionManager, Session
+from routers.commands import handle_compare_command
+
+
+def make_client(api_key="key"):
+    client = MagicMock()
+    client.api_key = api_key
+    return client
+
+
+async def fake_process(self, message, client):
+    """Mimic Session.process_* by appending to the session history"""
+    self.data['messages'].append({"role": "user", "content": message})
+    reply = f"{self.get_provider()} says hi"
+    self.data['messages'].append({"role": "assistant", "content": reply})
+    self.last_usage = {"input_tokens": 3, "output_tokens": 5, "cached_tokens": 0}
+    return reply
+
+
+@pytest.fixture
+def compare_message():
+    message = Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=42, is_bot=False, first_name="Tester"),
+        text="/compare What is 2+2?",
+    )
+    return message
+
+
+@pytest.mark.asyncio
+async def test_compare_fans_out_without_touching_history(compare_message):
+    session_manager = SessionManager()
+    history_before = list(session_manager.get_or_create_session(42).data['messages'])
+
+    with patch.object(Session, "process_openai_message", fake_process), \
+         patch.object(Session, "process_claude_message", fake_process), \
+         patch.object(Session, "process_gemini_message", fake_process), \
+         patch.object(Session, "process_grok_message", fake_process), \
+         patch.object(Message, "answer", new_callable=AsyncMock) as answer:
+        await handle_compare_command(
+            compare_message,
+            session_manager=session_manager,
+            openai_client=make_client(),
+            claude_client=make_client(),
+            gemini_client=make_client(api_key=None),
+            grok_client=make_client(),
+        )
+
+    replies = [call.args[0] for call in answer.call_args_list]
+    # One progress message plus one answer per configured provider
+    assert len(replies) == 4
+    assert any("openai says hi" in reply for reply in replies)
+    assert any("anthropic says hi" in reply for reply in replies)
+    assert not any("gemini says hi" in reply for reply in replies)
+    assert all("3 in / 5 out tokens" in reply for reply in replies[1:])
+    assert session_manager.get_or_create_session(42).data['messages'] == history_before
@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram import Dispatcher
+from aiogram.types import Message, Update
+
+import routers.media as media
+from middlewares.subscription import SubscriptionMiddleware
+
+GROUP_ID = -100123456789
+USER_ID = 12345
+
+
+@pytest.fixture(scope="module")
+def subscription_manager():
+    return MagicMock()
+
+
+@pytest.fixture(scope="module")
+def dp(subscription_manager):
+    # The media router can only be attached once
+    dispatcher = Dispatcher()
+    dispatcher.message.middleware(SubscriptionMiddleware(subscription_manager))
+    dispatcher.include_router(media.router)
+    return dispatcher
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    collector = media.MediaGroupCollector(min_quiet=0.01, max_quiet=0.05, max_wait=0.5)
+    monkeypatch.setattr(media, "media_group_collector", collector)
+    return collector
+
+
+@pytest.fixture
+def bot():
+    bot = MagicMock()
+    bot.id = 42
+    bot.get_chat = AsyncMock(return_value=SimpleNamespace(id=-1001))
+    return bot
+
+
+def _album_part(update_id, message_id, group_id, caption=None):
+    message = {
+        "message_id": message_id,
+        "date": datetime.datetime.now(),
+        "chat": {"id": GROUP_ID, "type": "supergroup", "title": "Test Group"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Test User"},
+        "media_group_id": group_id,
+        "photo": [{"file_id": f"file-{message_id}", "file_unique_id": f"unique-{message_id}", "width": 10, "height": 10}],
+    }
+    if caption:
+        message["caption"] = caption
+    return Update.model_validate({"update_id": update_id, "message": message})
+
+
+def _deps():
+    return dict(session_manager=MagicMock(), image_pipeline=MagicMock(), vision_cache=MagicMock(),
+                openai_client=MagicMock(), claude_client=MagicMock(), gemini_client=MagicMock(), grok_client=MagicMock())
+
+
+@pytest.mark.asyncio
+async def test_album_without_ask_reaches_no_handler_and_no_subscription_check(dp, subscription_manager, collector, bot):
+    subscription_manager.is_subscriber = AsyncMock(return_value=False)
+    with patch.object(media, "_process_images", new=AsyncMock(return_value="answer")) as process, \
+         patch.object(Message, "answer", new=AsyncMock()) as answer, \
+         patch.object(Message, "reply", new=AsyncMock()) as reply:
+        for n in range(3):
+            await dp.feed_update(bot, _album_part(100 + n, 200 + n, "album-1"), **_deps())
+        await asyncio.sleep(0.6)
+        await collector.drain()
+
+    subscription_manager.is_subscriber.assert_not_awaited()
+    process.assert_not_awaited()
+    answer.assert_not_awaited()
+    reply.assert_not_awaited()
+    assert not collector.groups
+
+
+@pytest.mark.asyncio
+async def test_album_with_ask_collects_parts_seen_before_and_after(dp, subscription_manager, collector, bot):
+    subscription_manager.is_subscriber = AsyncMock(return_value=True)
+    with patch.object(media, "_process_images", new=AsyncMock(return_value="answer")) as process, \
+         patch.object(Message, "reply", new=AsyncMock()) as reply:
+        await dp.feed_update(bot, _album_part(110, 210, "album-2"), **_deps())
+        await dp.feed_update(bot, _album_part(111, 211, "album-2", caption="/ask what is this?"), **_deps())
+        await dp.feed_update(bot, _album_part(112, 212, "album-2"), **_deps())
+        await collector.drain()
+
+    # Only the part with /ask went through the middlewares
+    subscription_manager.is_subscriber.assert_awaited_once()
+    process.assert_awaited_once()
+    caption, photos = process.await_args.args[2], process.await_args.args[3]
+    assert caption == "what is this?"
+    assert [sizes[0].file_id for sizes in photos] == ["file-210", "file-211", "file-212"]
+    reply.assert_awaited_once_with("answer")
+
+
+@pytest.mark.asyncio
+async def test_long_album_answer_is_split(dp, subscription_manager, collector, bot):
+    subscription_manager.is_subscriber = AsyncMock(return_value=True)
+    answer = "word " * 1500
+    with patch.object(media, "_process_images", new=AsyncMock(return_value=answer)), \
+         patch.object(Message, "reply", new=AsyncMock()) as reply:
+        await dp.feed_update(bot, _album_part(120, 220, "album-3", caption="/ask describe"), **_deps())
+        await dp.feed_update(bot, _album_part(121, 221, "album-3"), **_deps())
+        await collector.drain()
+
+    assert reply.await_count == 2
+    assert all(len(call.args[0]) <= 4096 for call in reply.await_args_list)
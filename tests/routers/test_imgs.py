@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import itertools
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram.types import Message, User, Chat
+
+from config import IMG_MAX_BATCH
+from utils.image_cache import ImageCache
+from routers.commands import handle_imgs_command
+
+file_ids = itertools.count(1)
+
+
+def make_client(image_model, result=None, error=None):
+    client = MagicMock()
+    client.api_key = "key"
+    client.image_model = image_model
+    client.image_size = "1024x1024"
+    client.generate_image = AsyncMock(return_value=result, side_effect=error)
+    return client
+
+
+def make_message(text):
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=42, is_bot=False, first_name="Tester"),
+        text=text,
+    )
+
+
+def sent_photo(*args, **kwargs):
+    return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{next(file_ids)}")])
+
+
+async def run(text, openai_client, flux_client, image_cache):
+    with patch.object(Message, "answer", new_callable=AsyncMock) as answer, \
+         patch.object(Message, "answer_photo", new=AsyncMock(side_effect=sent_photo)) as answer_photo, \
+         patch.object(Message, "answer_media_group", new=AsyncMock(side_effect=lambda media: [sent_photo() for _ in media])) as answer_media_group:
+        await handle_imgs_command(make_message(text), openai_client=openai_client, flux_client=flux_client, image_cache=image_cache)
+    return [call.args[0] for call in answer.call_args_list], answer_photo, answer_media_group
+
+
+@pytest.mark.asyncio
+async def test_count_is_clamped_to_the_batch_limit():
+    openai_client = make_client("dall-e-3", result=b"png")
+    flux_client = make_client("flux-pro-1.1", result="https://cdn.bfl.ml/image.jpg")
+
+    replies, answer_photo, _ = await run("/imgs 50 a cat", openai_client, flux_client, ImageCache())
+
+    assert replies[0].startswith(f"Generating {IMG_MAX_BATCH} images")
+    assert answer_photo.await_count == IMG_MAX_BATCH
+    assert openai_client.generate_image.await_count + flux_client.generate_image.await_count == IMG_MAX_BATCH
+
+
+@pytest.mark.asyncio
+async def test_album_reports_partial_failure():
+    openai_client = make_client("dall-e-3", result=b"png")
+    flux_client = make_client("flux-pro-1.1", error=RuntimeError("moderated"))
+
+    replies, answer_photo, answer_media_group = await run("/imgs 2 album a cat", openai_client, flux_client, ImageCache())
+
+    # The one image that worked goes out alone
+    answer_media_group.assert_not_awaited()
+    assert answer_photo.await_args.kwargs["caption"] == "OPENAI"
+    assert replies[-1] == "Failed to generate 1 of 2 images (FLUX)"
+
+
+@pytest.mark.asyncio
+async def test_cached_variants_are_resent_without_generating():
+    openai_client = make_client("dall-e-3", result=b"png")
+    flux_client = make_client("flux-pro-1.1", result="https://cdn.bfl.ml/image.jpg")
+    image_cache = ImageCache()
+
+    _, first, _ = await run("/imgs 2 a cat", openai_client, flux_client, image_cache)
+    _, second, _ = await run("/imgs 2 A  cat", openai_client, flux_client, image_cache)
+
+    assert openai_client.generate_image.await_count == 1
+    assert flux_client.generate_image.await_count == 1
+    first_ids = {await image_cache.get(key) for key in list(image_cache.local._data)}
+    assert {call.args[0] for call in second.call_args_list} == first_ids
+
+
+@pytest.mark.asyncio
+async def test_concurrent_albums_share_generations_and_the_cache():
+    async def slow_png(prompt):
+        await asyncio.sleep(0.05)
+        return b"png"
+
+    async def slow_url(prompt):
+        await asyncio.sleep(0.05)
+        return "https://cdn.bfl.ml/image.jpg"
+
+    openai_client = make_client("dall-e-3")
+    openai_client.generate_image = AsyncMock(side_effect=slow_png)
+    flux_client = make_client("flux-pro-1.1")
+    flux_client.generate_image = AsyncMock(side_effect=slow_url)
+    image_cache = ImageCache()
+
+    with patch.object(Message, "answer", new_callable=AsyncMock), \
+         patch.object(Message, "answer_media_group", new=AsyncMock(side_effect=lambda media: [sent_photo() for _ in media])) as albums:
+        send = lambda: handle_imgs_command(make_message("/imgs 2 album a cat"), openai_client=openai_client,
+                                           flux_client=flux_client, image_cache=image_cache)
+        await asyncio.gather(send(), send())
+        await send()
+
+    assert openai_client.generate_image.await_count == 1
+    assert flux_client.generate_image.await_count == 1
+    cached = {await image_cache.get(key) for key in list(image_cache.local._data)}
+    medias = [{media.media for media in call.args[0]} for call in albums.await_args_list]
+    # One album uploaded the images, the other two resent their file_ids
+    assert len(medias) == 3 and medias.count(cached) == 2
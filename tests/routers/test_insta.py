@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram.types import Message, User, Chat, FSInputFile, URLInputFile, InputMediaPhoto, InputMediaVideo
+from aiogram.exceptions import TelegramBadRequest
+
+from utils.insta_cache import InstaCache
+from clients.ig_client import IgMedia
+from managers.insta_job_manager import InstaUserLimit
+from routers.commands import cmd_insta
+
+REEL_URL = "https://www.instagram.com/reel/Cx_y-Z12345/?igsh=abc"
+
+
+@pytest.fixture
+def insta_message():
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=42, is_bot=False, first_name="Tester"),
+        text=f"/insta {REEL_URL}",
+    )
+
+
+def make_jobs():
+    jobs = MagicMock()
+    jobs.resolve_media = AsyncMock(return_value=(True, IgMedia(
+        shortcode="Cx_y-Z12345", media_type="video", video_url="https://cdn.example/video.mp4",
+    )))
+    jobs.download = AsyncMock(return_value=(True, "downloads/Cx_y-Z12345/video.mp4"))
+    return jobs
+
+
+def sent_video(file_id="file-id"):
+    return SimpleNamespace(video=SimpleNamespace(file_id=file_id))
+
+
+@pytest.mark.asyncio
+async def test_video_url_is_passed_to_telegram_and_cached(insta_message):
+    jobs, cache = make_jobs(), InstaCache()
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_video", new=AsyncMock(return_value=sent_video())) as answer_video:
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache)
+
+    answer_video.assert_awaited_once_with("https://cdn.example/video.mp4")
+    jobs.download.assert_not_awaited()
+    assert await cache.get("Cx_y-Z12345") == "file-id"
+    status.delete.assert_awaited_once()
+
+    # The second request reuses the file_id without any Instagram work
+    with patch.object(Message, "answer_video", new=AsyncMock()) as answer_video:
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache)
+    answer_video.assert_awaited_once_with("file-id")
+    assert jobs.resolve_media.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_streaming_then_to_download(insta_message):
+    jobs, cache = make_jobs(), InstaCache()
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+    answer_video = AsyncMock(side_effect=[Exception("failed to get HTTP URL content"), Exception("stream broke"), sent_video()])
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_video", new=answer_video):
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache)
+
+    sent = [call.args[0] for call in answer_video.await_args_list]
+    assert sent[0] == "https://cdn.example/video.mp4"
+    assert isinstance(sent[1], URLInputFile) and sent[1].url == "https://cdn.example/video.mp4"
+    assert isinstance(sent[2], FSInputFile)
+    jobs.download.assert_awaited_once()
+    assert await cache.get("Cx_y-Z12345") == "file-id"
+
+
+@pytest.mark.asyncio
+async def test_async_metadata_path_skips_the_worker_pool(insta_message):
+
+    jobs, cache = make_jobs(), InstaCache()
+    ig_client = MagicMock()
+    ig_client.get_media = AsyncMock(return_value=IgMedia(
+        shortcode="Cx_y-Z12345", media_type="video", video_url="https://cdn.example/high.mp4",
+        width=720, height=1280, duration=15,
+    ))
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_video", new=AsyncMock(return_value=sent_video())) as answer_video:
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache, ig_client=ig_client)
+
+    ig_client.get_media.assert_awaited_once_with("Cx_y-Z12345")
+    answer_video.assert_awaited_once_with("https://cdn.example/high.mp4", width=720, height=1280, duration=15)
+    jobs.resolve_media.assert_not_awaited()
+    jobs.download.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_segmented_download_replaces_streaming(insta_message):
+    from clients.segmented_downloader import Download
+    from utils.bot_api import MemoryInputFile
+
+    jobs, cache = make_jobs(), InstaCache()
+    downloader = MagicMock()
+    downloader.download = AsyncMock(return_value=Download(size=4, data=memoryview(bytearray(b"mp4!"))))
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+    answer_video = AsyncMock(side_effect=[Exception("failed to get HTTP URL content"), sent_video()])
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_video", new=answer_video):
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache, insta_downloader=downloader)
+
+    assert downloader.download.await_args.args[0] == "https://cdn.example/video.mp4"
+    uploaded = answer_video.await_args_list[1].args[0]
+    assert isinstance(uploaded, MemoryInputFile) and uploaded.data == b"mp4!"
+    jobs.download.assert_not_awaited()
+
+
+def photo_or_video(media):
+    if isinstance(media, InputMediaVideo):
+        return sent_video(f"video-{media.media}")
+    return SimpleNamespace(photo=[SimpleNamespace(file_id=f"photo-{media.media}")])
+
+
+@pytest.mark.asyncio
+async def test_carousel_is_sent_as_albums_of_ten(insta_message):
+    items = [
+        IgMedia(shortcode="Cx_y-Z12345", media_type="video" if i % 3 == 0 else "image", id=str(i),
+                video_url=f"https://cdn.example/{i}.mp4" if i % 3 == 0 else None, image_url=f"https://cdn.example/{i}.jpg")
+        for i in range(12)
+    ]
+    carousel = IgMedia(shortcode="Cx_y-Z12345", media_type="carousel", items=items)
+    ig_client = MagicMock(get_media=AsyncMock(return_value=carousel))
+    jobs, cache = make_jobs(), InstaCache()
+    await cache.set("Cx_y-Z12345:1", "cached-photo")
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+
+    async def answer_media_group(media):
+        return [photo_or_video(item) for item in media]
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_media_group", new=AsyncMock(side_effect=answer_media_group)) as send_group:
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache, ig_client=ig_client)
+
+    albums = [call.args[0] for call in send_group.await_args_list]
+    assert [len(album) for album in albums] == [10, 2]
+    assert albums[0][1].media == "cached-photo"
+    assert isinstance(albums[0][0], InputMediaVideo) and albums[0][0].media == "https://cdn.example/0.mp4"
+    assert isinstance(albums[1][0], InputMediaPhoto)
+    assert await cache.get("Cx_y-Z12345:0") == "video-https://cdn.example/0.mp4"
+    assert await cache.get("Cx_y-Z12345:11") == "photo-https://cdn.example/11.jpg"
+    jobs.download.assert_not_awaited()
+    status.delete.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_follower_retries_when_the_leader_hits_its_own_job_limit(insta_message):
+    follower_message = insta_message.model_copy(update={"message_id": 2, "from_user": User(id=43, is_bot=False, first_name="Other")})
+    leader_waiting = asyncio.Event()
+    release_leader = asyncio.Event()
+
+    async def resolve_media(user_id, url, progress=None):
+        if user_id == 42:
+            leader_waiting.set()
+            await release_leader.wait()
+            raise InstaUserLimit("You already have 2 Instagram downloads in progress, please wait")
+        return True, IgMedia(shortcode="Cx_y-Z12345", media_type="video", video_url="https://cdn.example/video.mp4")
+
+    jobs, cache = make_jobs(), InstaCache()
+    jobs.resolve_media = AsyncMock(side_effect=resolve_media)
+    leader_status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+    follower_status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+
+    with patch.object(Message, "answer", new=AsyncMock(side_effect=[leader_status, follower_status])), \
+         patch.object(Message, "answer_video", new=AsyncMock(return_value=sent_video())) as answer_video:
+        leader = asyncio.create_task(cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache))
+        await leader_waiting.wait()
+        follower = asyncio.create_task(cmd_insta(follower_message, insta_jobs=jobs, insta_cache=cache))
+        await asyncio.sleep(0)
+        release_leader.set()
+        await asyncio.gather(leader, follower)
+
+    leader_status.edit_text.assert_awaited_once_with("You already have 2 Instagram downloads in progress, please wait")
+    follower_status.edit_text.assert_awaited_once_with("⬆️ Uploading...")
+    follower_status.delete.assert_awaited_once()
+    assert [call.kwargs.get("user_id", call.args[0]) for call in jobs.resolve_media.await_args_list] == [42, 43]
+    answer_video.assert_awaited_once_with("https://cdn.example/video.mp4")
+    assert await cache.get("Cx_y-Z12345") == "file-id"
+
+
+@pytest.mark.asyncio
+async def test_rejected_album_upload_is_reported_as_a_failed_download(insta_message):
+    items = [IgMedia(shortcode="Cx_y-Z12345", media_type="image", id=str(i), image_url=f"https://cdn.example/{i}.jpg") for i in range(2)]
+    ig_client = MagicMock(get_media=AsyncMock(return_value=IgMedia(shortcode="Cx_y-Z12345", media_type="carousel", items=items)))
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+    error = TelegramBadRequest(method=MagicMock(), message="Bad Request: failed to get HTTP URL content")
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_media_group", new=AsyncMock(side_effect=error)):
+        await cmd_insta(insta_message, insta_jobs=make_jobs(), insta_cache=InstaCache(), ig_client=ig_client)
+
+    status.edit_text.assert_awaited_with("Something went wrong: Telegram server says - Bad Request: failed to get HTTP URL content")
+    status.delete.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_unexpected_failure_is_reported_on_the_status_message(insta_message):
+    jobs, cache = make_jobs(), InstaCache()
+    jobs.download = AsyncMock(side_effect=RuntimeError("worker crashed"))
+    status = MagicMock(edit_text=AsyncMock(), delete=AsyncMock())
+
+    with patch.object(Message, "answer", new=AsyncMock(return_value=status)), \
+         patch.object(Message, "answer_video", new=AsyncMock(side_effect=Exception("failed to get HTTP URL content"))):
+        await cmd_insta(insta_message, insta_jobs=jobs, insta_cache=cache)
+
+    status.edit_text.assert_awaited_with("Something went wrong while downloading this post, please try again later")
+    status.delete.assert_not_awaited()
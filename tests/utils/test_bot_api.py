@@ -0,0 +1,49 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram.client.telegram import TelegramAPIServer, SimpleFilesPathWrapper, BareFilesPathWrapper, PRODUCTION
+from aiogram.types import FSInputFile
+
+from utils.bot_api import local_file_path, upload_file, MemoryInputFile
+
+
+def make_bot(api):
+    return SimpleNamespace(session=SimpleNamespace(api=api))
+
+
+def test_cloud_api_downloads_and_uploads():
+    bot = make_bot(PRODUCTION)
+    assert local_file_path(bot, "photos/file_1.jpg") is None
+    assert isinstance(upload_file(bot, "downloads/abc/abc.mp4"), FSInputFile)
+
+
+def test_local_mode_maps_paths_between_server_and_bot(tmp_path):
+    wrapper = SimpleFilesPathWrapper(Path("/var/lib/telegram-bot-api"), tmp_path)
+    bot = make_bot(TelegramAPIServer.from_base("http://localhost:8081", is_local=True, wrap_local_file=wrapper))
+
+    server_path = "/var/lib/telegram-bot-api/123:ABC/photos/file_1.jpg"
+    assert local_file_path(bot, server_path) == str(tmp_path / "123:ABC" / "photos" / "file_1.jpg")
+
+    video = tmp_path / "downloads" / "abc.mp4"
+    assert upload_file(bot, str(video)) == "file:///var/lib/telegram-bot-api/downloads/abc.mp4"
+    # Files the server can't see are uploaded as usual
+    assert isinstance(upload_file(bot, "/elsewhere/abc.mp4"), FSInputFile)
+    assert local_file_path(bot, "/elsewhere/file_1.jpg") is None
+
+
+def test_local_mode_without_shared_directory_uploads():
+    bot = make_bot(TelegramAPIServer.from_base("http://localhost:8081", is_local=True, wrap_local_file=BareFilesPathWrapper()))
+    assert isinstance(upload_file(bot, "/srv/downloads/abc/abc.mp4"), FSInputFile)
+
+
+@pytest.mark.asyncio
+async def test_memory_input_file_uploads_the_buffer_in_chunks():
+    data = memoryview(bytearray(range(256)) * 3)
+    upload = MemoryInputFile(data, filename="video.mp4", chunk_size=500)
+    chunks = [chunk async for chunk in upload.read(None)]
+    assert [len(chunk) for chunk in chunks] == [500, 268]
+    assert b"".join(chunks) == data
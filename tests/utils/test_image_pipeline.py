@@ -0,0 +1,69 @@
+import base64
+import io
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from PIL import Image
+from aiogram.client.telegram import TelegramAPIServer
+
+from utils.image_pipeline import ImagePipeline, pick_photo_size, parse_data_url, _resize_to_data_url
+
+SIZES = [
+    SimpleNamespace(file_id="s", width=90, height=60),
+    SimpleNamespace(file_id="m", width=800, height=533),
+    SimpleNamespace(file_id="l", width=1280, height=853),
+    SimpleNamespace(file_id="xl", width=2560, height=1706),
+]
+
+
+def jpeg_bytes(width, height):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, format="JPEG")
+    return output.getvalue()
+
+
+def test_pick_photo_size_uses_smallest_sufficient_variant():
+    # OpenAI scales the short side to 768, so 1280x853 is enough
+    assert pick_photo_size(SIZES, "openai").file_id == "l"
+    # Claude wants up to 1568 on the long side
+    assert pick_photo_size(SIZES, "anthropic").file_id == "xl"
+    # Falls back to the largest available size
+    assert pick_photo_size(SIZES[:2], "anthropic").file_id == "m"
+
+
+def test_resize_fits_provider_limits():
+    media_type, data = parse_data_url(_resize_to_data_url(jpeg_bytes(2560, 1706), (1568, 1568), 85))
+    assert media_type == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+        assert max(image.size) == 1568
+
+
+@pytest.mark.asyncio
+async def test_prepare_caches_get_file_and_skips_reencoding_small_photos():
+    original = jpeg_bytes(800, 533)
+    bot = AsyncMock()
+    bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path="photos/file_1.jpg"))
+    bot.download_file = AsyncMock(side_effect=lambda path: io.BytesIO(original))
+
+    pipeline = ImagePipeline()
+    urls = await pipeline.prepare_many(bot, [SIZES[:2], SIZES[:2]], "openai")
+
+    assert bot.get_file.await_count == 1
+    assert all(base64.b64decode(parse_data_url(url)[1]) == original for url in urls)
+
+
+@pytest.mark.asyncio
+async def test_prepare_reads_local_mode_files_in_place(tmp_path):
+    original = jpeg_bytes(800, 533)
+    (tmp_path / "file_1.jpg").write_bytes(original)
+    bot = AsyncMock()
+    bot.session = SimpleNamespace(api=TelegramAPIServer.from_base("http://localhost:8081", is_local=True))
+    bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path=str(tmp_path / "file_1.jpg")))
+
+    url = await ImagePipeline().prepare(bot, SIZES[:2], "openai")
+
+    bot.download_file.assert_not_awaited()
+    assert base64.b64decode(parse_data_url(url)[1]) == original
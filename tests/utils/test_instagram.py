@@ -0,0 +1,53 @@
+import os, sys
+import time
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.instagram import extract_shortcode
+from utils.disk_janitor import DiskJanitor
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.instagram.com/p/C1a2B3c4D5e/", "C1a2B3c4D5e"),
+    ("https://www.instagram.com/p/C1a2B3c4D5e", "C1a2B3c4D5e"),
+    ("https://www.instagram.com/reel/Cx_y-Z12345/?igsh=MWQ1ZGUxMzBkMA==", "Cx_y-Z12345"),
+    ("https://instagram.com/reels/Cx_y-Z12345/", "Cx_y-Z12345"),
+    ("https://www.instagram.com/tv/B8abcdEFGhi/?utm_source=ig_web_copy_link", "B8abcdEFGhi"),
+    ("https://m.instagram.com/p/C1a2B3c4D5e/?img_index=2#comments", "C1a2B3c4D5e"),
+    ("https://www.instagram.com/some.user/reel/Cx_y-Z12345/", "Cx_y-Z12345"),
+    ("https://www.instagram.com/some.user/", None),
+    ("https://www.instagram.com/stories/some.user/123/", None),
+])
+def test_extract_shortcode(url, expected):
+    assert extract_shortcode(url) == expected
+
+
+def _write(path, size, age):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_janitor_bounds_directory_by_age_and_size(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "expired", "video.mp4"), 10, age=7200)
+    _write(os.path.join(root, "old", "video.mp4"), 100, age=1800)
+    _write(os.path.join(root, "older", "video.mp4"), 100, age=2400)
+    _write(os.path.join(root, "fresh", "video.mp4"), 100, age=10)
+
+    janitor = DiskJanitor(root, max_bytes=250, max_age=3600, grace=60)
+    removed, freed = janitor.sweep()
+
+    assert (removed, freed) == (2, 110)
+    assert sorted(os.listdir(root)) == ["fresh", "old"]
+
+
+def test_janitor_keeps_files_within_grace_period(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "a", "video.mp4"), 100, age=5)
+    _write(os.path.join(root, "b", "video.mp4"), 100, age=5)
+
+    janitor = DiskJanitor(root, max_bytes=50, max_age=3600, grace=60)
+    assert janitor.sweep() == (0, 0)
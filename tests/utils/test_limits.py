@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.limits import KeyedLimiter
+
+
+@pytest.mark.asyncio
+async def test_limit_applies_per_key_and_is_released():
+    limiter = KeyedLimiter(1)
+    order = []
+
+    async def job(key, name, delay):
+        async with limiter.acquire(key):
+            order.append(f"{name} start")
+            await asyncio.sleep(delay)
+            order.append(f"{name} end")
+
+    first = asyncio.create_task(job(1, "a", 0.05))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(job(1, "b", 0))
+    other = asyncio.create_task(job(2, "c", 0))
+    await asyncio.sleep(0.01)
+    # User 1 waits for its first job, user 2 doesn't
+    assert order == ["a start", "c start", "c end"]
+    assert limiter.active(1) == 2
+
+    await asyncio.gather(first, second, other)
+    assert order[3:] == ["a end", "b start", "b end"]
+    # Idle keys are dropped
+    assert limiter.active(1) == 0
+    assert limiter._semaphores == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_job_releases_its_slot():
+    limiter = KeyedLimiter(1)
+    with pytest.raises(RuntimeError):
+        async with limiter.acquire(1):
+            raise RuntimeError("boom")
+    async with limiter.acquire(1):
+        assert limiter.active(1) == 1
@@ -0,0 +1,51 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.markdown_entities import render_markdown
+
+
+def spans(text, entities):
+    """Entity texts, cut out by UTF-16 offsets like Telegram does"""
+    encoded = text.encode("utf-16-le")
+    return [(entity.type, encoded[entity.offset * 2:(entity.offset + entity.length) * 2].decode("utf-16-le"))
+            for entity in entities]
+
+
+def test_inline_formatting():
+    text, entities = render_markdown("Some **bold _nested_** text, `x_y`, ~~old~~ and [docs](https://example.com)")
+    assert text == "Some bold nested text, x_y, old and docs"
+    assert spans(text, entities) == [
+        ("bold", "bold nested"), ("italic", "nested"), ("code", "x_y"), ("strikethrough", "old"), ("text_link", "docs"),
+    ]
+    assert entities[-1].url == "https://example.com"
+
+
+def test_plain_text_has_no_entities():
+    text = "snake_case_name costs 2 * 3 = 6 (approx.) - see file_name.py!"
+    assert render_markdown(text) == (text, [])
+
+
+def test_offsets_count_utf16_units():
+    text, entities = render_markdown("😀😀 **bold** 👍 `code`")
+    assert text == "😀😀 bold 👍 code"
+    assert [(entity.offset, entity.length) for entity in entities] == [(5, 4), (13, 4)]
+    assert spans(text, entities) == [("bold", "bold"), ("code", "code")]
+
+
+def test_blocks():
+    source = "# Title\n\n- one\n* two\n\n```python\nif x:\n    return **y**\n```\n> quoted\n> lines\nafter"
+    text, entities = render_markdown(source)
+    assert text == "Title\n\n• one\n• two\n\nif x:\n    return **y**\nquoted\nlines\nafter"
+    assert spans(text, entities) == [("bold", "Title"), ("pre", "if x:\n    return **y**"), ("blockquote", "quoted\nlines")]
+    assert entities[1].language == "python"
+
+
+def test_unterminated_fence_and_unknown_links_stay_safe():
+    text, entities = render_markdown("[file](./local.md)\n```\ncode without end")
+    assert text == "[file](./local.md)\ncode without end"
+    assert spans(text, entities) == [("pre", "code without end")]
+
+
+def test_text_without_markup_is_only_stripped():
+    text = "  Plain answer, 3.14 (approx.) - see above.\n\nSecond paragraph.\n"
+    assert render_markdown(text) == (text.strip(), [])
@@ -0,0 +1,107 @@
+import asyncio
+import random
+from types import SimpleNamespace
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.media_group import MediaGroupCollector
+
+
+def _part(group_id, message_id, caption=None):
+    return SimpleNamespace(media_group_id=group_id, message_id=message_id, photo=[f"photo-{message_id}"], caption=caption)
+
+
+@pytest.mark.asyncio
+async def test_soak_every_album_is_flushed_once_and_complete():
+    collector = MediaGroupCollector(min_quiet=0.05, max_quiet=0.2, max_wait=1.0)
+    rng = random.Random(42)
+    flushed = {}
+
+    async def callback(anchor, items):
+        assert anchor.media_group_id not in flushed
+        flushed[anchor.media_group_id] = [item.message_id for item in items]
+
+    expected = {}
+    message_id = 0
+
+    async def send_album(group_id, parts):
+        # Parts of one album arrive shortly after each other, possibly out of order
+        ids = list(range(message_id, message_id + parts))
+        expected[group_id] = ids
+        shuffled = ids[:]
+        rng.shuffle(shuffled)
+        for part_id in shuffled:
+            await asyncio.sleep(rng.uniform(0, 0.02))
+            collector.add(_part(group_id, part_id), callback)
+
+    senders = []
+    for n in range(200):
+        parts = rng.randint(1, 10)
+        senders.append(send_album(f"group-{n}", parts))
+        message_id += parts
+    await asyncio.gather(*senders)
+    await collector.drain()
+
+    assert flushed == expected
+    assert not collector.groups
+    assert not collector._tasks
+
+
+@pytest.mark.asyncio
+async def test_trickling_album_is_flushed_by_max_wait_and_late_parts_are_dropped():
+    collector = MediaGroupCollector(min_quiet=0.05, max_quiet=0.05, max_wait=0.2)
+    calls = []
+
+    async def callback(anchor, items):
+        calls.append([item.caption for item in items])
+
+    for n in range(6):
+        collector.add(_part("album", n, caption="/ask what" if n == 0 else None), callback)
+        await asyncio.sleep(0.04)
+    await collector.drain()
+    assert len(calls) == 1
+    assert calls[0][0] == "/ask what"
+
+    collector.add(_part("album", 99), callback)
+    await collector.drain()
+    assert len(calls) == 1
+    assert not collector.groups
+
+
+@pytest.mark.asyncio
+async def test_pending_albums_are_bounded():
+    collector = MediaGroupCollector(min_quiet=1.0, max_quiet=1.0, max_wait=5.0, max_pending=3)
+    flushed = []
+
+    async def callback(anchor, items):
+        flushed.append(anchor.media_group_id)
+
+    for n in range(5):
+        collector.add(_part(f"group-{n}", n), callback)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert flushed == ["group-0", "group-1"]
+    assert len(collector.groups) == 3
+    await collector.drain()
+
+
+@pytest.mark.asyncio
+async def test_observed_parts_join_the_album_started_by_add():
+    collector = MediaGroupCollector(min_quiet=0.01, max_quiet=0.05, max_wait=0.5)
+    flushed = []
+
+    async def callback(anchor, items):
+        flushed.append((anchor.message_id, [item.message_id for item in items]))
+
+    collector.observe(_part("g", 1))
+    collector.add(_part("g", 2, "/ask"), callback)
+    collector.observe(_part("g", 3))
+    # Parts of an album nobody added are never flushed
+    collector.observe(_part("other", 4))
+    await collector.drain()
+
+    assert flushed == [(2, [1, 2, 3])]
+    assert not collector.groups
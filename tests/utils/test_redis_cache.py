@@ -0,0 +1,54 @@
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.image_cache import ImageCache
+from utils.insta_cache import InstaCache
+from utils.vision_cache import VisionCache
+
+
+class FakeRedis:
+    """GET/SET returning bytes, like redis-py without decode_responses"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        value = self.data.get(key)
+        return value.encode() if value is not None else None
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttls[key] = ex
+
+
+class BrokenRedis:
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("down")
+
+
+@pytest.mark.asyncio
+async def test_replicas_share_entries_under_their_prefixes():
+    redis = FakeRedis()
+    await InstaCache(redis).set("Cx_y-Z12345", "file-1")
+    key = ImageCache.make_key("openai", "gpt-image-1", "1024x1024", "a cat")
+    await ImageCache(redis).set(key, "file-2")
+    await VisionCache(redis).set("openai/gpt-4o:abc", "A cat on a mat.")
+
+    assert set(redis.data) == {"instacache:Cx_y-Z12345", f"imgcache:{key}", "vision:openai/gpt-4o:abc"}
+    assert await InstaCache(redis).get("Cx_y-Z12345") == "file-1"
+    assert await ImageCache(redis).get(key) == "file-2"
+    assert (await VisionCache(redis).get("openai/gpt-4o:abc"))["answer"] == "A cat on a mat."
+
+
+@pytest.mark.asyncio
+async def test_redis_failures_fall_back_to_the_local_cache():
+    cache = InstaCache(BrokenRedis())
+    assert await cache.get("Cx_y-Z12345") is None
+    await cache.set("Cx_y-Z12345", "file-1")
+    assert await cache.get("Cx_y-Z12345") == "file-1"
@@ -0,0 +1,100 @@
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, SendMediaGroup, EditMessageText
+from aiogram.types import InputMediaPhoto
+
+from utils.send_scheduler import SendScheduler, TokenBucket, split_message, answer_long
+from middlewares.flood_control import FloodControlMiddleware
+
+
+def test_short_text_is_one_message():
+    assert split_message("hello") == ["hello"]
+
+
+def test_split_on_paragraphs_within_the_limit():
+    paragraphs = [f"Paragraph {i} " + "word " * 30 for i in range(10)]
+    chunks = split_message("\n\n".join(paragraphs), limit=400)
+    assert all(len(chunk) <= 400 for chunk in chunks)
+    assert "\n\n".join(chunks).split("\n\n") == paragraphs
+
+
+def test_long_code_block_keeps_fences_and_indentation():
+    code = "\n".join(f"    line_{i} = {i}" for i in range(60))
+    text = f"Intro\n\n```python\n{code}\n```\n\nOutro"
+    chunks = split_message(text, limit=300)
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    code_chunks = [chunk for chunk in chunks if "line_" in chunk]
+    assert len(code_chunks) > 1
+    for chunk in code_chunks:
+        start = chunk.index("```python\n")
+        body = chunk[start:chunk.index("\n```", start) + 4]
+        assert all(line.startswith("    line_") for line in body.split("\n")[1:-1])
+    assert chunks[-1].endswith("Outro")
+
+
+def test_limit_counts_utf16_units():
+    chunks = split_message("😀" * 3000)
+    assert len(chunks) == 2
+    assert all(len(chunk.encode("utf-16-le")) // 2 <= 4096 for chunk in chunks)
+    assert "".join(chunks) == "😀" * 3000
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_paces_after_the_burst():
+    bucket = TokenBucket(rate=50, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # Two tokens come from the burst, two more need 20ms each
+    assert time.monotonic() - started >= 0.035
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_the_chat_and_retries():
+    scheduler = SendScheduler(retries=1)
+    method = SendMessage(chat_id=1, text="hi")
+    send = AsyncMock(side_effect=[TelegramRetryAfter(method, "Flood control exceeded", 0), "sent"])
+
+    assert await scheduler.run(1, send) == "sent"
+    assert send.await_count == 2
+
+    send = AsyncMock(side_effect=TelegramRetryAfter(method, "Flood control exceeded", 0))
+    with pytest.raises(TelegramRetryAfter):
+        await scheduler.run(1, send)
+    assert send.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_only_paces_messages():
+    scheduler = SendScheduler()
+    scheduler.run = AsyncMock(return_value="paced")
+    middleware = FloodControlMiddleware(scheduler)
+    make_request = AsyncMock(return_value="direct")
+    bot = MagicMock()
+
+    album = SendMediaGroup(chat_id=-100, media=[InputMediaPhoto(media="a"), InputMediaPhoto(media="b")])
+    assert await middleware(make_request, bot, album) == "paced"
+    assert scheduler.run.await_args.kwargs == {"method": "sendMediaGroup", "messages": 2}
+
+    edit = EditMessageText(chat_id=-100, message_id=1, text="x")
+    assert await middleware(make_request, bot, edit) == "direct"
+
+
+@pytest.mark.asyncio
+async def test_answer_long_sends_every_chunk_in_order():
+    message = MagicMock(reply=AsyncMock(side_effect=lambda text: text))
+    text = "\n\n".join("x" * 3000 for _ in range(3))
+    sent = await answer_long(message, text, as_reply=True)
+    assert sent == ["x" * 3000] * 3
+
+
+@pytest.mark.asyncio
+async def test_answer_long_never_sends_an_empty_message():
+    message = MagicMock(answer=AsyncMock(side_effect=lambda text, **kwargs: text))
+    assert await answer_long(message, "```\n```") == ["```\n```"]
+    assert await answer_long(message, " \n\n ") == []
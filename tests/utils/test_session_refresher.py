@@ -0,0 +1,126 @@
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from managers.ig_account_pool import IgAccountPool
+from utils.metrics import ig_session_age_seconds
+from utils.session_refresher import IgSessionRefresher
+
+
+def make_pool(store=None):
+    pool = IgAccountPool(store, accounts=[("fresh", "secret"), ("stale", "secret"), ("cookies", None)])
+    now = time.time()
+    for name, age in (("fresh", 60), ("stale", 11 * 3600), ("cookies", 20 * 3600)):
+        sessions = pool.accounts[name]
+        sessions.loaded = True
+        sessions.saved_at = now - age
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_leader_renews_sessions_close_to_expiry():
+    pool = make_pool()
+    refresher = IgSessionRefresher(pool, refresh_after=12 * 3600)
+
+    for sessions in pool.accounts.values():
+        sessions.login = AsyncMock()
+    await refresher.tick()
+
+    pool.accounts["stale"].login.assert_awaited_once()
+    pool.accounts["fresh"].login.assert_not_awaited()
+    # Without a password the session can't be renewed by logging in
+    pool.accounts["cookies"].login.assert_not_awaited()
+    assert ig_session_age_seconds.labels(account="fresh")._value.get() >= 60
+
+
+@pytest.mark.asyncio
+async def test_followers_only_pick_up_refreshed_sessions():
+    lock = MagicMock()
+    lock.acquire = AsyncMock(return_value=False)
+    store = MagicMock()
+    store.redis.lock.return_value = lock
+    pool = make_pool(store)
+    refresher = IgSessionRefresher(pool, refresh_after=12 * 3600)
+
+    for sessions in pool.accounts.values():
+        sessions.login = AsyncMock()
+        sessions.sync_from_store = AsyncMock(return_value=False)
+    await refresher.tick()
+
+    assert not await refresher.is_leader()
+    for sessions in pool.accounts.values():
+        sessions.login.assert_not_awaited()
+        sessions.sync_from_store.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_leadership_is_kept_by_reacquiring_the_lock():
+    lock = MagicMock()
+    lock.acquire = AsyncMock(return_value=True)
+    lock.reacquire = AsyncMock()
+    store = MagicMock()
+    store.redis.lock.return_value = lock
+    refresher = IgSessionRefresher(make_pool(store))
+
+    assert await refresher.is_leader()
+    assert await refresher.is_leader()
+    store.redis.lock.assert_called_once_with("ig:session:lock", timeout=refresher.interval * 3)
+    lock.reacquire.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_sessions_in_use_are_left_alone():
+    pool = make_pool()
+    refresher = IgSessionRefresher(pool, refresh_after=12 * 3600)
+    stale = pool.accounts["stale"]
+    stale.login = AsyncMock()
+    stale.leases = 1
+
+    await refresher.tick()
+    stale.login.assert_not_awaited()
+
+    stale.leases = 0
+    await refresher.tick()
+    stale.login.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_followers_never_log_in():
+    lock = MagicMock()
+    lock.acquire = AsyncMock(return_value=False)
+    store = MagicMock()
+    store.redis.lock.return_value = lock
+    pool = make_pool(store)
+    refresher = IgSessionRefresher(pool)
+    missing = pool.accounts["fresh"]
+    missing.loaded = False
+    missing.ensure_session = AsyncMock()
+    missing.sync_from_store = AsyncMock(return_value=False)
+
+    await refresher.tick()
+
+    missing.ensure_session.assert_not_awaited()
+    missing.sync_from_store.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_leader_skips_cooling_accounts_and_cools_down_failed_logins():
+    pool = make_pool()
+    refresher = IgSessionRefresher(pool, refresh_after=12 * 3600)
+    failing = pool.accounts["fresh"]
+    failing.loaded = False
+    failing.ensure_session = AsyncMock(side_effect=Exception("Checkpoint required"))
+
+    await refresher.tick()
+    failing.ensure_session.assert_awaited_once()
+    assert await pool.state.cooling_down(["fresh"]) == {"fresh"}
+
+    # Cooling down: no new login attempt until the cool-down is over
+    await refresher.tick()
+    failing.ensure_session.assert_awaited_once()
+    pool.state.cooldowns.clear()
+    await refresher.tick()
+    assert failing.ensure_session.await_count == 2
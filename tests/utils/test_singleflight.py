@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "file_id"
+
+    results = await asyncio.gather(*(flights.do("key", generate) for _ in range(5)))
+
+    assert calls == 1
+    assert [value for value, _ in results] == ["file_id"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert "key" not in flights
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_all_waiters_and_are_not_cached():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flights.do("key", fail) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+    async def succeed():
+        return 1
+
+    assert await flights.do("key", succeed) == (1, False)
@@ -0,0 +1,220 @@
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram import Bot, Dispatcher, Router
+from aiogram.methods import GetMe
+from aiogram.types import Message, Update, User
+
+from utils.update_stream import UpdateStream, UpdateWorker, worker_shards
+from utils.update_dedupe import UpdateDedupe
+from middlewares.update_stream import UpdatePublishMiddleware
+from middlewares.dedupe import UpdateDedupeMiddleware
+
+
+def _id(entry_id):
+    return tuple(int(part) for part in entry_id.split("-"))
+
+
+class FakeRedis:
+    """Just enough of Redis Streams and one consumer group"""
+
+    def __init__(self):
+        self.streams = {}
+        self.delivered = {}
+        self.pending = {}
+        self.seq = 0
+
+    async def xgroup_create(self, key, group, id="0", mkstream=False):
+        self.streams.setdefault(key, [])
+        self.delivered.setdefault(key, 0)
+        self.pending.setdefault(key, {})
+
+    async def xadd(self, key, fields, maxlen=None, approximate=True):
+        self.seq += 1
+        entry_id = f"{int(time.time() * 1000)}-{self.seq}"
+        self.streams.setdefault(key, []).append((entry_id, {k: str(v) for k, v in fields.items()}))
+        return entry_id
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        (key, last), = streams.items()
+        entries = self.streams[key]
+        if last == ">":
+            new = entries[self.delivered[key]:self.delivered[key] + count]
+            self.delivered[key] += len(new)
+            for entry_id, _ in new:
+                self.pending[key][entry_id] = (consumer, time.monotonic())
+            if not new and block:
+                await asyncio.sleep(0.005)
+        else:
+            new = [(entry_id, fields) for entry_id, fields in entries
+                   if self.pending[key].get(entry_id, ("",))[0] == consumer and _id(entry_id) > _id(last)][:count]
+        return [[key, new]] if new else []
+
+    async def xautoclaim(self, key, group, consumer, min_idle_time, start_id="0-0", count=None):
+        now = time.monotonic()
+        claimed = [(entry_id, fields) for entry_id, fields in self.streams[key]
+                   if entry_id in self.pending[key] and (now - self.pending[key][entry_id][1]) * 1000 >= min_idle_time]
+        for entry_id, _ in claimed:
+            self.pending[key][entry_id] = (consumer, now)
+        return ["0-0", claimed, []]
+
+    async def xack(self, key, group, entry_id):
+        self.pending[key].pop(entry_id, None)
+
+
+def update(update_id, chat_id, text):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+        },
+    })
+
+
+def make_dispatcher(handled):
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        if message.text.startswith("slow"):
+            await asyncio.sleep(0.05)
+        handled.append((message.chat.id, message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def publish(stream, *updates):
+    for item in updates:
+        await stream.publish(item.message.from_user.id, item.model_dump_json(exclude_unset=True, by_alias=True))
+
+
+async def run_until(worker, condition, timeout=2):
+    task = asyncio.create_task(worker.run(handle_signals=False))
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+    worker.stop()
+    await task
+
+
+def test_worker_shards_split_evenly():
+    assert worker_shards(0, 2, 4) == [0, 2]
+    assert worker_shards(1, 2, 4) == [1, 3]
+    assert worker_shards(0, 1, 4) == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_chats_run_concurrently_in_order_per_chat():
+    redis, handled = FakeRedis(), []
+    stream = UpdateStream(redis, shards=1)
+    await publish(stream, update(1, 10, "slow 1"), update(2, 10, "2"), update(3, 20, "3"), update(4, 10, "4"))
+    worker = UpdateWorker(stream, make_dispatcher(handled), Bot(token="42:TEST"), [0], "worker-0", claim_idle=60)
+
+    await run_until(worker, lambda: len(handled) == 4)
+
+    # Chat 20 doesn't wait for the slow update of chat 10
+    assert handled[0] == (20, "3")
+    assert [text for chat, text in handled if chat == 10] == ["slow 1", "2", "4"]
+    assert redis.pending[stream.key(0)] == {}
+
+
+@pytest.mark.asyncio
+async def test_unacknowledged_updates_are_recovered():
+    redis, handled = FakeRedis(), []
+    stream = UpdateStream(redis, shards=1)
+    key = stream.key(0)
+    await stream.ensure_group(0)
+    await publish(stream, update(1, 10, "mine"), update(2, 20, "crashed"), update(3, 30, "new"))
+    # Delivered before a crash: one to this worker's name, one to a consumer that is gone
+    await redis.xreadgroup("workers", "worker-0", {key: ">"}, count=1)
+    await redis.xreadgroup("workers", "worker-9", {key: ">"}, count=1)
+    worker = UpdateWorker(stream, make_dispatcher(handled), Bot(token="42:TEST"), [0], "worker-0", claim_idle=0)
+
+    await run_until(worker, lambda: len(handled) == 3)
+
+    assert sorted(text for _, text in handled) == ["crashed", "mine", "new"]
+    assert redis.pending[key] == {}
+
+
+@pytest.mark.asyncio
+async def test_ingress_publishes_to_the_shard_of_the_sender():
+    redis = FakeRedis()
+    stream = UpdateStream(redis, shards=4)
+    middleware = UpdatePublishMiddleware(stream)
+
+    async def handler(event, data):
+        raise AssertionError("ingress must not handle updates")
+
+    # A user's group and private updates go to the same worker; channel posts by chat
+    group_message = update(1, -1001, "hi")
+    await middleware(handler, group_message, {"event_chat": SimpleNamespace(id=-1001), "event_from_user": SimpleNamespace(id=7)})
+    await middleware(handler, update(2, 7, "hello"), {"event_chat": SimpleNamespace(id=7), "event_from_user": SimpleNamespace(id=7)})
+    await middleware(handler, update(3, -1002, "post"), {"event_chat": SimpleNamespace(id=-1002), "event_from_user": None})
+
+    assert [fields["sender"] for _, fields in redis.streams[stream.key(7 % 4)]] == ["7", "7"]
+    assert Update.model_validate_json(redis.streams[stream.key(7 % 4)][0][1]["update"]) == group_message
+    assert [fields["sender"] for _, fields in redis.streams[stream.key(-1002 % 4)]] == ["-1002"]
+
+
+class SlowClaimRedis(FakeRedis):
+    async def set(self, key, value, nx=False, ex=None):
+        # The dedupe claim of the first update is answered last
+        if key.endswith(":1"):
+            await asyncio.sleep(0.05)
+        return True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("handle_as_tasks, order", [(False, ["first", "second"]), (True, ["second", "first"])])
+async def test_ingress_polling_publishes_in_update_order(handle_as_tasks, order):
+    redis = SlowClaimRedis()
+    stream = UpdateStream(redis, shards=1)
+    dp = Dispatcher()
+    dp.update.outer_middleware(UpdateDedupeMiddleware(UpdateDedupe(redis)))
+    dp.update.outer_middleware(UpdatePublishMiddleware(stream))
+    bot = Bot(token="42:TEST")
+    batches = [[update(1, 10, "first"), update(2, 10, "second")]]
+
+    async def call(method, request_timeout=None):
+        if isinstance(method, GetMe):
+            return User(id=42, is_bot=True, first_name="Bot")
+        if batches:
+            return batches.pop()
+        await asyncio.sleep(0.01)
+        return []
+
+    async def stop_when_published():
+        while len(redis.streams.get(stream.key(0), [])) < 2:
+            await asyncio.sleep(0.005)
+        await dp.stop_polling()
+
+    with patch.object(Bot, "__call__", new=AsyncMock(side_effect=call)):
+        stopper = asyncio.create_task(stop_when_published())
+        await asyncio.wait_for(dp.start_polling(bot, handle_signals=False, handle_as_tasks=handle_as_tasks), timeout=2)
+        await stopper
+
+    published = [Update.model_validate_json(fields["update"]).message.text for _, fields in redis.streams[stream.key(0)]]
+    assert published == order
+
+
+@pytest.mark.asyncio
+async def test_busy_chat_does_not_hold_every_slot():
+    redis, handled = FakeRedis(), []
+    stream = UpdateStream(redis, shards=1)
+    # More updates queued behind chat 10's slow one than the worker has slots
+    await publish(stream, update(1, 10, "slow 1"), update(2, 10, "2"), update(3, 10, "3"), update(4, 10, "4"), update(5, 20, "5"))
+    worker = UpdateWorker(stream, make_dispatcher(handled), Bot(token="42:TEST"), [0], "worker-0", concurrency=2, claim_idle=60)
+
+    await run_until(worker, lambda: len(handled) == 5)
+
+    assert handled[0] == (20, "5")
+    assert [text for chat, text in handled if chat == 10] == ["slow 1", "2", "3", "4"]
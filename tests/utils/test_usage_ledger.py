@@ -0,0 +1,112 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.usage_ledger import UsageLedger, usage_context
+
+USAGE = {"input_tokens": 100, "output_tokens": 20, "cached_tokens": 50}
+
+
+class FakePipeline:
+    def __init__(self):
+        self.commands = []
+        self.execute = AsyncMock(return_value=[])
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, *args))
+        return command
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_record_aggregates_in_memory_without_redis():
+    ledger = UsageLedger()
+    token = usage_context.set((1, -100))
+    try:
+        ledger.record("openai", "gpt-4o-mini", USAGE)
+        ledger.record("openai", "gpt-4o-mini", USAGE, images=2)
+    finally:
+        usage_context.reset(token)
+
+    top = await ledger.top_consumers("user")
+    assert top[0][0] == "1"
+    assert top[0][1] == 240
+    assert top[0][2]["openai/gpt-4o-mini:cached_tokens"] == 100
+    assert top[0][2]["openai/gpt-4o-mini:images"] == 2
+    assert top[0][2]["openai/gpt-4o-mini:requests"] == 2
+
+    models = await ledger.top_consumers("model")
+    assert models[0][0] == "openai/gpt-4o-mini"
+
+
+@pytest.mark.asyncio
+async def test_flush_batches_into_one_pipeline_round_trip():
+    pipeline = FakePipeline()
+    redis = MagicMock()
+    redis.pipeline = MagicMock(return_value=pipeline)
+    ledger = UsageLedger(redis)
+
+    token = usage_context.set((1, 2))
+    try:
+        for _ in range(5):
+            ledger.record("anthropic", "claude", USAGE)
+    finally:
+        usage_context.reset(token)
+
+    await ledger.flush()
+
+    pipeline.execute.assert_awaited_once()
+    hincrby = [cmd for cmd in pipeline.commands if cmd[0] == "hincrby"]
+    # Repeated requests are summed before they reach Redis
+    assert ("hincrby", hincrby[0][1], "anthropic/claude:input_tokens", 500) in hincrby
+    assert {cmd[0] for cmd in pipeline.commands} == {"hincrby", "zincrby", "expire"}
+
+    # Nothing left to flush afterwards
+    await ledger.flush()
+    pipeline.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_retried():
+    pipeline = FakePipeline()
+    pipeline.execute = AsyncMock(side_effect=ConnectionError("down"))
+    redis = MagicMock()
+    redis.pipeline = MagicMock(return_value=pipeline)
+    ledger = UsageLedger(redis)
+
+    ledger.record("grok", "grok-1", USAGE)
+    await ledger.flush()
+
+    assert ledger._hashes
+
+
+@pytest.mark.asyncio
+async def test_local_totals_are_pruned_after_retention(monkeypatch):
+    import utils.usage_ledger as usage_ledger
+
+    ledger = UsageLedger()
+    monkeypatch.setattr(usage_ledger, "_today", lambda: "2024-01-01")
+    monkeypatch.setattr(usage_ledger, "_oldest_kept_day", lambda: "2023-10-03")
+    token = usage_context.set((1, -100))
+    try:
+        ledger.record("openai", "gpt-4o-mini", USAGE)
+        await ledger.flush()
+        assert await ledger.top_consumers("user", day="2024-01-01")
+
+        monkeypatch.setattr(usage_ledger, "_today", lambda: "2024-06-01")
+        monkeypatch.setattr(usage_ledger, "_oldest_kept_day", lambda: "2024-03-02")
+        ledger.record("openai", "gpt-4o-mini", USAGE)
+        await ledger.flush()
+    finally:
+        usage_context.reset(token)
+
+    assert all(":2024-01-01:" not in key for key in [*ledger._local_hashes, *ledger._local_scores])
+    assert (await ledger.top_consumers("user"))[0][0] == "1"
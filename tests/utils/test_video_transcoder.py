@@ -0,0 +1,73 @@
+import json
+import pytest
+from unittest.mock import AsyncMock
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.video_transcoder import VideoTranscoder, plan_encode, parse_probe
+
+MB = 1024 * 1024
+
+
+def test_plan_encode_fits_the_limit_and_scales_down_low_bitrates():
+    # 50 MB over 60 seconds leaves room for a full HD stream
+    bitrate, short_side = plan_encode(50 * MB, 60, 1080)
+    assert (bitrate + 128_000) * 60 / 8 <= 50 * MB
+    assert short_side is None
+
+    # The same budget for a 10 minute video needs fewer pixels
+    bitrate, short_side = plan_encode(50 * MB, 600, 1080)
+    assert bitrate < 600_000 and short_side == 360
+
+    # Retries aim lower
+    assert plan_encode(50 * MB, 600, 1080, attempt=1)[0] < bitrate
+
+
+def test_parse_probe_reads_duration_and_video_size():
+    output = json.dumps({
+        "streams": [{"codec_type": "audio"}, {"codec_type": "video", "width": 720, "height": 1280}],
+        "format": {"duration": "93.4"},
+    })
+    info = parse_probe(output)
+    assert (info.duration, info.width, info.height) == (93.4, 720, 1280)
+
+
+@pytest.mark.asyncio
+async def test_files_that_fit_are_not_transcoded(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"0" * 1024)
+    transcoder = VideoTranscoder(size_limit=2048)
+    transcoder.available = True
+    transcoder._run = AsyncMock()
+
+    assert await transcoder.fit(str(path)) is None
+    transcoder._run.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_large_file_is_transcoded_with_thumbnail(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"0" * 4096)
+    transcoder = VideoTranscoder(size_limit=2048)
+    transcoder.available = True
+    probe = json.dumps({"streams": [{"codec_type": "video", "width": 1080, "height": 1920}], "format": {"duration": "600"}})
+    commands = []
+
+    async def run(args):
+        commands.append(args)
+        if args[0] == "ffmpeg":
+            with open(args[-1], "wb") as f:
+                f.write(b"0" * 1024)
+        return probe
+
+    transcoder._run = run
+    result = await transcoder.fit(str(path))
+
+    assert result.path == str(tmp_path / "video.small.mp4")
+    assert result.thumbnail == str(tmp_path / "video.small.jpg")
+    assert result.info.duration == 600
+    encode = next(args for args in commands if "libx264" in args)
+    # Portrait videos are bounded by their width
+    assert encode[encode.index("-vf") + 1] == "scale=360:-2"
+    assert encode[encode.index("-threads") + 1] == str(transcoder.threads)
@@ -0,0 +1,29 @@
+import pytest
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.vision_cache import VisionCache, compact_description
+
+
+def test_key_ignores_caption_formatting():
+    key = VisionCache.make_key("openai/gpt-4o", ["AQADuid"], "What is in this image?")
+    assert key == VisionCache.make_key("openai/gpt-4o", ["AQADuid"], "  what is IN this   image ")
+    assert key != VisionCache.make_key("anthropic/claude", ["AQADuid"], "What is in this image?")
+    assert key != VisionCache.make_key("openai/gpt-4o", ["AQADother"], "What is in this image?")
+
+
+def test_compact_description_cuts_at_sentence():
+    answer = "A cat sits on a keyboard. " * 30
+    description = compact_description(answer)
+    assert len(description) <= 300
+    assert description.endswith(".")
+
+
+@pytest.mark.asyncio
+async def test_local_round_trip_without_redis():
+    cache = VisionCache()
+    key = VisionCache.make_key("openai/gpt-4o", ["AQADuid"], "caption")
+    assert await cache.get(key) is None
+    await cache.set(key, "A meme about Mondays.")
+    assert (await cache.get(key))["description"] == "A meme about Mondays."
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestClient, TestServer
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+
+from utils.webhook_server import build_webhook_app
+from middlewares.concurrency import ConcurrencyLimitMiddleware
+from clients.flux_client import FluxClient
+
+SECRET = "s3cret"
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "hello",
+    },
+}
+
+
+@pytest_asyncio.fixture
+async def webhook():
+    received = asyncio.Queue()
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        await received.put(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    app = build_webhook_app(Bot(token="42:TEST"), dp, path="/telegram/webhook", secret=SECRET)
+    async with TestClient(TestServer(app)) as client:
+        yield client, received
+
+
+@pytest.mark.asyncio
+async def test_update_with_secret_is_dispatched(webhook):
+    client, received = webhook
+    resp = await client.post("/telegram/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+    assert resp.status == 200
+    assert await asyncio.wait_for(received.get(), timeout=1) == "hello"
+
+
+@pytest.mark.asyncio
+async def test_update_with_wrong_secret_is_rejected(webhook):
+    client, received = webhook
+    resp = await client.post("/telegram/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "nope"})
+    assert resp.status == 401
+    resp = await client.post("/telegram/webhook", json=UPDATE)
+    assert resp.status == 401
+    await asyncio.sleep(0.05)
+    assert received.empty()
+
+
+@pytest.mark.asyncio
+async def test_health_and_metrics(webhook):
+    client, _ = webhook
+    resp = await client.get("/healthz")
+    assert resp.status == 200
+    assert await resp.text() == "ok"
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    assert "# TYPE" in await resp.text()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_middleware():
+    middleware = ConcurrencyLimitMiddleware(2)
+    running = peak = 0
+
+    async def handler(event, data):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return event
+
+    results = await asyncio.gather(*(middleware(handler, i, {}) for i in range(6)))
+    assert results == list(range(6))
+    assert peak == 2
+
+
+def test_flux_callback_is_mounted_only_with_a_webhook_url():
+    def flux_routes(flux_client):
+        app = build_webhook_app(Bot(token="42:TEST"), Dispatcher(), flux_client, path="/telegram/webhook", secret=SECRET)
+        return [route.resource.canonical for route in app.router.routes() if route.method == "POST" and "flux" in route.resource.canonical]
+
+    assert flux_routes(FluxClient()) == []
+    assert flux_routes(FluxClient("https://bot.example.com/flux/webhook")) == ["/flux/webhook"]
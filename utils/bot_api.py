@@ -0,0 +1,66 @@
+from pathlib import Path
+from typing import AsyncGenerator, Optional, Union
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, BareFilesPathWrapper, SimpleFilesPathWrapper
+from aiogram.types import FSInputFile, InputFile
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE
+from config import TELEGRAM_API_URL, TELEGRAM_API_LOCAL, TELEGRAM_API_FILES_DIR, TELEGRAM_API_LOCAL_FILES_DIR
+from utils.logging_config import logger
+
+
+def create_session() -> Optional[AiohttpSession]:
+    """Bot session for a self-hosted Bot API server, or None to use api.telegram.org"""
+    if not TELEGRAM_API_URL:
+        return None
+    if TELEGRAM_API_FILES_DIR and TELEGRAM_API_LOCAL_FILES_DIR:
+        wrapper = SimpleFilesPathWrapper(Path(TELEGRAM_API_FILES_DIR), Path(TELEGRAM_API_LOCAL_FILES_DIR))
+    else:
+        wrapper = BareFilesPathWrapper()
+    api = TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL, wrap_local_file=wrapper)
+    logger.info(f"Using Bot API server {TELEGRAM_API_URL}" + (" in local mode" if TELEGRAM_API_LOCAL else ""))
+    return AiohttpSession(api=api)
+
+
+def _local_api(bot) -> Optional[TelegramAPIServer]:
+    api = getattr(getattr(bot, "session", None), "api", None)
+    return api if isinstance(api, TelegramAPIServer) and api.is_local else None
+
+
+def local_file_path(bot, file_path: str) -> Optional[str]:
+    """Where a file from get_file lies on our disk when the server runs in local mode, else None"""
+    api = _local_api(bot)
+    if api is None:
+        return None
+    try:
+        return str(api.wrap_local_file.to_local(file_path))
+    except ValueError:
+        # Outside the directory shared with the server
+        return None
+
+
+def upload_file(bot, path: str) -> Union[str, FSInputFile]:
+    """A downloaded file to send: a file:// URI the local server reads itself, or an upload.
+
+    Paths are only handed over inside the directory configured as shared with
+    the server; without that mapping nothing says the server can see the file.
+    """
+    api = _local_api(bot)
+    if api is not None and isinstance(api.wrap_local_file, SimpleFilesPathWrapper):
+        try:
+            return Path(api.wrap_local_file.to_server(Path(path).resolve())).as_uri()
+        except ValueError:
+            pass
+    return FSInputFile(path)
+
+
+
+class MemoryInputFile(InputFile):
+    """An upload straight from a buffer; BufferedInputFile would copy all of it into a BytesIO first"""
+
+    def __init__(self, data: memoryview, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.data = data
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        for offset in range(0, len(self.data), self.chunk_size):
+            yield bytes(self.data[offset:offset + self.chunk_size])
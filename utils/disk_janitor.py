@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+from typing import List, Optional, Tuple
+from utils.logging_config import logger
+
+
+class DiskJanitor:
+    """Keep a download directory bounded by file age and total size.
+
+    Files older than max_age are removed; if the directory is still larger than
+    max_bytes, the oldest files go first. Files younger than grace are never
+    evicted for size, so a download that is still being uploaded survives.
+    """
+
+    def __init__(self, path: str, max_bytes: int, max_age: float, interval: float = 300, grace: float = 300) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.grace = grace
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.warning(f"Disk janitor sweep of {self.path} failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_path))
+        return files
+
+    def sweep(self) -> Tuple[int, int]:
+        """Remove expired and excess files; returns (files removed, bytes freed)"""
+        if not os.path.isdir(self.path):
+            return 0, 0
+        now = time.time()
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        removed, freed = 0, 0
+
+        for mtime, size, file_path in files:
+            expired = now - mtime > self.max_age
+            over_budget = total > self.max_bytes and now - mtime > self.grace
+            if not expired and not over_budget:
+                continue
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+
+        # Drop the per-post directories that are now empty
+        for root, _, _ in os.walk(self.path, topdown=False):
+            if root != self.path and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+        if removed:
+            logger.info(f"Disk janitor removed {removed} files ({freed} bytes) from {self.path}")
+        return removed, freed
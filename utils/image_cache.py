@@ -0,0 +1,29 @@
+import hashlib
+import re
+from typing import Optional
+from redis.asyncio.client import Redis
+from config import IMG_CACHE_SIZE, IMG_CACHE_TTL
+from utils.redis_cache import RedisTTLCache
+
+CACHE_KEY = "{provider}:{model}:{size}:{digest}"
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt.strip().lower())
+
+
+class ImageCache(RedisTTLCache):
+    """Map generation parameters to the Telegram file_id of an already sent image.
+
+    Identical requests are answered with the file_id (no generation, no
+    upload), and concurrent identical requests share a single generation.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None) -> None:
+        super().__init__(redis, "imgcache", maxsize=IMG_CACHE_SIZE, ttl=IMG_CACHE_TTL)
+
+    @staticmethod
+    def make_key(provider: str, model: str, size: str, prompt: str, variant: int = 0) -> str:
+        raw = f"{normalize_prompt(prompt)}|{variant}"
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return CACHE_KEY.format(provider=provider, model=model, size=size, digest=digest)
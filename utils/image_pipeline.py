@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import io
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+from config import IMAGE_PROCESS_WORKERS, IMAGE_JPEG_QUALITY
+from utils.ttl_cache import TTLCache
+from utils.bot_api import local_file_path
+from utils.logging_config import logger
+
+# Largest useful (long side, short side) per provider; bigger images are downscaled
+# by the provider anyway, so sending more pixels only costs bandwidth and latency.
+PROVIDER_MAX_SIZE = {
+    "openai": (2048, 768),
+    "grok": (2048, 768),
+    "anthropic": (1568, 1568),
+    "gemini": (1536, 1536),
+}
+DEFAULT_MAX_SIZE = (1568, 1568)
+
+# Telegram keeps file paths valid for at least an hour
+FILE_PATH_TTL = 50 * 60
+
+
+def _fit_scale(width: int, height: int, max_size: Tuple[int, int]) -> float:
+    max_long, max_short = max_size
+    long_side, short_side = max(width, height), min(width, height)
+    return min(1.0, max_long / long_side, max_short / short_side)
+
+
+def pick_photo_size(sizes: Sequence, provider: str):
+    """Pick the smallest PhotoSize that still covers the provider's target resolution"""
+    max_long, max_short = PROVIDER_MAX_SIZE.get(provider, DEFAULT_MAX_SIZE)
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= max_long or min(size.width, size.height) >= max_short:
+            return size
+    return ordered[-1]
+
+
+def parse_data_url(url: str) -> Tuple[str, str]:
+    """Split a base64 data URL into (media type, base64 payload)"""
+    header, data = url.split(",", 1)
+    media_type = header[len("data:"):].split(";", 1)[0]
+    return media_type, data
+
+
+def _to_data_url(data: bytes, media_type: str = "image/jpeg") -> str:
+    return f"data:{media_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _file_to_data_url(path: str) -> str:
+    # base64 reads straight from the mapped pages, the file is never copied into a bytes object
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _to_data_url(data)
+
+
+def _resize_to_data_url(source: Union[bytes, str], max_size: Tuple[int, int], quality: int) -> str:
+    """Downscale and re-encode an image (its bytes or a local path) as JPEG (runs in a worker process)"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        scale = _fit_scale(image.width, image.height, max_size)
+        if scale < 1.0:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return _to_data_url(output.getvalue())
+
+
+class ImagePipeline:
+    """Download Telegram photos once and turn them into inline images for the AI providers.
+
+    The bot token never leaves the bot: providers receive base64 data URLs
+    instead of api.telegram.org file links. With a local Bot API server the
+    photo is already on disk and is read in place instead of downloaded.
+    """
+
+    def __init__(self) -> None:
+        self.file_paths = TTLCache(maxsize=2048, ttl=FILE_PATH_TTL)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def get_file_path(self, bot, file_id: str) -> str:
+        file_path = self.file_paths.get(file_id)
+        if file_path is None:
+            file = await bot.get_file(file_id)
+            file_path = file.file_path
+            self.file_paths.set(file_id, file_path)
+        return file_path
+
+    async def download(self, bot, file_id: str) -> bytes:
+        file_path = await self.get_file_path(bot, file_id)
+        buffer = await bot.download_file(file_path)
+        return buffer.getvalue()
+
+    async def prepare(self, bot, sizes: Sequence, provider: str) -> str:
+        """Return a data URL for a photo, sized for the given provider"""
+        size = pick_photo_size(sizes, provider)
+        max_size = PROVIDER_MAX_SIZE.get(provider, DEFAULT_MAX_SIZE)
+        local_path = local_file_path(bot, await self.get_file_path(bot, size.file_id))
+
+        if _fit_scale(size.width, size.height, max_size) >= 1.0:
+            # Telegram photos are already JPEG; no need to decode and re-encode
+            if local_path:
+                return await asyncio.to_thread(_file_to_data_url, local_path)
+            return _to_data_url(await self.download(bot, size.file_id))
+
+        # The worker process opens a local file itself, so its bytes aren't pickled over
+        source = local_path or await self.download(bot, size.file_id)
+        logger.debug(f"Resizing {size.width}x{size.height} photo for {provider}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _resize_to_data_url, source, max_size, IMAGE_JPEG_QUALITY)
+
+    async def prepare_many(self, bot, photos: List[Sequence], provider: str) -> List[str]:
+        return list(await asyncio.gather(*(self.prepare(bot, sizes, provider) for sizes in photos)))
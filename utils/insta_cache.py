@@ -0,0 +1,15 @@
+from typing import Optional
+from redis.asyncio.client import Redis
+from config import INSTA_CACHE_SIZE, INSTA_CACHE_TTL
+from utils.redis_cache import RedisTTLCache
+
+
+class InstaCache(RedisTTLCache):
+    """Map Instagram shortcodes to the Telegram file_id of an already sent video.
+
+    A post is downloaded and uploaded once; later requests resend the file_id,
+    and concurrent requests for the same post share a single download.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None) -> None:
+        super().__init__(redis, "instacache", maxsize=INSTA_CACHE_SIZE, ttl=INSTA_CACHE_TTL)
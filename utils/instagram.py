@@ -0,0 +1,15 @@
+import re
+from typing import Optional
+
+# /p/, /reel/, /reels/ and /tv/ links, optionally prefixed by a username and
+# followed by query strings or fragments (?igsh=..., ?img_index=2, #...)
+SHORTCODE_RE = re.compile(
+    r"(?:https?://)?(?:www\.|m\.)?instagram\.com/(?:[\w.]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)",
+    re.IGNORECASE,
+)
+
+
+def extract_shortcode(url: str) -> Optional[str]:
+    """Return the post shortcode of an Instagram link, or None if it isn't a post link"""
+    match = SHORTCODE_RE.search(url or "")
+    return match.group(1) if match else None
@@ -0,0 +1,45 @@
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+from config import PROVIDER_MAX_CONCURRENCY, IMG_MAX_CONCURRENT_PER_USER
+
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """Get the shared semaphore limiting concurrent calls to a provider"""
+    semaphore = _provider_semaphores.get(provider)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(PROVIDER_MAX_CONCURRENCY.get(provider, 4))
+        _provider_semaphores[provider] = semaphore
+    return semaphore
+
+
+class KeyedLimiter:
+    """Per-key concurrency limit (e.g. per user); idle keys are dropped"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._semaphores: Dict[Hashable, asyncio.Semaphore] = {}
+        self._users: Counter = Counter()
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable):
+        semaphore = self._semaphores.setdefault(key, asyncio.Semaphore(self.limit))
+        self._users[key] += 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._semaphores[key]
+
+    def active(self, key: Hashable) -> int:
+        return self._users.get(key, 0)
+
+
+# Image generations running at once per user
+image_user_limiter = KeyedLimiter(IMG_MAX_CONCURRENT_PER_USER)
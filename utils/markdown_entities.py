@@ -0,0 +1,182 @@
+import re
+from typing import List, Optional, Tuple
+from aiogram.types import MessageEntity
+
+FENCE_RE = re.compile(r"^\s*```\s*([\w+#.-]*)\s*$")
+HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+BULLET_RE = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+QUOTE_RE = re.compile(r"^>\s?(.*)$")
+INLINE_RE = re.compile(
+    r"(?P<ticks>`+)(?P<code>.+?)(?P=ticks)"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>[^)\s]+)\)"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|__(?P<underscore_bold>.+?)__"
+    r"|~~(?P<strike>.+?)~~"
+    r"|(?<![\w*])\*(?![\s*])(?P<italic>.+?)(?<![\s*])\*(?![\w*])"
+    # snake_case words are not italic
+    r"|(?<![\w_])_(?![\s_])(?P<underscore_italic>.+?)(?<![\s_])_(?![\w_])"
+)
+# Anything render_markdown could turn into an entity; text without it is sent as is
+MARKUP_RE = re.compile(r"[`*_~\[]|^\s*(?:#|>|[-+]\s)", re.MULTILINE)
+INLINE_MARKUP_RE = re.compile(r"[`*_~\[]")
+LINK_SCHEMES = ("http://", "https://", "tg://")
+
+
+def utf16_len(text: str) -> int:
+    """Length as Telegram counts it (UTF-16 code units)"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _Builder:
+    """Collects the plain text and the entities with their UTF-16 offsets"""
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        self.offset = 0
+        # (type, offset, length, extra); MessageEntity objects are only built at the end
+        self.entities: List[Tuple[str, int, int, dict]] = []
+
+    def add(self, text: str) -> None:
+        if text:
+            self.parts.append(text)
+            self.offset += utf16_len(text)
+
+    def entity(self, entity_type: str, start: int, **extra) -> None:
+        if self.offset > start:
+            self.entities.append((entity_type, start, self.offset - start, extra))
+
+    def inline(self, text: str) -> None:
+        if not INLINE_MARKUP_RE.search(text):
+            self.add(text)
+            return
+        position = 0
+        for match in INLINE_RE.finditer(text):
+            self.add(text[position:match.start()])
+            position = match.end()
+            start = self.offset
+            kind = match.lastgroup
+            if match.group("code") is not None:
+                self.add(match.group("code"))
+                self.entity("code", start)
+            elif match.group("link_url") is not None:
+                url = match.group("link_url")
+                if not url.startswith(LINK_SCHEMES):
+                    self.add(match.group(0))
+                    continue
+                self.inline(match.group("link_text"))
+                self.entity("text_link", start, url=url)
+            elif kind in ("bold", "underscore_bold"):
+                self.inline(match.group(kind))
+                self.entity("bold", start)
+            elif kind == "strike":
+                self.inline(match.group(kind))
+                self.entity("strikethrough", start)
+            else:
+                self.inline(match.group(kind))
+                self.entity("italic", start)
+        self.add(text[position:])
+
+
+def _add_code(builder: _Builder, lines: List[str], language: str) -> None:
+    start = builder.offset
+    builder.add("\n".join(lines))
+    builder.entity("pre", start, language=language or None)
+
+
+def render_markdown(text: str) -> Tuple[str, List[MessageEntity]]:
+    """Turn model Markdown into plain text plus Telegram entities.
+
+    Handles code fences, inline code, bold, italic, strikethrough, links,
+    headings, bullet lists and quotes in one pass over the lines. Nothing is
+    escaped, so the result can't fail Telegram's Markdown parser; markup that
+    doesn't match is kept as literal text. Text without any markup skips
+    the parser entirely.
+    """
+    if not MARKUP_RE.search(text):
+        return text.strip(), []
+    builder = _Builder()
+    lines = text.strip().split("\n")
+    code: Optional[List[str]] = None
+    language = ""
+    quote_start: Optional[int] = None
+    for index, line in enumerate(lines):
+        newline = "\n" if index < len(lines) - 1 else ""
+        fence = FENCE_RE.match(line) if "```" in line else None
+        if code is not None:
+            if fence and not fence.group(1):
+                _add_code(builder, code, language)
+                code = None
+                builder.add(newline)
+            else:
+                code.append(line)
+            continue
+
+        quote = QUOTE_RE.match(line) if line.startswith(">") else None
+        if quote_start is not None and not quote:
+            builder.entity("blockquote", quote_start)
+            quote_start = None
+
+        if fence:
+            code, language = [], fence.group(1)
+            continue
+        if quote:
+            if quote_start is None:
+                quote_start = builder.offset
+            builder.inline(quote.group(1))
+            # Close the quote before its line break
+            if index == len(lines) - 1 or not lines[index + 1].startswith(">"):
+                builder.entity("blockquote", quote_start)
+                quote_start = None
+            builder.add(newline)
+            continue
+
+        marker = line.lstrip()[:1]
+        heading = HEADING_RE.match(line) if marker == "#" else None
+        bullet = BULLET_RE.match(line) if marker in ("-", "*", "+") else None
+        if heading:
+            start = builder.offset
+            builder.inline(heading.group(1))
+            builder.entity("bold", start)
+        elif bullet:
+            builder.add(f"{bullet.group(1)}• ")
+            builder.inline(bullet.group(2))
+        else:
+            builder.inline(line)
+        builder.add(newline)
+
+    if code is not None:
+        # Unterminated fence: the rest of the reply is code
+        _add_code(builder, code, language)
+
+    rendered = "".join(builder.parts)
+    stripped = rendered.rstrip()
+    end = utf16_len(stripped)
+    entities = []
+    for entity_type, offset, length, extra in sorted(builder.entities, key=lambda entity: (entity[1], -entity[2])):
+        length = min(length, end - offset)
+        if length > 0:
+            entities.append(MessageEntity(type=entity_type, offset=offset, length=length, **extra))
+    return stripped, entities
+
+
+if __name__ == "__main__":
+    # Benchmark against the MarkdownV2 escaper on a large model response:
+    #   python -m utils.markdown_entities
+    import timeit
+    from utils.telegram_utils import escape_markdown_v2
+
+    section = (
+        "## Section\n\nSome **bold** text, *italic* words, `inline code`, a [link](https://example.com) "
+        "and a snake_case_name with 3.14 (parentheses) - dashes!\n\n"
+        "- first item\n- second item with `code`\n\n"
+        "```python\ndef handler(message):\n    return message.text.split()[0]\n```\n\n"
+        "> quoted line\n\n"
+    )
+    plain = "A plain answer without any formatting, just sentences (and numbers like 3.14).\n\n"
+    runs = 20
+    for label, response in (("markdown", section * 200), ("plain", plain * (len(section) * 200 // len(plain)))):
+        for name, func in (("render_markdown", render_markdown), ("escape_markdown_v2", escape_markdown_v2)):
+            seconds = timeit.timeit(lambda: func(response), number=runs) / runs
+            print(f"{label:>8} {name:>20}: {seconds * 1000:.2f} ms per {len(response)} characters")
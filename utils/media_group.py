@@ -0,0 +1,136 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from utils.ttl_cache import TTLCache
+from utils.logging_config import logger
+
+
+@dataclass
+class MediaGroupItem:
+    """The parts of an album message the handlers actually need"""
+    message_id: int
+    photo: Tuple[Any, ...]
+    caption: Optional[str]
+
+
+@dataclass
+class MediaGroup:
+    anchor: Any  # first message of the album, used for replying
+    callback: Callable[[Any, List[MediaGroupItem]], Awaitable[None]]
+    first_seen: float
+    last_seen: float
+    items: List[MediaGroupItem] = field(default_factory=list)
+
+
+class MediaGroupCollector:
+    """Collect Telegram album parts and hand them over once the album is complete.
+
+    An album is flushed after a quiet period without new parts, or at the latest
+    max_wait seconds after its first part. The quiet period adapts to the
+    observed gap between parts. Flushed albums are evicted right away; their ids
+    are remembered briefly so late parts don't start a second reply.
+
+    Parts passed to observe() don't start an album themselves; they are kept
+    for a few seconds and join the album if a part passed to add() starts it.
+    """
+
+    def __init__(
+        self,
+        min_quiet: float = 0.3,
+        max_quiet: float = 1.5,
+        max_wait: float = 4.0,
+        max_pending: int = 1000,
+    ) -> None:
+        self.min_quiet = min_quiet
+        self.max_quiet = max_quiet
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.avg_gap = min_quiet
+        self.groups: Dict[str, MediaGroup] = {}
+        self.flushed = TTLCache(maxsize=max_pending, ttl=60)
+        self.strays = TTLCache(maxsize=max_pending, ttl=max_wait + max_quiet)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def quiet_period(self) -> float:
+        return min(self.max_quiet, max(self.min_quiet, self.avg_gap * 3))
+
+    def add(self, message: Any, callback: Callable[[Any, List[MediaGroupItem]], Awaitable[None]]) -> None:
+        """Add an album part; the callback of the first part is used for the whole album"""
+        group_id = message.media_group_id
+        if group_id in self.flushed:
+            logger.debug(f"Dropping late part of already processed media group {group_id}")
+            return
+
+        now = time.monotonic()
+        item = self._item(message)
+        group = self.groups.get(group_id)
+        if group is None:
+            if len(self.groups) >= self.max_pending:
+                # Bound memory: flush the oldest pending album early
+                oldest = min(self.groups, key=lambda key: self.groups[key].first_seen)
+                self._track(self._flush(oldest, self.groups.pop(oldest)))
+            items = self.strays.pop(group_id, []) + [item]
+            self.groups[group_id] = MediaGroup(anchor=message, callback=callback, first_seen=now, last_seen=now, items=items)
+            self._track(self._flush_when_quiet(group_id))
+            return
+        self._append(group, item, now)
+
+    def observe(self, message: Any) -> None:
+        """Add an album part that should not start an album on its own"""
+        group_id = message.media_group_id
+        if group_id in self.flushed:
+            return
+        item = self._item(message)
+        group = self.groups.get(group_id)
+        if group is not None:
+            self._append(group, item, time.monotonic())
+            return
+        strays = self.strays.get(group_id)
+        if strays is None:
+            self.strays.set(group_id, [item])
+        else:
+            strays.append(item)
+
+    @staticmethod
+    def _item(message: Any) -> MediaGroupItem:
+        return MediaGroupItem(
+            message_id=message.message_id,
+            photo=tuple(message.photo or ()),
+            caption=message.caption,
+        )
+
+    def _append(self, group: MediaGroup, item: MediaGroupItem, now: float) -> None:
+        self.avg_gap = 0.8 * self.avg_gap + 0.2 * (now - group.last_seen)
+        group.last_seen = now
+        group.items.append(item)
+
+    def _track(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_when_quiet(self, group_id: str) -> None:
+        while group_id in self.groups:
+            group = self.groups[group_id]
+            deadline = min(group.last_seen + self.quiet_period, group.first_seen + self.max_wait)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await self._flush(group_id, self.groups.pop(group_id))
+                return
+            await asyncio.sleep(remaining)
+
+    async def _flush(self, group_id: str, group: MediaGroup) -> None:
+        self.flushed.set(group_id, True)
+        group.items.sort(key=lambda item: item.message_id)
+        logger.debug(f"Flushing media group {group_id} with {len(group.items)} parts")
+        try:
+            await group.callback(group.anchor, group.items)
+        except Exception as e:
+            logger.error(f"Error processing media group {group_id}: {e}", exc_info=True)
+
+    async def drain(self) -> None:
+        """Wait for all pending albums to be flushed"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -1,8 +1,46 @@
 from prometheus_client import Histogram, Gauge, Counter
 
 ig_session_age_seconds = Gauge(
-    "ig_session_age_seconds", "Age of current Instagram session")
+    "ig_session_age_seconds", "Age of current Instagram session", ["account"])
 ig_login_duration_seconds = Histogram(
     "ig_login_duration_seconds", "Duration of Instagram login")
 ig_login_errors_total = Counter(
     "ig_login_errors_total", "Number of Instagram login errors")
+
+insta_queue_depth = Gauge(
+    "insta_queue_depth", "Instagram download jobs waiting for a worker")
+insta_jobs_running = Gauge(
+    "insta_jobs_running", "Instagram download jobs currently running")
+insta_job_wait_seconds = Histogram(
+    "insta_job_wait_seconds", "Time Instagram jobs spend queued")
+insta_job_duration_seconds = Histogram(
+    "insta_job_duration_seconds", "Duration of Instagram download jobs",
+    ["stage", "status"], buckets=(1, 2.5, 5, 10, 20, 40, 80, 160))
+insta_download_bytes_total = Counter(
+    "insta_download_bytes_total", "Bytes of Instagram videos downloaded from the CDN", ["mode"])
+insta_download_throughput_bytes = Histogram(
+    "insta_download_throughput_bytes", "Throughput of Instagram CDN downloads in bytes per second",
+    ["mode"], buckets=(2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7))
+insta_download_segments = Histogram(
+    "insta_download_segments", "Byte range segments per Instagram CDN download",
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+insta_transcode_seconds = Histogram(
+    "insta_transcode_seconds", "Duration of transcoding Instagram videos to the upload limit",
+    ["status"], buckets=(5, 10, 20, 40, 80, 160, 320, 640))
+
+telegram_send_wait_seconds = Histogram(
+    "telegram_send_wait_seconds", "Time outgoing Telegram messages wait for the flood limits",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+telegram_send_seconds = Histogram(
+    "telegram_send_seconds", "Duration of Telegram send requests", ["method"])
+telegram_retry_after_total = Counter(
+    "telegram_retry_after_total", "Telegram sends answered with retry_after")
+
+telegram_duplicate_updates_total = Counter(
+    "telegram_duplicate_updates_total", "Telegram updates dropped because they were already handled")
+
+update_stream_delay_seconds = Histogram(
+    "update_stream_delay_seconds", "Time updates spend in the Redis stream before a worker handles them",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+update_stream_recovered_total = Counter(
+    "update_stream_recovered_total", "Updates taken over from the pending list of a crashed worker")
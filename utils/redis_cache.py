@@ -0,0 +1,53 @@
+from typing import Any, Optional
+from redis.asyncio.client import Redis
+from utils.singleflight import SingleFlight
+from utils.ttl_cache import TTLCache
+from utils.logging_config import logger
+
+
+class RedisTTLCache:
+    """A local TTLCache in front of an optional Redis shared between replicas.
+
+    Keys live under prefix in Redis; Redis hits are copied into the local
+    LRU, and Redis failures are logged and treated as misses. Values are
+    strings unless a subclass overrides dumps and loads. Concurrent work for
+    the same key can be collapsed with flights.
+    """
+
+    def __init__(self, redis: Optional[Redis], prefix: str, maxsize: int, ttl: int) -> None:
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.flights = SingleFlight()
+
+    @staticmethod
+    def dumps(value: Any) -> str:
+        return value
+
+    @staticmethod
+    def loads(raw: Any) -> Any:
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None or self.redis is None:
+            return value
+        try:
+            raw = await self.redis.get(f"{self.prefix}:{key}")
+        except Exception as e:
+            logger.warning(f"Redis lookup in {self.prefix} cache failed: {e}")
+            return None
+        if raw is None:
+            return None
+        value = self.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+        if self.redis is not None:
+            try:
+                await self.redis.set(f"{self.prefix}:{key}", self.dumps(value), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Redis store in {self.prefix} cache failed: {e}")
@@ -0,0 +1,206 @@
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable, List, TypeVar, Union
+from aiogram.exceptions import TelegramRetryAfter
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE_PER_MIN, TELEGRAM_CHAT_BURST, TELEGRAM_SEND_RETRIES,
+)
+from utils.ttl_cache import TTLCache
+from utils.markdown_entities import render_markdown, utf16_len
+from utils.metrics import telegram_send_wait_seconds, telegram_send_seconds, telegram_retry_after_total
+from utils.logging_config import logger
+
+T = TypeVar("T")
+
+# Telegram's limit for one text message, counted in UTF-16 code units
+MESSAGE_LIMIT = 4096
+FENCE_RE = re.compile(r"^```")
+
+
+class TokenBucket:
+    """Tokens refill at rate per second up to capacity; waiters are served in order"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        # Holding the lock while sleeping keeps the waiters in FIFO order
+        async with self._lock:
+            tokens = min(tokens, self.capacity)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate if self.tokens < tokens else 0.0)
+                if wait <= 0:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for a while, e.g. after Telegram answered with retry_after"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SendScheduler:
+    """Pace outgoing Telegram messages below the flood limits.
+
+    Every send takes a token from its chat's bucket (about one message per
+    second in private chats, 20 per minute in groups) and then from the
+    global bucket (about 30 per second for the whole bot). A TelegramRetryAfter
+    pauses the chat for the time Telegram asked for and the send is retried.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 group_rate_per_min: float = TELEGRAM_GROUP_RATE_PER_MIN, chat_burst: int = TELEGRAM_CHAT_BURST,
+                 retries: int = TELEGRAM_SEND_RETRIES) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_min / 60
+        self.chat_burst = chat_burst
+        self.retries = retries
+        # An idle bucket refills long before it expires, so dropping it loses nothing
+        self.chats = TTLCache(maxsize=100_000, ttl=3600)
+
+    def bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            # Groups and channels have negative ids (or an @username)
+            group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if group else self.chat_rate, self.chat_burst)
+        self.chats.set(chat_id, bucket)
+        return bucket
+
+    async def run(self, chat_id: Union[int, str], send: Callable[[], Awaitable[T]], method: str = "send", messages: int = 1) -> T:
+        """Send once the chat and global limits allow it; messages is how many messages the call creates"""
+        bucket = self.bucket(chat_id)
+        for attempt in range(self.retries + 1):
+            queued = time.monotonic()
+            await bucket.acquire(messages)
+            await self.global_bucket.acquire(messages)
+            started = time.monotonic()
+            telegram_send_wait_seconds.observe(started - queued)
+            try:
+                return await send()
+            except TelegramRetryAfter as e:
+                telegram_retry_after_total.inc()
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Telegram asked to retry {method} to chat {chat_id} after {e.retry_after}s")
+                bucket.pause(e.retry_after)
+            finally:
+                telegram_send_seconds.labels(method=method).observe(time.monotonic() - started)
+
+
+def _blocks(text: str) -> List[str]:
+    """Split text into paragraphs, keeping fenced code blocks whole"""
+    blocks: List[str] = []
+    current: List[str] = []
+    in_code = False
+    for line in text.split("\n"):
+        stripped = line.strip()
+        # A line like ```code``` opens and closes on its own
+        if FENCE_RE.match(stripped) and stripped.count("```") % 2 == 1:
+            if not in_code and current:
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+            if in_code:
+                blocks.append("\n".join(current))
+                current = []
+            in_code = not in_code
+        elif not in_code and not line.strip():
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+        else:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_hard(text: str, limit: int) -> List[str]:
+    """Split on the last newline or space before the limit, or mid-word if there is none"""
+    pieces = []
+    while utf16_len(text) > limit:
+        # Characters outside the BMP count twice, so cut on the UTF-16 length
+        cut = limit
+        while (excess := utf16_len(text[:cut]) - limit) > 0:
+            cut -= excess
+        window = text[:cut]
+        split_at = window.rfind("\n")
+        if split_at <= 0:
+            split_at = window.rfind(" ")
+        if split_at <= 0:
+            pieces.append(window)
+            text = text[cut:]
+        else:
+            # Drop only the separator, so indentation of code survives
+            pieces.append(window[:split_at])
+            text = text[split_at + 1:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def _split_block(block: str, limit: int) -> List[str]:
+    if utf16_len(block) <= limit:
+        return [block]
+    lines = block.split("\n")
+    if not FENCE_RE.match(lines[0].strip()):
+        return _split_hard(block, limit)
+    # Close and reopen the fence in every piece of a long code block
+    opening = lines[0].strip()
+    closing = "```" if len(lines) > 1 and FENCE_RE.match(lines[-1].strip()) else ""
+    body = "\n".join(lines[1:-1] if closing else lines[1:])
+    room = limit - utf16_len(opening) - len("\n\n```")
+    return [f"{opening}\n{piece}\n```" for piece in _split_hard(body, room)]
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split text into messages of at most limit UTF-16 units, on paragraph and code block boundaries"""
+    if utf16_len(text) <= limit:
+        return [text]
+    chunks: List[str] = []
+    current = ""
+    for block in _blocks(text):
+        for piece in _split_block(block, limit):
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if utf16_len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def answer_long(message, text: str, as_reply: bool = False, **kwargs: Any) -> List[Any]:
+    """Send model Markdown as one or more formatted messages; the send scheduler paces them"""
+    send = message.reply if as_reply else message.answer
+    sent = []
+    for chunk in split_message(text):
+        # Formatting goes out as entities, so there is no parse mode that could reject the text
+        rendered, entities = render_markdown(chunk)
+        if not rendered:
+            # Telegram rejects empty messages; keep markup that rendered to nothing (e.g. an empty fence) as text
+            rendered, entities = chunk.strip(), []
+            if not rendered:
+                continue
+        chunk = rendered
+        if entities:
+            sent.append(await send(chunk, entities=entities, parse_mode=None, **kwargs))
+        else:
+            sent.append(await send(chunk, **kwargs))
+    return sent
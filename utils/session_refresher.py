@@ -1,16 +1,146 @@
 import asyncio
+import random
+from typing import Dict, Optional, Tuple
+from redis.exceptions import LockError
 from utils.redis_client import RedisClient
-from utils.session_store import IgSessionStore
-from clients.ig_client import IgClient
+from utils.session_store import IgSessionStore, LOCK_KEY
+from utils.settings import IG_SESSION_REFRESH_HOURS, IG_SESSION_CHECK_INTERVAL_SEC
+from utils.metrics import ig_session_age_seconds
+from managers.ig_account_pool import IgAccountPool
+from managers.ig_session_manager import IgSessionManager
 from utils.logging_config import logger
 
 
+class IgSessionRefresher:
+    """Renew Instagram sessions in the background before they expire.
+
+    One replica is elected leader through the ig:session:lock key and logs in
+    again once a session gets close to IG_SESSION_REFRESH_HOURS; every account
+    gets its own jittered deadline so logins don't happen in bursts. The leader
+    also loads missing sessions up front, so users rarely wait for a login,
+    but leaves accounts alone while they cool down; a failed login starts a
+    cool-down itself. The other replicas never log in: they only pick up
+    sessions from the session store.
+    """
+
+    def __init__(self, pool: IgAccountPool, interval: float = IG_SESSION_CHECK_INTERVAL_SEC,
+                 refresh_after: float = IG_SESSION_REFRESH_HOURS * 3600) -> None:
+        self.pool = pool
+        self.store = pool.store
+        self.interval = interval
+        self.refresh_after = refresh_after
+        self._deadlines: Dict[Tuple[str, Optional[float]], float] = {}
+        self._leader_lock = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._leader_lock is not None:
+            try:
+                await self._leader_lock.release()
+            except LockError:
+                pass
+            self._leader_lock = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.warning(f"Instagram session refresh round failed: {e}")
+            await asyncio.sleep(self.interval * random.uniform(0.8, 1.2))
+
+    async def is_leader(self) -> bool:
+        """Hold ig:session:lock across rounds; without Redis this process is the only one"""
+        if self.store is None:
+            return True
+        try:
+            if self._leader_lock is not None:
+                await self._leader_lock.reacquire()
+                return True
+            lock = self.store.redis.lock(LOCK_KEY, timeout=self.interval * 3)
+            if await lock.acquire(blocking=False):
+                logger.info("Became the Instagram session refresh leader")
+                self._leader_lock = lock
+                return True
+        except LockError:
+            logger.info("Lost Instagram session refresh leadership")
+            self._leader_lock = None
+        return False
+
+    def _deadline(self, sessions: IgSessionManager) -> float:
+        """Refresh somewhere between 75% and 90% of the refresh period, fixed per session"""
+        key = (sessions.name, sessions.saved_at)
+        if key not in self._deadlines:
+            self._deadlines = {k: v for k, v in self._deadlines.items() if k[0] != sessions.name}
+            self._deadlines[key] = self.refresh_after * random.uniform(0.75, 0.9)
+        return self._deadlines[key]
+
+    async def tick(self) -> None:
+        leader = await self.is_leader()
+        try:
+            cooling = await self.pool.state.cooling_down(self.pool.accounts)
+        except Exception as e:
+            logger.warning(f"Failed to read IG account cool-downs: {e}")
+            cooling = set(self.pool.accounts)
+        for sessions in self.pool.accounts.values():
+            try:
+                if sessions.leases:
+                    # Replacing the session would pull it from under a running request
+                    logger.debug(f"Instagram account {sessions.name} is in use, checking it next round")
+                elif not leader:
+                    await sessions.sync_from_store()
+                elif sessions.name in cooling:
+                    # Logging in again right after a rejection is what gets accounts flagged
+                    logger.debug(f"Instagram account {sessions.name} is cooling down, checking it next round")
+                elif not sessions.loaded:
+                    await sessions.ensure_session()
+                elif self._due(sessions):
+                    await self.refresh(sessions)
+            except Exception as e:
+                logger.warning(f"Refreshing Instagram session of {sessions.name} failed: {e}")
+                if leader:
+                    await self._cool_down(sessions)
+            if sessions.age is not None:
+                ig_session_age_seconds.labels(account=sessions.name).set(sessions.age)
+
+    async def _cool_down(self, sessions: IgSessionManager) -> None:
+        try:
+            await self.pool.state.set_cooldown(sessions.name, self.pool.cooldown)
+        except Exception as e:
+            logger.warning(f"Failed to cool down IG account {sessions.name}: {e}")
+
+    def _due(self, sessions: IgSessionManager) -> bool:
+        if not sessions.username or not sessions.password:
+            # Cookie-only sessions can't be renewed by logging in
+            return False
+        return sessions.age is not None and sessions.age >= self._deadline(sessions)
+
+    async def refresh(self, sessions: IgSessionManager) -> None:
+        logger.info(f"Refreshing Instagram session of {sessions.name} (age: {sessions.age})")
+        await sessions.relogin()
+
+
 async def main() -> None:
     redis = RedisClient().get_master()
     store = IgSessionStore(redis)
-    client = IgClient(store)
-    await client.login()
-    logger.info("Instagram session refreshed")
+    pool = IgAccountPool(store)
+    refresher = IgSessionRefresher(pool)
+    for sessions in pool.accounts.values():
+        if not sessions.password:
+            continue
+        try:
+            await refresher.refresh(sessions)
+            logger.info(f"Instagram session of {sessions.name} refreshed")
+        except Exception as e:
+            logger.error(f"Failed to refresh Instagram session of {sessions.name}: {e}")
     await redis.close()
 
 
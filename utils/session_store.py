@@ -1,12 +1,30 @@
 import json
-from typing import Optional
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
 from redis.asyncio.client import Redis
 from utils.settings import IG_SESSION_REFRESH_HOURS
 
 SESSION_KEY = "ig:session:{username}"
 LOCK_KEY = "ig:session:lock"
+ACCOUNT_LOCK_KEY = "ig:session:lock:{username}"
+LEASE_KEY = "ig:lease:{username}"
+COOLDOWN_KEY = "ig:cooldown:{username}"
+BUDGET_KEY = "ig:budget:{username}:{window}"
+LRU_KEY = "ig:accounts:lru"
 TTL = IG_SESSION_REFRESH_HOURS * 3600 + 1800
 
+# Leases of an account are members of a sorted set scored by their expiry, so
+# several can be held at once and a crashed holder's lease simply runs out
+ACQUIRE_LEASE_SCRIPT = """
+redis.call("zremrangebyscore", KEYS[1], "-inf", ARGV[1])
+if redis.call("zcard", KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call("zadd", KEYS[1], ARGV[2], ARGV[4])
+redis.call("pexpire", KEYS[1], ARGV[5])
+return 1
+"""
+
 
 class IgSessionStore:
     def __init__(self, redis: Redis) -> None:
@@ -25,10 +43,109 @@ class IgSessionStore:
             ex=TTL,
         )
 
+    async def delete_session(self, username: str) -> None:
+        await self.redis.delete(SESSION_KEY.format(username=username))
+
     async def touch(self, username: str) -> None:
         await self.redis.expire(SESSION_KEY.format(username=username), TTL)
 
-    async def acquire_lock(self):
-        lock = self.redis.lock(LOCK_KEY, timeout=300)
+    async def acquire_lock(self, username: Optional[str] = None):
+        key = ACCOUNT_LOCK_KEY.format(username=username) if username else LOCK_KEY
+        lock = self.redis.lock(key, timeout=300)
         await lock.acquire()
         return lock
+
+    # Account pool state, shared by all replicas
+
+    async def acquire_lease(self, username: str, lease_id: str, ttl_ms: int, limit: int) -> bool:
+        now_ms = int(time.time() * 1000)
+        return bool(await self.redis.eval(ACQUIRE_LEASE_SCRIPT, 1, LEASE_KEY.format(username=username),
+                                          now_ms, now_ms + ttl_ms, limit, lease_id, ttl_ms))
+
+    async def refresh_lease(self, username: str, lease_id: str, ttl_ms: int) -> bool:
+        """Push back the expiry of a held lease; False if it already ran out"""
+        key = LEASE_KEY.format(username=username)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {lease_id: int(time.time() * 1000) + ttl_ms}, xx=True, ch=True)
+            pipe.pexpire(key, ttl_ms)
+            changed, _ = await pipe.execute()
+        return bool(changed)
+
+    async def release_lease(self, username: str, lease_id: str) -> None:
+        await self.redis.zrem(LEASE_KEY.format(username=username), lease_id)
+
+    async def set_cooldown(self, username: str, seconds: int) -> None:
+        await self.redis.set(COOLDOWN_KEY.format(username=username), "1", ex=seconds)
+
+    async def cooling_down(self, usernames: Iterable[str]) -> Set[str]:
+        usernames = list(usernames)
+        values = await self.redis.mget([COOLDOWN_KEY.format(username=username) for username in usernames])
+        return {username for username, value in zip(usernames, values) if value is not None}
+
+    async def consume_budget(self, username: str, limit: int, window: int) -> bool:
+        """Count one request against the account's budget for the current window"""
+        key = BUDGET_KEY.format(username=username, window=int(time.time() // window))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, window)
+            count, _ = await pipe.execute()
+        return count <= limit
+
+    async def last_used(self, usernames: Iterable[str]) -> Dict[str, float]:
+        usernames = list(usernames)
+        scores = await self.redis.zmscore(LRU_KEY, usernames)
+        return {username: score or 0.0 for username, score in zip(usernames, scores)}
+
+    async def mark_used(self, username: str) -> None:
+        await self.redis.zadd(LRU_KEY, {username: time.time()})
+
+
+class LocalIgAccountState:
+    """In-process stand-in for the account pool state of IgSessionStore (no Redis)"""
+
+    def __init__(self) -> None:
+        self.leases: Dict[str, Dict[str, float]] = {}
+        self.cooldowns: Dict[str, float] = {}
+        self.budgets: Dict[str, Tuple[int, int]] = {}
+        self.used: Dict[str, float] = {}
+
+    async def acquire_lease(self, username: str, lease_id: str, ttl_ms: int, limit: int) -> bool:
+        now = time.monotonic()
+        leases = {held: expiry for held, expiry in self.leases.get(username, {}).items() if expiry > now}
+        self.leases[username] = leases
+        if len(leases) >= limit:
+            return False
+        leases[lease_id] = now + ttl_ms / 1000
+        return True
+
+    async def refresh_lease(self, username: str, lease_id: str, ttl_ms: int) -> bool:
+        leases = self.leases.get(username, {})
+        now = time.monotonic()
+        if leases.get(lease_id, 0) <= now:
+            return False
+        leases[lease_id] = now + ttl_ms / 1000
+        return True
+
+    async def release_lease(self, username: str, lease_id: str) -> None:
+        self.leases.get(username, {}).pop(lease_id, None)
+
+    async def set_cooldown(self, username: str, seconds: int) -> None:
+        self.cooldowns[username] = time.monotonic() + seconds
+
+    async def cooling_down(self, usernames: Iterable[str]) -> Set[str]:
+        now = time.monotonic()
+        return {username for username in usernames if self.cooldowns.get(username, 0) > now}
+
+    async def consume_budget(self, username: str, limit: int, window: int) -> bool:
+        current = int(time.time() // window)
+        budget_window, count = self.budgets.get(username, (current, 0))
+        if budget_window != current:
+            count = 0
+        self.budgets[username] = (current, count + 1)
+        return count + 1 <= limit
+
+    async def last_used(self, usernames: Iterable[str]) -> Dict[str, float]:
+        return {username: self.used.get(username, 0.0) for username in usernames}
+
+    async def mark_used(self, username: str) -> None:
+        self.used[username] = time.time()
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional, Tuple
 
 
 def _int_env(name: str, default: int) -> int:
@@ -9,12 +9,41 @@ def _int_env(name: str, default: int) -> int:
         return default
 
 
+def _accounts_env(name: str) -> List[Tuple[str, Optional[str]]]:
+    accounts = []
+    for item in os.getenv(name, "").split(","):
+        username, _, password = item.strip().partition(":")
+        if username:
+            accounts.append((username, password or None))
+    return accounts
+
+
 IG_USERNAME: Optional[str] = os.getenv("IG_USERNAME")
 IG_PASSWORD: Optional[str] = os.getenv("IG_PASSWORD")
 
+# Account pool as user:password,user2:password2; IG_USERNAME is always part of it
+IG_ACCOUNTS = _accounts_env("IG_ACCOUNTS")
+if IG_USERNAME and all(username != IG_USERNAME for username, _ in IG_ACCOUNTS):
+    IG_ACCOUNTS.insert(0, (IG_USERNAME, IG_PASSWORD))
+
 REDIS_SENTINEL_HOSTS = os.getenv("REDIS_SENTINEL_HOSTS", "")
 REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 
 IG_SESSION_REFRESH_HOURS = _int_env("IG_SESSION_REFRESH_HOURS", 12)
 IG_LOGIN_TIMEOUT_SEC = _int_env("IG_LOGIN_TIMEOUT_SEC", 30)
+
+IG_SESSIONID: Optional[str] = os.getenv("IG_SESSIONID")
+IG_CSRFTOKEN: Optional[str] = os.getenv("IG_CSRFTOKEN")
+IG_DS_USER_ID: Optional[str] = os.getenv("IG_DS_USER_ID")
+
+IG_HTTP_MAX_CONNECTIONS = _int_env("IG_HTTP_MAX_CONNECTIONS", 10)
+IG_HTTP_TIMEOUT_SEC = _int_env("IG_HTTP_TIMEOUT_SEC", 15)
+INSTALOADER_SESSION_FILE: Optional[str] = os.getenv("INSTALOADER_SESSION_FILE")
+
+IG_ACCOUNT_HOURLY_BUDGET = _int_env("IG_ACCOUNT_HOURLY_BUDGET", 60)
+IG_ACCOUNT_COOLDOWN_SEC = _int_env("IG_ACCOUNT_COOLDOWN_SEC", 600)
+IG_LEASE_TTL_SEC = _int_env("IG_LEASE_TTL_SEC", 120)
+IG_LEASE_WAIT_SEC = _int_env("IG_LEASE_WAIT_SEC", 30)
+IG_LEASES_PER_ACCOUNT = _int_env("IG_LEASES_PER_ACCOUNT", 1)
+IG_SESSION_CHECK_INTERVAL_SEC = _int_env("IG_SESSION_CHECK_INTERVAL_SEC", 300)
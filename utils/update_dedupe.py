@@ -0,0 +1,36 @@
+from typing import Optional
+from redis.asyncio.client import Redis
+from config import UPDATE_DEDUPE_TTL, UPDATE_DEDUPE_SIZE
+from utils.ttl_cache import TTLCache
+from utils.logging_config import logger
+
+CLAIM_KEY = "tgupdate:{bot_id}:{update_id}"
+
+
+class UpdateDedupe:
+    """Remember which Telegram updates were taken so each is handled once.
+
+    The first replica to claim an update id wins a Redis SET NX; ids seen by
+    this process are kept in a local LRU so repeats never reach Redis.
+    Without Redis, or when it fails, only the local LRU is consulted, so an
+    outage can let a duplicate through but never drops an update.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, ttl: int = UPDATE_DEDUPE_TTL, size: int = UPDATE_DEDUPE_SIZE) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=size, ttl=ttl)
+
+    async def claim(self, bot_id: int, update_id: int) -> bool:
+        """True if this is the first time the update is seen"""
+        key = CLAIM_KEY.format(bot_id=bot_id, update_id=update_id)
+        if key in self.local:
+            return False
+        self.local.set(key, True)
+        if self.redis is None:
+            return True
+        try:
+            return bool(await self.redis.set(key, 1, nx=True, ex=self.ttl))
+        except Exception as e:
+            logger.warning(f"Update dedupe Redis claim failed: {e}")
+            return True
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import signal
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from redis.asyncio.client import Redis
+from redis.exceptions import ResponseError
+from config import (
+    UPDATE_STREAM_SHARDS, UPDATE_STREAM_MAXLEN, UPDATE_STREAM_CLAIM_IDLE, UPDATE_STREAM_READ_AHEAD, BOT_MAX_CONCURRENT_UPDATES,
+)
+from utils.metrics import update_stream_delay_seconds, update_stream_recovered_total
+from utils.logging_config import logger
+
+STREAM_KEY = "tgupdates:{shard}"
+GROUP = "workers"
+READ_COUNT = 100
+# Stays below the 5 second socket timeout of the Redis connections
+READ_BLOCK_MS = 2000
+
+
+def worker_shards(index: int, count: int, shards: int = UPDATE_STREAM_SHARDS) -> List[int]:
+    """Shards consumed by worker index of count"""
+    return [shard for shard in range(shards) if shard % count == index]
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _entries(raw) -> List[Tuple[str, Optional[Dict[str, str]]]]:
+    # Entries trimmed from the stream come back from the pending list without fields
+    return [
+        (_decode(entry_id), {_decode(k): _decode(v) for k, v in fields.items()} if fields else None)
+        for entry_id, fields in raw or []
+    ]
+
+
+class UpdateStream:
+    """One Redis stream of raw updates per shard; a sender always lands in the same shard"""
+
+    def __init__(self, redis: Redis, shards: int = UPDATE_STREAM_SHARDS, maxlen: int = UPDATE_STREAM_MAXLEN) -> None:
+        self.redis = redis
+        self.shards = shards
+        self.maxlen = maxlen
+
+    def shard(self, sender_id: int) -> int:
+        return sender_id % self.shards
+
+    @staticmethod
+    def key(shard: int) -> str:
+        return STREAM_KEY.format(shard=shard)
+
+    async def publish(self, sender_id: int, update: str) -> None:
+        await self.redis.xadd(self.key(self.shard(sender_id)), {"sender": sender_id, "update": update},
+                              maxlen=self.maxlen, approximate=True)
+
+    async def ensure_group(self, shard: int) -> None:
+        try:
+            await self.redis.xgroup_create(self.key(shard), GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+
+class UpdateWorker:
+    """Handle the updates of some shards through the dispatcher, in order per sender.
+
+    Every shard is read with XREADGROUP by one consumer. Updates of different
+    senders run concurrently (up to concurrency at once), updates of one sender
+    wait for the previous one without holding a slot, so a busy sender can't
+    stall the others. At most read_ahead updates are held, running or waiting.
+    An update is acknowledged once handled, so after a crash it stays pending:
+    a worker restarted under the same name reads its own pending updates
+    first, and updates left by a consumer that doesn't come back are taken
+    over with XAUTOCLAIM once idle for claim_idle seconds.
+    """
+
+    def __init__(self, stream: UpdateStream, dp, bot, shards: List[int], consumer: str,
+                 concurrency: int = BOT_MAX_CONCURRENT_UPDATES, claim_idle: float = UPDATE_STREAM_CLAIM_IDLE,
+                 read_ahead: int = UPDATE_STREAM_READ_AHEAD) -> None:
+        self.stream = stream
+        self.redis = stream.redis
+        self.dp = dp
+        self.bot = bot
+        self.shards = shards
+        self.consumer = consumer
+        self.claim_idle = claim_idle
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.backlog = asyncio.Semaphore(max(1, concurrency, read_ahead))
+        # Last update of every sender still in flight, which the next one waits for
+        self.senders: Dict[int, asyncio.Task] = {}
+        self.inflight: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self._stopped = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    async def run(self, handle_signals: bool = True) -> None:
+        """Consume until stop() or SIGINT/SIGTERM, then let the started updates finish"""
+        loop = asyncio.get_running_loop()
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self.stop)
+        for shard in self.shards:
+            await self.stream.ensure_group(shard)
+        logger.info(f"Worker {self.consumer} consuming shards {self.shards}")
+        readers = [asyncio.create_task(self._consume(self.stream.key(shard))) for shard in self.shards]
+        try:
+            await self._stopped.wait()
+        finally:
+            if handle_signals:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            # Whatever doesn't finish stays pending and is recovered on restart
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _consume(self, key: str) -> None:
+        recovered = False
+        claimed_at = 0.0
+        while True:
+            try:
+                if not recovered:
+                    await self._read_own_pending(key)
+                    recovered = True
+                if time.monotonic() - claimed_at >= self.claim_idle:
+                    await self._claim(key)
+                    claimed_at = time.monotonic()
+                raw = await self.redis.xreadgroup(GROUP, self.consumer, {key: ">"}, count=READ_COUNT, block=READ_BLOCK_MS)
+                for entry_id, fields in _entries(raw[0][1] if raw else None):
+                    await self._dispatch(key, entry_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Reading {key} failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _read_own_pending(self, key: str) -> None:
+        """Updates delivered to this consumer name before a restart but never acknowledged"""
+        last_id = "0"
+        while True:
+            raw = await self.redis.xreadgroup(GROUP, self.consumer, {key: last_id}, count=READ_COUNT)
+            entries = _entries(raw[0][1] if raw else None)
+            if not entries:
+                return
+            for entry_id, fields in entries:
+                update_stream_recovered_total.inc()
+                await self._dispatch(key, entry_id, fields)
+            last_id = entries[-1][0]
+
+    async def _claim(self, key: str) -> None:
+        start = "0-0"
+        while True:
+            result = await self.redis.xautoclaim(key, GROUP, self.consumer, int(self.claim_idle * 1000),
+                                                 start_id=start, count=READ_COUNT)
+            start = _decode(result[0])
+            for entry_id, fields in _entries(result[1]):
+                # Our own slow updates go idle too; they are running already
+                if entry_id in self.inflight:
+                    continue
+                update_stream_recovered_total.inc()
+                logger.info(f"Took over update {entry_id} of {key}")
+                await self._dispatch(key, entry_id, fields)
+            if start == "0-0":
+                return
+
+    async def _dispatch(self, key: str, entry_id: str, fields: Optional[Dict[str, str]]) -> None:
+        if entry_id in self.inflight:
+            return
+        if not fields or "update" not in fields:
+            await self.redis.xack(key, GROUP, entry_id)
+            return
+        await self.backlog.acquire()
+        self.inflight.add(entry_id)
+        sender_id = int(fields["sender"])
+        task = asyncio.create_task(self._handle(key, entry_id, sender_id, fields["update"], self.senders.get(sender_id)))
+        self.senders[sender_id] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, key: str, entry_id: str, sender_id: int, update: str, previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self.slots:
+                # Stream ids start with the millisecond they were added
+                update_stream_delay_seconds.observe(max(0.0, time.time() - int(entry_id.split("-")[0]) / 1000))
+                try:
+                    await self.dp.feed_raw_update(self.bot, json.loads(update))
+                except Exception as e:
+                    # Acknowledged anyway: an update that always fails must not block its sender
+                    logger.error(f"Error handling update {entry_id} of {key}: {e}", exc_info=True)
+                try:
+                    await self.redis.xack(key, GROUP, entry_id)
+                except Exception as e:
+                    logger.warning(f"Failed to acknowledge update {entry_id} of {key}: {e}")
+        finally:
+            self.inflight.discard(entry_id)
+            self.backlog.release()
+            if self.senders.get(sender_id) is asyncio.current_task():
+                del self.senders[sender_id]
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio.client import Redis
+from config import USAGE_FLUSH_INTERVAL, USAGE_RETENTION_DAYS
+from utils.logging_config import logger
+
+# (user_id, chat_id) of the update currently being handled, set by UsageContextMiddleware
+usage_context: ContextVar[Tuple[Optional[int], Optional[int]]] = ContextVar("usage_context", default=(None, None))
+
+HASH_KEY = "usage:{day}:{scope}:{id}"
+TOP_KEY = "usage:{day}:top:{scope}"
+SCOPES = ("user", "chat", "model")
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _oldest_kept_day() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() - USAGE_RETENTION_DAYS * 86400))
+
+
+class UsageLedger:
+    """Aggregate token usage in memory and flush it to Redis in batches.
+
+    Recording never touches the network; a background task periodically writes
+    the accumulated deltas with a single pipelined round trip. Without Redis the
+    totals are kept in process so the admin report still works.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None) -> None:
+        self.redis = redis
+        self._hashes: Dict[str, Counter] = defaultdict(Counter)
+        self._scores: Dict[str, Counter] = defaultdict(Counter)
+        self._local_hashes: Dict[str, Counter] = defaultdict(Counter)
+        self._local_scores: Dict[str, Counter] = defaultdict(Counter)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, provider: str, model: str, usage: Dict[str, int], images: int = 0) -> None:
+        user_id, chat_id = usage_context.get()
+        day = _today()
+        model_id = f"{provider}/{model}"
+        metrics = {
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "images": images,
+            "requests": 1,
+        }
+        total_tokens = metrics["input_tokens"] + metrics["output_tokens"]
+
+        for scope, scope_id in (("user", user_id), ("chat", chat_id), ("model", model_id)):
+            if scope_id is None:
+                continue
+            key = HASH_KEY.format(day=day, scope=scope, id=scope_id)
+            for metric, value in metrics.items():
+                if not value:
+                    continue
+                field = metric if scope == "model" else f"{model_id}:{metric}"
+                self._hashes[key][field] += value
+            self._scores[TOP_KEY.format(day=day, scope=scope)][str(scope_id)] += total_tokens
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._hashes and not self._scores:
+            return
+        hashes, self._hashes = self._hashes, defaultdict(Counter)
+        scores, self._scores = self._scores, defaultdict(Counter)
+
+        if self.redis is None:
+            for key, fields in hashes.items():
+                self._local_hashes[key].update(fields)
+            for key, members in scores.items():
+                self._local_scores[key].update(members)
+            self._prune_local()
+            return
+
+        ttl = USAGE_RETENTION_DAYS * 86400
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, fields in hashes.items():
+                    for field, value in fields.items():
+                        pipe.hincrby(key, field, value)
+                    pipe.expire(key, ttl)
+                for key, members in scores.items():
+                    for member, value in members.items():
+                        pipe.zincrby(key, value, member)
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            logger.debug(f"Flushed usage for {len(hashes)} keys to Redis")
+        except Exception as e:
+            logger.warning(f"Failed to flush usage to Redis, will retry: {e}")
+            # Merge the deltas back so they are retried on the next flush
+            for key, fields in hashes.items():
+                self._hashes[key].update(fields)
+            for key, members in scores.items():
+                self._scores[key].update(members)
+
+    def _prune_local(self) -> None:
+        """Forget days past the retention window, as the Redis keys expire"""
+        oldest = _oldest_kept_day()
+        for counters in (self._local_hashes, self._local_scores):
+            # Keys look like usage:<day>:..., and ISO dates compare as strings
+            for key in [key for key in counters if key.split(":", 2)[1] < oldest]:
+                del counters[key]
+
+    async def top_consumers(self, scope: str, day: Optional[str] = None, limit: int = 10) -> List[Tuple[str, int, Dict[str, int]]]:
+        """Return (id, total tokens, per-field totals) for the biggest consumers of a day"""
+        day = day or _today()
+        await self.flush()
+        top_key = TOP_KEY.format(day=day, scope=scope)
+
+        if self.redis is None:
+            ranked = self._local_scores[top_key].most_common(limit)
+            return [
+                (member, int(score), dict(self._local_hashes[HASH_KEY.format(day=day, scope=scope, id=member)]))
+                for member, score in ranked
+            ]
+
+        ranked = await self.redis.zrevrange(top_key, 0, limit - 1, withscores=True)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for member, _ in ranked:
+                member = member.decode() if isinstance(member, bytes) else member
+                pipe.hgetall(HASH_KEY.format(day=day, scope=scope, id=member))
+            details = await pipe.execute()
+
+        result = []
+        for (member, score), fields in zip(ranked, details):
+            member = member.decode() if isinstance(member, bytes) else member
+            fields = {
+                (k.decode() if isinstance(k, bytes) else k): int(v)
+                for k, v in fields.items()
+            }
+            result.append((member, int(score), fields))
+        return result
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from config import INSTA_UPLOAD_LIMIT_MB, INSTA_TRANSCODE_WORKERS, INSTA_TRANSCODE_THREADS, INSTA_TRANSCODE_TIMEOUT
+from utils.metrics import insta_transcode_seconds
+from utils.logging_config import logger
+
+AUDIO_BITRATE = 128_000
+# Room for the container and the encoder overshooting its target
+SIZE_HEADROOM = 0.92
+MIN_VIDEO_BITRATE = 150_000
+# (minimum video bitrate, largest short side) pairs; lower bitrates get fewer pixels
+SHORT_SIDE_LADDER = ((2_500_000, 1080), (1_200_000, 720), (600_000, 480), (0, 360))
+THUMBNAIL_SIZE = 320
+
+
+@dataclass
+class VideoInfo:
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+@dataclass
+class TranscodedVideo:
+    path: str
+    info: VideoInfo
+    thumbnail: Optional[str] = None
+
+
+def plan_encode(size_limit: int, duration: float, short_side: Optional[int], attempt: int = 0) -> Tuple[int, Optional[int]]:
+    """Pick the video bitrate and the short side to scale down to (None to keep it) that fit size_limit bytes.
+
+    Every retry aims 15% lower in case the encoder overshot.
+    """
+    total_bitrate = size_limit * 8 * SIZE_HEADROOM * (0.85 ** attempt) / max(duration, 1.0)
+    video_bitrate = max(MIN_VIDEO_BITRATE, int(total_bitrate - AUDIO_BITRATE))
+    max_short_side = next(limit for floor, limit in SHORT_SIDE_LADDER if video_bitrate >= floor)
+    if short_side is not None and short_side <= max_short_side:
+        max_short_side = None
+    return video_bitrate, max_short_side
+
+
+def parse_probe(output: str) -> VideoInfo:
+    """Read duration and dimensions from ffprobe's JSON output"""
+    data = json.loads(output or "{}")
+    info = VideoInfo()
+    duration = (data.get("format") or {}).get("duration")
+    if duration:
+        info.duration = float(duration)
+    for stream in data.get("streams") or []:
+        if stream.get("codec_type") == "video":
+            info.width, info.height = stream.get("width"), stream.get("height")
+            break
+    return info
+
+
+class VideoTranscoder:
+    """Shrink videos that are too large for the Bot API upload limit with ffmpeg.
+
+    Each ffmpeg run is its own process; a semaphore caps how many run at once
+    and -threads how many cores each may use, so transcodes can't take the CPU
+    away from the bot. Files that already fit are returned untouched, and
+    without ffmpeg on the PATH nothing is transcoded at all.
+    """
+
+    def __init__(self, size_limit: int = INSTA_UPLOAD_LIMIT_MB * 1024 * 1024, workers: int = INSTA_TRANSCODE_WORKERS,
+                 threads: int = INSTA_TRANSCODE_THREADS, timeout: float = INSTA_TRANSCODE_TIMEOUT) -> None:
+        self.size_limit = size_limit
+        self.threads = threads
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max(1, workers))
+        self.available = shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+        if not self.available:
+            logger.warning("ffmpeg is not installed; videos over the upload limit will not be transcoded")
+
+    def fits(self, path: str) -> bool:
+        return os.path.getsize(path) <= self.size_limit
+
+    async def fit(self, path: str) -> Optional[TranscodedVideo]:
+        """Return a transcoded copy of path that fits the upload limit, or None if path fits already or can't be shrunk"""
+        if self.fits(path) or not self.available:
+            return None
+        async with self.semaphore:
+            started = time.monotonic()
+            status = "error"
+            try:
+                result = await self._transcode(path)
+                status = "ok" if result else "too_large"
+                return result
+            except Exception as e:
+                logger.error(f"Transcoding {path} failed: {e}")
+                return None
+            finally:
+                insta_transcode_seconds.labels(status=status).observe(time.monotonic() - started)
+
+    async def probe(self, path: str) -> VideoInfo:
+        output = await self._run([
+            "ffprobe", "-v", "error", "-print_format", "json", "-show_format",
+            "-show_entries", "stream=codec_type,width,height", path,
+        ])
+        return parse_probe(output)
+
+    async def _transcode(self, path: str) -> Optional[TranscodedVideo]:
+        source = await self.probe(path)
+        if not source.duration:
+            logger.warning(f"Cannot transcode {path}: unknown duration")
+            return None
+        output = f"{os.path.splitext(path)[0]}.small.mp4"
+        portrait = bool(source.width and source.height and source.width < source.height)
+        short_side = min(source.width, source.height) if source.width and source.height else None
+        for attempt in range(2):
+            video_bitrate, max_short_side = plan_encode(self.size_limit, source.duration, short_side, attempt)
+            logger.info(f"Transcoding {path} to {video_bitrate // 1000} kbit/s" + (f", {max_short_side}p" if max_short_side else ""))
+            args = [
+                "ffmpeg", "-y", "-v", "error", "-i", path, "-threads", str(self.threads),
+                "-c:v", "libx264", "-preset", "veryfast", "-b:v", str(video_bitrate),
+                "-maxrate", str(video_bitrate), "-bufsize", str(video_bitrate * 2),
+                "-c:a", "aac", "-b:a", str(AUDIO_BITRATE),
+                # moov atom first, so Telegram clients can start playing before the download ends
+                "-movflags", "+faststart",
+            ]
+            if max_short_side:
+                args += ["-vf", f"scale={max_short_side}:-2" if portrait else f"scale=-2:{max_short_side}"]
+            await self._run(args + [output])
+            if self.fits(output):
+                break
+        else:
+            os.remove(output)
+            logger.warning(f"Could not transcode {path} below {self.size_limit} bytes")
+            return None
+
+        info = await self.probe(output)
+        return TranscodedVideo(path=output, info=info, thumbnail=await self._thumbnail(output, info))
+
+    async def _thumbnail(self, path: str, info: VideoInfo) -> Optional[str]:
+        thumbnail = f"{os.path.splitext(path)[0]}.jpg"
+        offset = min(1.0, (info.duration or 0) / 2)
+        try:
+            await self._run([
+                "ffmpeg", "-y", "-v", "error", "-ss", f"{offset:.2f}", "-i", path, "-frames:v", "1",
+                "-vf", f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease", "-q:v", "5", thumbnail,
+            ])
+        except Exception as e:
+            logger.warning(f"Failed to create thumbnail for {path}: {e}")
+            return None
+        return thumbnail
+
+    async def _run(self, args: List[str]) -> str:
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"{args[0]} exited with {process.returncode}: {stderr.decode(errors='replace').strip()[-500:]}")
+        return stdout.decode()
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import re
+from typing import Any, Dict, Optional, Sequence
+from redis.asyncio.client import Redis
+from config import VISION_CACHE_SIZE, VISION_CACHE_TTL
+from utils.redis_cache import RedisTTLCache
+
+CACHE_KEY = "{model}:{digest}"
+DESCRIPTION_MAX_CHARS = 300
+
+
+def normalize_caption(caption: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", caption.strip().lower()).rstrip(" ?!.")
+
+
+def compact_description(answer: str) -> str:
+    """Shorten an answer to a compact description usable as history context"""
+    text = re.sub(r"\s+", " ", answer).strip()
+    if len(text) <= DESCRIPTION_MAX_CHARS:
+        return text
+    cut = text[:DESCRIPTION_MAX_CHARS]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if sentence_end > DESCRIPTION_MAX_CHARS // 2:
+        return cut[:sentence_end + 1]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+class VisionCache(RedisTTLCache):
+    """Cache vision answers by image file_unique_id, caption and model.
+
+    Entries live in a local LRU and, when Redis is configured, are shared
+    between replicas.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None) -> None:
+        super().__init__(redis, "vision", maxsize=VISION_CACHE_SIZE, ttl=VISION_CACHE_TTL)
+
+    @staticmethod
+    def make_key(model: str, file_unique_ids: Sequence[str], caption: str) -> str:
+        raw = "|".join(file_unique_ids) + "|" + normalize_caption(caption)
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return CACHE_KEY.format(model=model, digest=digest)
+
+    @staticmethod
+    def dumps(entry: Dict[str, str]) -> str:
+        return json.dumps(entry, ensure_ascii=False)
+
+    @staticmethod
+    def loads(raw: Any) -> Dict[str, str]:
+        return json.loads(raw)
+
+    async def set(self, key: str, answer: str) -> Dict[str, str]:
+        entry = {"answer": answer, "description": compact_description(answer)}
+        await super().set(key, entry)
+        return entry
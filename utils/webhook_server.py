@@ -0,0 +1,82 @@
+import asyncio
+import signal
+from typing import Optional
+from urllib.parse import urlparse
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONNECTIONS,
+)
+from utils.logging_config import logger
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def build_webhook_app(bot: Bot, dp: Dispatcher, flux_client=None, path: str = WEBHOOK_PATH,
+                      secret: Optional[str] = WEBHOOK_SECRET, background: bool = True) -> web.Application:
+    """aiohttp app serving Telegram updates, the Flux callback, /healthz and /metrics.
+
+    With background, updates are acknowledged right away and handled in the
+    background, so a slow model call never holds up Telegram's connection.
+    Without it an update is handled (for the ingress: published) before the
+    response, one after another per connection.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=background, secret_token=secret).register(app, path=path)
+    if flux_client is not None and flux_client.scheduler.webhook_url:
+        app.router.add_post(urlparse(flux_client.scheduler.webhook_url).path or "/", flux_client.handle_webhook)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, dp: Dispatcher) -> None:
+    url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    try:
+        await bot.set_webhook(
+            url,
+            secret_token=WEBHOOK_SECRET,
+            # Telegram doesn't send update types that no router handles
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    except TelegramRetryAfter:
+        # Several replicas starting together: one of them has just set it
+        logger.info("setWebhook is rate limited; another replica registered the webhook")
+        return
+    logger.info(f"Registered Telegram webhook at {url}")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, flux_client=None, background: bool = True) -> None:
+    """Serve the webhook app until SIGINT or SIGTERM.
+
+    The webhook is left registered on shutdown: other replicas behind the
+    load balancer keep serving it.
+    """
+    app = build_webhook_app(bot, dp, flux_client, background=background)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        await set_webhook(bot, dp)
+        await stopped.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        # Also runs the dispatcher shutdown hooks and closes the bot session
+        await runner.cleanup()